@@ -0,0 +1,161 @@
+""" Admission control, limiting how much of the service each owner can use.
+
+The service runs on a single reactor in front of a shared backend, so a
+single owner that sends many requests, or runs several full listings at
+once, slows down every other owner's requests too. Requests are checked
+before any backend work is done for them, and rejected requests get a
+``429`` response with a ``Retry-After`` header.
+"""
+
+from functools import partial
+
+from zope.interface import implementer
+
+from go_store_service.interfaces import AdmissionRejected, IAdmissionControl
+
+
+def _released():
+    pass
+
+
+class TokenBucket(object):
+    """
+    A bucket of tokens that refills at a steady rate. Each request takes a
+    token, so requests are limited to ``rate`` a second on average, with
+    bursts of up to ``burst`` requests.
+
+    :param float rate:
+        Number of tokens added per second.
+    :param float burst:
+        Maximum number of tokens the bucket holds. It starts full.
+    :param float now:
+        The current time, in seconds.
+    """
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+    def take(self, now):
+        """
+        Take a token.
+
+        :returns:
+            ``0`` if a token was taken, otherwise the number of seconds until
+            one will be available.
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / float(self.rate)
+
+
+@implementer(IAdmissionControl)
+class OwnerAdmissionControl(object):
+    """
+    Admission control that limits each owner's request rate and number of
+    concurrent listings.
+
+    Limits are kept in memory, so they apply to each process separately.
+
+    :param float rate:
+        Number of requests per second each owner may make on average, or
+        ``None`` for no limit.
+    :param float burst:
+        Number of requests each owner may make at once after being idle.
+        Defaults to one second's worth of requests, and is at least one.
+    :param int max_listings:
+        Maximum number of listings each owner may have in progress at once,
+        or ``None`` for no limit.
+    :param float listing_retry_after:
+        Number of seconds clients that hit ``max_listings`` are told to wait.
+        We can't tell when a listing will finish, so this is a guess.
+    :param reactor:
+        Used to tell the time. Defaults to the global reactor.
+    """
+
+    DEFAULT_LISTING_RETRY_AFTER = 1
+
+    def __init__(self, rate=None, burst=None, max_listings=None,
+                 listing_retry_after=None, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        if rate is not None and burst is None:
+            burst = rate
+        if burst is not None:
+            burst = max(burst, 1)
+        if listing_retry_after is None:
+            listing_retry_after = self.DEFAULT_LISTING_RETRY_AFTER
+        self.rate = rate
+        self.burst = burst
+        self.max_listings = max_listings
+        self.listing_retry_after = listing_retry_after
+        self.reactor = reactor
+        self._buckets = {}
+        self._next_prune = None
+        self._listings = {}
+
+    def _forget_full_buckets(self, now):
+        """
+        Forget the buckets of owners that have been idle long enough for
+        their buckets to fill up, since a new bucket would be the same. This
+        is done at most once per refill period, so it doesn't cost much.
+        """
+        if self._next_prune is not None and now < self._next_prune:
+            return
+        self._next_prune = now + self.burst / float(self.rate)
+        for owner_id, bucket in self._buckets.items():
+            if bucket.is_full(now):
+                del self._buckets[owner_id]
+
+    def _take_token(self, owner_id, now):
+        self._forget_full_buckets(now)
+        bucket = self._buckets.get(owner_id)
+        if bucket is None:
+            bucket = self._buckets[owner_id] = TokenBucket(
+                self.rate, self.burst, now)
+        return bucket.take(now)
+
+    def listings(self, owner_id):
+        """
+        Return the number of listings an owner has in progress.
+        """
+        return self._listings.get(owner_id, 0)
+
+    def _release_listing(self, owner_id):
+        count = self._listings[owner_id] - 1
+        if count:
+            self._listings[owner_id] = count
+        else:
+            del self._listings[owner_id]
+
+    def admit(self, owner_id, listing=False):
+        limit_listings = listing and self.max_listings is not None
+        # This is checked first so that rejected listings don't use up
+        # tokens.
+        if limit_listings and self.listings(owner_id) >= self.max_listings:
+            raise AdmissionRejected(
+                "Too many listings in progress for %r." % (owner_id,),
+                "listings", self.listing_retry_after)
+        if self.rate is not None:
+            retry_after = self._take_token(owner_id, self.reactor.seconds())
+            if retry_after:
+                raise AdmissionRejected(
+                    "Too many requests for %r." % (owner_id,), "rate",
+                    retry_after)
+        if not limit_listings:
+            return _released
+        self._listings[owner_id] = self.listings(owner_id) + 1
+        return partial(self._release_listing, owner_id)
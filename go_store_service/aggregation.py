@@ -0,0 +1,142 @@
+""" Counting and summing objects, optionally grouped by a field.
+
+An aggregation counts the objects it's given and sums the values of some of
+their fields. If it has a ``group_by`` field, objects are grouped by the
+value of that field and each group is counted and summed separately. For
+example, aggregating::
+
+    {"status": "paid", "amount": 5}
+    {"status": "paid", "amount": 2.5}
+    {"amount": 1}
+
+with ``group_by="status"`` and ``sums=["amount"]`` gives::
+
+    [{"group": None, "count": 1, "sum": {"amount": 1}},
+     {"group": "paid", "count": 2, "sum": {"amount": 7.5}}]
+
+Fields are dotted paths into an object's data, as for queries. Objects that
+don't have the ``group_by`` field are grouped under ``None``. Only numbers
+are summed, other values (including booleans) are ignored.
+"""
+
+import json
+
+from go_store_service.query import MISSING, lookup
+
+
+def _split_path(path):
+    names = path.split(".")
+    if not all(names):
+        raise ValueError("Invalid path: %r" % (path,))
+    return names
+
+
+def _is_number(value):
+    return (isinstance(value, (int, long, float)) and
+            not isinstance(value, bool))
+
+
+class Aggregation(object):
+    """
+    A description of how to aggregate objects.
+
+    :param str group_by:
+        Path to the field to group objects by, or ``None`` to put all
+        objects in a single group.
+    :param list sums:
+        Paths to the fields to sum.
+
+    :raises ValueError:
+        If a path is invalid.
+    """
+
+    def __init__(self, group_by=None, sums=()):
+        self.group_by = group_by
+        self.sums = list(sums)
+        self._group_names = None
+        if group_by is not None:
+            self._group_names = _split_path(group_by)
+        self._sum_names = [(path, _split_path(path)) for path in self.sums]
+
+    def __repr__(self):
+        return "<Aggregation group_by=%r sums=%r>" % (
+            self.group_by, self.sums)
+
+    def aggregator(self):
+        """
+        Return an :class:`Aggregator` for this aggregation.
+        """
+        return Aggregator(self)
+
+    def aggregate(self, datas):
+        """
+        Aggregate the data of many objects in one pass.
+
+        :param datas:
+            Iterable of object data. The data isn't modified or copied.
+        :returns:
+            A list of results. See :meth:`Aggregator.results`.
+        """
+        aggregator = self.aggregator()
+        for data in datas:
+            aggregator.add(data)
+        return aggregator.results()
+
+    def _group(self, data):
+        if self._group_names is None:
+            return None
+        value = lookup(data, self._group_names)
+        if value is MISSING:
+            return None
+        return value
+
+
+class Aggregator(object):
+    """
+    Accumulates the results of an :class:`Aggregation` as objects are added.
+    Only group values and running totals are kept, so objects can be
+    discarded once they've been added.
+    """
+
+    def __init__(self, aggregation):
+        self.aggregation = aggregation
+        # Groups by the canonical JSON encoding of the group value, because
+        # group values may be unhashable.
+        self._groups = {}
+        if aggregation.group_by is None:
+            self._new_group(None, None)
+
+    def _new_group(self, key, value):
+        group = self._groups[key] = {
+            "group": value,
+            "count": 0,
+            "sum": dict((path, 0) for path in self.aggregation.sums),
+        }
+        return group
+
+    def add(self, data):
+        """
+        Add an object's data to the results.
+        """
+        value = self.aggregation._group(data)
+        key = None
+        if value is not None:
+            key = json.dumps(value, sort_keys=True)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._new_group(key, value)
+        group["count"] += 1
+        sums = group["sum"]
+        for path, names in self.aggregation._sum_names:
+            value = lookup(data, names)
+            if _is_number(value):
+                sums[path] += value
+
+    def results(self):
+        """
+        Return a list of ``{"group": ..., "count": ..., "sum": {...}}``
+        dicts, one per group, ordered by encoded group value. Aggregations
+        without ``group_by`` always have exactly one result, with a group of
+        ``None``.
+        """
+        return [self._groups[key] for key in sorted(self._groups)]
@@ -2,11 +2,31 @@
 """
 
 import json
+import math
+from functools import partial
+from io import BytesIO
+from itertools import islice
 
-from twisted.internet.defer import maybeDeferred, inlineCallbacks
+from twisted.internet.defer import (
+    Deferred, maybeDeferred, inlineCallbacks, returnValue, succeed)
+from twisted.internet.interfaces import IPushProducer
 from twisted.python import log
+from zope.interface import implementer
 
-from cyclone.web import RequestHandler, Application, URLSpec, HTTPError
+from cyclone.web import (
+    RequestHandler, Application, URLSpec, HTTPError, ChunkedTransferEncoding)
+
+from go_store_service.aggregation import Aggregation
+from go_store_service.compression import (
+    CompressedContentEncoding, parse_accept)
+from go_store_service.encoding import (
+    JSON_CONTENT_TYPE, MSGPACK_CONTENT_TYPE, RawJson, frame, iter_frames,
+    json_dumps, msgpack_available, msgpack_dumps, msgpack_loads,
+    object_version)
+from go_store_service.interfaces import (
+    AdmissionRejected, ObjectNotFound, SchemaViolation, VersionConflict)
+from go_store_service.projection import parse_fields
+from go_store_service.query import Query
 
 
 def ensure_deferred(x):
@@ -36,12 +56,253 @@ def create_urlspec_regex(dfn, *args, **kw):
     return "/".join(parts)
 
 
+def parse_etags(header):
+    """
+    Parse the value of an ``If-Match`` or ``If-None-Match`` header into a
+    list of entity tags, with quotes and weak indicators removed. Returns
+    ``None`` if the header is ``*``.
+    """
+    if header.strip() == '*':
+        return None
+    etags = []
+    for etag in header.split(','):
+        etag = etag.strip()
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        etags.append(etag.strip('"'))
+    return etags
+
+
+def negotiate_content_type(header):
+    """
+    Return the content type objects in a response should be encoded as,
+    given the request's ``Accept`` header.
+
+    MessagePack is only used if it is available and the client prefers it
+    to JSON. Otherwise JSON is used.
+    """
+    for media_type in parse_accept(header):
+        if media_type == MSGPACK_CONTENT_TYPE and msgpack_available():
+            return MSGPACK_CONTENT_TYPE
+        if media_type in (JSON_CONTENT_TYPE, "application/*", "*/*"):
+            return JSON_CONTENT_TYPE
+    return JSON_CONTENT_TYPE
+
+
+@implementer(IPushProducer)
+class StreamProducer(object):
+    """
+    Push producer for tracking whether a transport is accepting writes.
+
+    The transport pauses this producer when its write buffer fills up and
+    resumes it once the buffer has drained. Writers should wait on
+    :meth:`wait` before producing more data.
+    """
+
+    def __init__(self):
+        self.stopped = False
+        self._paused = None
+
+    def wait(self):
+        """
+        Return a deferred that fires once the producer isn't paused.
+        """
+        if self._paused is None:
+            return succeed(None)
+        d = Deferred()
+        self._paused.addCallback(lambda r: d.callback(r))
+        return d
+
+    def pauseProducing(self):
+        if self._paused is None:
+            self._paused = Deferred()
+
+    def resumeProducing(self):
+        paused, self._paused = self._paused, None
+        if paused is not None:
+            paused.callback(None)
+
+    def stopProducing(self):
+        self.stopped = True
+        self.resumeProducing()
+
+
 class BaseHandler(RequestHandler):
     """
     Base class for utility methods for :class:`CollectionHandler`
     and :class:`ElementHandler`.
     """
 
+    # Number of streamed objects to buffer before flushing the response.
+    stream_flush_count = 100
+
+    # Route definition used to label metrics for this handler.
+    route = None
+
+    # Counters used for metrics.
+    bytes_written = 0
+    objects_written = 0
+
+    # HTTP methods that read a whole collection, which admission control
+    # may limit separately.
+    listing_methods = ()
+
+    _response_type = None
+    _release_admission = None
+
+    def prepare(self):
+        """
+        Check with the application's admission control that the request may
+        be handled, and send a ``429`` response if it may not. Requests to
+        routes without an ``owner_id`` aren't checked.
+
+        Subclasses that override this must call it before doing anything
+        else.
+        """
+        admission = getattr(self.application, "admission", None)
+        owner_id = (self.path_kwargs or {}).get("owner_id")
+        if admission is None or owner_id is None:
+            return
+        listing = self.request.method in self.listing_methods
+        try:
+            self._release_admission = admission.admit(owner_id, listing)
+        except AdmissionRejected as e:
+            self._reject(e)
+
+    def _reject(self, rejection):
+        self.application.record_rejection(self, rejection)
+        # 429 isn't in httplib.responses, so HTTPError can't be used for it.
+        self.set_status(429, reason="Too Many Requests")
+        self.set_header(
+            "Retry-After", str(max(1, int(math.ceil(rejection.retry_after)))))
+        # Finishing the request here stops the handler method being called.
+        self.finish({"success": False, "reason": str(rejection)})
+
+    def on_finish(self):
+        if self._release_admission is not None:
+            release, self._release_admission = self._release_admission, None
+            release()
+
+    def response_type(self):
+        """
+        Return the content type objects in the response are encoded as. See
+        :func:`negotiate_content_type`.
+        """
+        if self._response_type is None:
+            self._response_type = negotiate_content_type(
+                self.request.headers.get("Accept", ""))
+        return self._response_type
+
+    def request_is_msgpack(self):
+        """
+        Return ``True`` if the request body is MessagePack encoded.
+
+        :raises HTTPError:
+            If the request body is MessagePack encoded but MessagePack isn't
+            available.
+        """
+        content_type = self.request.headers.get("Content-Type", "")
+        content_type = content_type.split(";")[0].strip().lower()
+        if content_type != MSGPACK_CONTENT_TYPE:
+            return False
+        if not msgpack_available():
+            raise HTTPError(415, reason="MessagePack is not supported.")
+        return True
+
+    def get_fields(self):
+        """
+        Return the field paths given in the ``fields`` query parameter, or
+        ``None`` if there isn't one. See
+        :func:`go_store_service.projection.parse_fields`.
+
+        :raises HTTPError:
+            If the fields are invalid.
+        """
+        fields = self.get_argument("fields", None)
+        if fields is None:
+            return None
+        try:
+            return parse_fields(fields)
+        except ValueError:
+            raise HTTPError(400, reason="Invalid fields.")
+
+    def get_query(self):
+        """
+        Return the query given in the ``query`` parameters, or ``None`` if
+        there aren't any. See :meth:`go_store_service.query.Query.parse`.
+
+        :raises HTTPError:
+            If the query is invalid.
+        """
+        conditions = self.get_arguments("query")
+        if not conditions:
+            return None
+        try:
+            return Query.parse(conditions)
+        except ValueError:
+            raise HTTPError(400, reason="Invalid query.")
+
+    def decode(self, data):
+        """
+        Decode an object sent in the request body, using the request's
+        content type.
+
+        :raises ValueError:
+            If the data can't be decoded.
+        """
+        if self.request_is_msgpack():
+            return msgpack_loads(data)
+        return json.loads(data)
+
+    def encode(self, obj):
+        """
+        Encode a dict or :class:`RawJson` object using the response's content
+        type, and set the response's ``Content-Type`` header.
+
+        Dicts are encoded as JSON using the fastest available encoder and
+        :class:`RawJson` objects are written out as JSON without being
+        re-encoded.
+        """
+        content_type = self.response_type()
+        self.set_header("Content-Type", content_type)
+        self.set_header("Vary", "Accept")
+        if content_type == MSGPACK_CONTENT_TYPE:
+            if isinstance(obj, RawJson):
+                obj = obj.decode()
+            return msgpack_dumps(obj)
+        if isinstance(obj, RawJson):
+            return obj.encoded
+        return json_dumps(obj)
+
+    def write(self, chunk):
+        """
+        Write a chunk to the output buffer.
+
+        Dicts and :class:`RawJson` objects are encoded with :meth:`encode`.
+        Other chunks are handled by :meth:`RequestHandler.write`.
+        """
+        if isinstance(chunk, (dict, RawJson)):
+            chunk = self.encode(chunk)
+        RequestHandler.write(self, chunk)
+
+    def write_framed(self, obj):
+        """
+        Write an object out as one of several objects in the response.
+
+        JSON objects are followed by a newline. MessagePack objects are
+        prefixed with their length, see
+        :func:`go_store_service.encoding.frame`.
+        """
+        if self.response_type() == MSGPACK_CONTENT_TYPE:
+            self.write(frame(self.encode(obj)))
+        else:
+            self.write(obj)
+            self.write("\n")
+
+    def flush(self, include_footers=False):
+        self.bytes_written += sum(len(part) for part in self._write_buffer)
+        return RequestHandler.flush(self, include_footers=include_footers)
+
     def raise_err(self, failure, status_code, reason):
         """
         Log the failure and raise a suitable :class:`HTTPError`.
@@ -54,26 +315,51 @@ class BaseHandler(RequestHandler):
         :param str reason:
             HTTP reason to return along with the status.
         """
+        if failure.check(HTTPError):
+            # This has already been turned into a suitable HTTP error.
+            failure.raiseException()
         log.err(failure)
         # TODO: write out a JSON error response.
         raise HTTPError(status_code, reason=reason)
 
-    def write_object(self, obj):
+    def catch_err(self, failure, error_class, status_code, reason):
         """
-        Write a serializable object out as JSON.
+        Raise a suitable :class:`HTTPError` for failures of a particular type.
+        Other failures are passed through unchanged.
+
+        :type failure: twisted.python.failure.Failure
+        :param failure:
+            failure that caused the error.
+        :param error_class:
+            exception class to catch.
+        :param int status_code:
+            HTTP status code to return.
+        :param str reason:
+            HTTP reason to return along with the status.
+        """
+        failure.trap(error_class)
+        raise HTTPError(status_code, reason=reason)
+
+    def write_object(self, obj, framed=False):
+        """
+        Write a serializable object out as JSON or MessagePack.
 
         :param dict obj:
-            JSON serializable object to write out.
+            JSON serializable object, or :class:`RawJson` object, to write
+            out.
+        :param bool framed:
+            If ``True``, the object is written with :meth:`write_framed`.
         """
         d = ensure_deferred(obj)
-        d.addCallback(self.write)
+        d.addCallback(self.write_framed if framed else self.write)
         d.addErrback(self.raise_err, 500, "Failed to write object")
         return d
 
     @inlineCallbacks
     def write_objects(self, objs):
         """
-        Write out a list of serialable objects as newline separated JSON.
+        Write out a list of serialable objects as newline separated JSON, or
+        length-prefixed MessagePack.
 
         :param list objs:
             List of dictionaries to write out.
@@ -83,8 +369,47 @@ class BaseHandler(RequestHandler):
             obj = yield obj_deferred
             if obj is None:
                 continue
-            yield self.write_object(obj)
-            self.write("\n")
+            yield self.write_object(obj, framed=True)
+
+    @inlineCallbacks
+    def stream_objects(self, objs):
+        """
+        Stream out a list of serializable objects as newline separated JSON,
+        or length-prefixed MessagePack.
+
+        The response is flushed (using chunked transfer encoding) every
+        :attr:`stream_flush_count` objects and no further objects are fetched
+        while the transport's write buffer is full, so only a bounded part
+        of the response is held in memory at once.
+
+        :param list objs:
+            List of dictionaries to write out.
+        """
+        producer = StreamProducer()
+        transport = self.request.connection.transport
+        transport.registerProducer(producer, True)
+        try:
+            objs = iter((yield objs))
+            buffered = 0
+            while True:
+                yield producer.wait()
+                if producer.stopped:
+                    break
+                try:
+                    obj_deferred = next(objs)
+                except StopIteration:
+                    break
+                obj = yield obj_deferred
+                if obj is None:
+                    continue
+                yield self.write_object(obj, framed=True)
+                self.objects_written += 1
+                buffered += 1
+                if buffered >= self.stream_flush_count:
+                    self.flush()
+                    buffered = 0
+        finally:
+            transport.unregisterProducer()
 
 
 # TODO: Sort out response metadata and make responses follow a consistent
@@ -97,29 +422,83 @@ class CollectionHandler(BaseHandler):
     Methods supported:
 
     * ``GET /`` - return a list of items in the collection.
+    * ``GET /?limit=:limit&cursor=:cursor`` - return a page of items in the
+      collection. If there are more pages, the cursor for the next page is
+      returned in the ``X-Next-Cursor`` header.
     * ``POST /`` - add an item to the collection.
+
+    ``GET`` requests may include a ``fields`` parameter with a comma
+    separated list of field paths (e.g. ``fields=name,address.city``) to
+    only return those fields of each item's data.
+
+    * ``GET /?query=:condition&query=:condition`` - return the items whose
+      data matches all the given conditions, e.g. ``status == "active"``.
+      See :mod:`go_store_service.query`. Queries can't be paged.
+
+    Listings don't have an ``ETag`` and don't support ``If-None-Match``.
+    They're streamed out as items are loaded, and the ``ETag`` header would
+    have to be sent before the first item, so every item would have to be
+    loaded (or at least have its version checked) before anything could be
+    sent. That's a full listing's worth of reads for a ``304``, which saves
+    bandwidth but no backend work.
     """
 
+    listing_methods = ("GET",)
+
     @classmethod
     def mk_urlspec(cls, dfn, collection_factory):
         # TODO: docstring
         return URLSpec(create_urlspec_regex(dfn), cls,
-                       kwargs={"collection_factory": collection_factory})
+                       kwargs={"collection_factory": collection_factory,
+                               "route": dfn})
 
-    def initialize(self, collection_factory):
+    def initialize(self, collection_factory, route=None):
         self.collection_factory = collection_factory
+        self.route = route
 
     def prepare(self):
+        BaseHandler.prepare(self)
         kw = self.path_kwargs
         if kw is None:
             kw = {}
         self.collection = self.collection_factory(**kw)
 
+    def _parse_limit(self, limit):
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            raise HTTPError(400, reason="Invalid limit.")
+        return limit
+
+    def _stream_page(self, page):
+        objs, next_cursor = page
+        if next_cursor is not None:
+            self.set_header("X-Next-Cursor", next_cursor)
+        return self.stream_objects(objs)
+
     def get(self, *args, **kw):
         """
-        Return all elements from a collection.
+        Return all elements from a collection, or a page of elements if a
+        limit is given, or the elements that match a query if one is given.
         """
-        d = self.write_objects(self.collection.all())
+        fields = self.get_fields()
+        query = self.get_query()
+        limit = self.get_argument("limit", None)
+        if query is not None:
+            if limit is not None:
+                raise HTTPError(400, reason="Queries can't be paged.")
+            d = self.stream_objects(
+                self.collection.query(query, fields=fields))
+        elif limit is None:
+            d = self.stream_objects(self.collection.all(fields=fields))
+        else:
+            d = ensure_deferred(self.collection.page(
+                self._parse_limit(limit), self.get_argument("cursor", None),
+                fields=fields))
+            d.addErrback(self.catch_err, ValueError, 400, "Invalid cursor.")
+            d.addCallback(self._stream_page)
         d.addErrback(self.raise_err, 500, "Failed to retrieve object.")
         return d
 
@@ -127,13 +506,235 @@ class CollectionHandler(BaseHandler):
         """
         Create an element witin a collection.
         """
-        data = json.loads(self.request.body)
+        data = self.decode(self.request.body)
         d = self.collection.create(None, data)
         d.addCallback(self.write_object)
+        d.addErrback(self.catch_err, SchemaViolation, 400, "Schema violation.")
         d.addErrback(self.raise_err, 500, "Failed to create object.")
         return d
 
 
+class CollectionActionHandler(BaseHandler):
+    """
+    Base class for handlers for actions on a collection as a whole.
+
+    Subclasses should set :attr:`action` to the name of the action. Requests
+    to ``/:action`` within the collection will be routed to the handler.
+    """
+
+    action = None
+
+    @classmethod
+    def mk_urlspec(cls, dfn, collection_factory):
+        route = dfn + '/' + cls.action
+        return URLSpec(create_urlspec_regex(route), cls,
+                       kwargs={"collection_factory": collection_factory,
+                               "route": route})
+
+    def initialize(self, collection_factory, route=None):
+        self.collection_factory = collection_factory
+        self.route = route
+
+    def prepare(self):
+        BaseHandler.prepare(self)
+        kw = self.path_kwargs
+        if kw is None:
+            kw = {}
+        self.collection = self.collection_factory(**kw)
+
+
+class BatchGetHandler(CollectionActionHandler):
+    """
+    Handler for retrieving many elements from a collection at once.
+
+    Methods supported:
+
+    * ``POST /_batch_get`` - return the elements with the ids given in the
+      request body (a JSON or MessagePack list of ids). Elements that don't
+      exist are left out.
+    """
+
+    action = '_batch_get'
+
+    def _parse_ids(self):
+        try:
+            object_ids = self.decode(self.request.body)
+        except ValueError:
+            object_ids = None
+        if not (isinstance(object_ids, list) and all(
+                isinstance(i, basestring) for i in object_ids)):
+            raise HTTPError(400, reason="Expected a list of ids.")
+        return object_ids
+
+    def post(self, *args, **kw):
+        """
+        Retrieve many elements within a collection.
+        """
+        d = self.stream_objects(self.collection.get_many(self._parse_ids()))
+        d.addErrback(self.raise_err, 500, "Failed to retrieve objects.")
+        return d
+
+
+class CountHandler(CollectionActionHandler):
+    """
+    Handler for counting the elements in a collection.
+
+    Methods supported:
+
+    * ``GET /_count`` - return the number of elements in the collection, as
+      ``{"count": ...}``.
+    * ``GET /_count?query=:condition`` - return the number of elements
+      whose data matches the query.
+    """
+
+    action = '_count'
+    listing_methods = ("GET",)
+
+    def _write_count(self, count):
+        self.write({"count": count})
+
+    def get(self, *args, **kw):
+        """
+        Count the elements within a collection.
+        """
+        query = self.get_query()
+        d = ensure_deferred(self.collection.count(query))
+        d.addCallback(self._write_count)
+        d.addErrback(self.raise_err, 500, "Failed to count objects.")
+        return d
+
+
+class AggregateHandler(CollectionActionHandler):
+    """
+    Handler for counting and summing the elements in a collection.
+
+    Methods supported:
+
+    * ``GET /_aggregate?group_by=:field&sum=:field&sum=:field`` - count the
+      elements in the collection and sum the given fields of their data,
+      grouped by the value of the ``group_by`` field if it's given. Returns
+      ``{"groups": [...]}``, see
+      :meth:`go_store_service.aggregation.Aggregator.results`. Fields are
+      dotted paths, as for ``fields`` parameters.
+    * ``GET /_aggregate?query=:condition&...`` - only aggregate elements
+      whose data matches the query.
+    """
+
+    action = '_aggregate'
+    listing_methods = ("GET",)
+
+    def _parse_aggregation(self):
+        try:
+            return Aggregation(
+                group_by=self.get_argument("group_by", None),
+                sums=self.get_arguments("sum"))
+        except ValueError:
+            raise HTTPError(400, reason="Invalid aggregation.")
+
+    def _write_groups(self, groups):
+        self.write({"groups": groups})
+
+    def get(self, *args, **kw):
+        """
+        Aggregate the elements within a collection.
+        """
+        aggregation = self._parse_aggregation()
+        query = self.get_query()
+        d = ensure_deferred(self.collection.aggregate(aggregation, query))
+        d.addCallback(self._write_groups)
+        d.addErrback(self.raise_err, 500, "Failed to aggregate objects.")
+        return d
+
+
+class BulkHandler(CollectionActionHandler):
+    """
+    Handler for creating many elements within a collection at once.
+
+    Methods supported:
+
+    * ``POST /_bulk`` - create (or overwrite) the elements given in the
+      request body, one ``{"id": ..., "data": ...}`` JSON object per line.
+      If ``id`` is missing or ``null``, one is generated. A result is
+      returned for each line, as newline separated JSON.
+
+    MessagePack request bodies contain length-prefixed objects instead of
+    lines, see :func:`go_store_service.encoding.frame`.
+    """
+
+    action = '_bulk'
+
+    # Number of objects to parse and hand to the collection at once.
+    bulk_batch_size = 100
+
+    def _iter_batches(self):
+        if self.request_is_msgpack():
+            items = iter_frames(self.request.body)
+        else:
+            items = (
+                line for line in BytesIO(self.request.body) if line.strip())
+        while True:
+            batch = list(islice(items, self.bulk_batch_size))
+            if not batch:
+                break
+            yield batch
+
+    def _parse_item(self, item):
+        """
+        Parse a line or frame of the request body into an
+        ``(object_id, data)`` tuple, or ``None`` if it is invalid.
+        """
+        try:
+            obj = self.decode(item)
+        except ValueError:
+            return None
+        if not isinstance(obj, dict):
+            return None
+        object_id = obj.get("id")
+        if not (object_id is None or isinstance(object_id, basestring)):
+            return None
+        return (object_id, obj.get("data"))
+
+    def _format_result(self, result):
+        if result is None:
+            return {"success": False, "reason": "Invalid line."}
+        success, obj = result
+        if not success and obj.check(SchemaViolation):
+            return {"success": False, "reason": "Schema violation."}
+        if not success:
+            log.err(obj)
+            return {"success": False, "reason": "Failed to create object."}
+        return {"success": True, "id": obj["id"]}
+
+    @inlineCallbacks
+    def _write_results(self):
+        producer = StreamProducer()
+        transport = self.request.connection.transport
+        transport.registerProducer(producer, True)
+        try:
+            for batch in self._iter_batches():
+                yield producer.wait()
+                if producer.stopped:
+                    break
+                items = [self._parse_item(item) for item in batch]
+                created = yield self.collection.create_many(
+                    [item for item in items if item is not None])
+                created = iter(created)
+                for item in items:
+                    result = None if item is None else next(created)
+                    self.write_framed(self._format_result(result))
+                self.flush()
+        finally:
+            transport.unregisterProducer()
+
+    def post(self, *args, **kw):
+        """
+        Create many elements within a collection.
+        """
+        d = self._write_results()
+        d.addErrback(self.raise_err, 500, "Failed to create objects.")
+        return d
+
+
 class ElementHandler(BaseHandler):
     """
     Handler for operations on an element within a collection.
@@ -141,64 +742,301 @@ class ElementHandler(BaseHandler):
     Methods supported:
 
     * ``GET /:elem_id`` - retrieve an element.
-    * ``PUT /:elem_id`` - update an element.
+    * ``PUT /:elem_id`` - update an element. Returns ``404`` if the element
+      doesn't exist.
+    * ``PUT /:elem_id?blind=true`` - write an element without reading it
+      first, if the backend has seen it recently enough to write it safely.
+      Otherwise it's read first as usual, so missing elements still get a
+      ``404``. ``blind=false`` turns off blind updates on backends that make
+      them by default. Updates with an ``If-Match`` header are never
+      blind.
     * ``DELETE /:elem_id`` - delete an element.
+
+    Responses include the element's version in the ``ETag`` header. ``GET``
+    requests with a matching ``If-None-Match`` header get an empty ``304``
+    response, and ``PUT`` and ``DELETE`` requests with an ``If-Match``
+    header that doesn't match the element's current version get a ``412``
+    response.
+
+    ``GET`` requests may include a ``fields`` parameter to only return some
+    of the element's fields, as for :class:`CollectionHandler`. The ``ETag``
+    of a partial response is a hash of the response body rather than the
+    element's version.
     """
 
     @classmethod
     def mk_urlspec(cls, dfn, collection_factory):
-        return URLSpec(create_urlspec_regex(dfn + '/:elem_id'), cls,
-                       kwargs={"collection_factory": collection_factory})
+        route = dfn + '/:elem_id'
+        return URLSpec(create_urlspec_regex(route), cls,
+                       kwargs={"collection_factory": collection_factory,
+                               "route": route})
 
-    def initialize(self, collection_factory):
+    def initialize(self, collection_factory, route=None):
         self.collection_factory = collection_factory
+        self.route = route
 
     def prepare(self):
+        BaseHandler.prepare(self)
         kw = self.path_kwargs.copy()
         self.elem_id = kw.pop('elem_id')
         self.collection = self.collection_factory(**kw)
 
+    def _set_etag(self, version):
+        # This is the header name cyclone uses, so it won't add its own.
+        self.set_header("Etag", '"%s"' % (version,))
+
+    def _not_modified(self, version):
+        """
+        Return ``True`` if the request has an ``If-None-Match`` header that
+        matches the element's current version.
+        """
+        header = self.request.headers.get("If-None-Match")
+        if header is None:
+            return False
+        etags = parse_etags(header)
+        return etags is None or version in etags
+
+    @inlineCallbacks
+    def _expected_version(self):
+        """
+        Return the version the element must have for the request's
+        ``If-Match`` header to match, or ``None`` if any version matches.
+        """
+        header = self.request.headers.get("If-Match")
+        etags = None if header is None else parse_etags(header)
+        if etags is None:
+            returnValue(None)
+        if len(etags) == 1:
+            returnValue(etags[0])
+        # Any of several versions will do, so we check which one the
+        # element has and make the write conditional on that.
+        version = yield self.collection.get_version(self.elem_id)
+        if version not in etags:
+            raise VersionConflict(
+                "Object %r does not have any of the versions %r." % (
+                    self.elem_id, etags))
+        returnValue(version)
+
+    @inlineCallbacks
+    def _get_element(self):
+        fields = self.get_fields()
+        # Collections that have to load an element to find its version are
+        # asked for the element straight away, so that a stale
+        # If-None-Match header doesn't mean loading it twice.
+        check_version = (
+            fields is None and self.collection.cheap_versions and
+            self.request.headers.get("If-None-Match") is not None)
+        if check_version:
+            version = yield self.collection.get_version(self.elem_id)
+            if version is not None and self._not_modified(version):
+                self._set_etag(version)
+                self.set_status(304)
+                return
+        obj = yield self.collection.get(self.elem_id, fields=fields)
+        if obj is not None and fields is None:
+            version = object_version(obj)
+            self._set_etag(version)
+            if self._not_modified(version):
+                self.set_status(304)
+                return
+        yield self.write_object(obj)
+
     def get(self, *args, **kw):
         """
         Retrieve an element within a collection.
         """
-        d = self.write_object(self.collection.get(self.elem_id))
+        d = self._get_element()
         d.addErrback(self.raise_err, 500,
                      "Failed to retrieve %r" % (self.elem_id,))
         return d
 
+    def _get_blind(self):
+        """
+        Return whether the ``blind`` parameter asks for a blind update, or
+        ``None`` if it isn't given.
+        """
+        blind = self.get_argument("blind", None)
+        if blind is None:
+            return None
+        if blind not in ("true", "false"):
+            raise HTTPError(400, reason="Invalid blind.")
+        return blind == "true"
+
+    @inlineCallbacks
+    def _update_element(self, data):
+        blind = self._get_blind()
+        version = yield self._expected_version()
+        obj = yield self.collection.update(
+            self.elem_id, data, version, blind=blind)
+        self._set_etag(object_version(obj))
+        yield self.write_object({"success": True})
+
     def put(self, *args, **kw):
         """
         Update an element within a collection.
         """
-        data = json.loads(self.request.body)
-        d = self.collection.update(self.elem_id, data)
-        d.addCallback(lambda r: self.write_object({"success": True}))
+        data = self.decode(self.request.body)
+        d = self._update_element(data)
+        d.addErrback(self.catch_err, ObjectNotFound, 404,
+                     "Object not found.")
+        d.addErrback(self.catch_err, VersionConflict, 412,
+                     "Version does not match.")
+        d.addErrback(self.catch_err, SchemaViolation, 400,
+                     "Schema violation.")
         d.addErrback(self.raise_err, 500,
                      "Failed to update %r" % (self.elem_id,))
         return d
 
+    @inlineCallbacks
+    def _delete_element(self):
+        version = yield self._expected_version()
+        yield self.collection.delete(self.elem_id, version)
+        yield self.write_object({"success": True})
+
     def delete(self, *args, **kw):
         """
         Delete an element from within a collection.
         """
-        d = self.collection.delete(self.elem_id)
-        d.addCallback(lambda r: self.write_object({"success": True}))
+        d = self._delete_element()
+        d.addErrback(self.catch_err, VersionConflict, 412,
+                     "Version does not match.")
         d.addErrback(self.raise_err, 500,
                      "Failed to delete %r" % (self.elem_id,))
         return d
 
 
+class DeletionStatusHandler(BaseHandler):
+    """
+    Handler for checking on the deletion of a store's rows.
+
+    Methods supported:
+
+    * ``GET /:owner_id/stores/:store_id/_deletion`` - return the status of
+      the job deleting the rows of a deleted store, see
+      :meth:`go_store_service.collections.cascading.DeletionJob.status`.
+      Returns ``404`` if the store's rows aren't being deleted and haven't
+      been recently.
+    """
+
+    @classmethod
+    def mk_urlspec(cls, dfn, jobs):
+        return URLSpec(create_urlspec_regex(dfn), cls,
+                       kwargs={"jobs": jobs, "route": dfn})
+
+    def initialize(self, jobs, route=None):
+        self.jobs = jobs
+        self.route = route
+
+    def get(self, owner_id, store_id):
+        job = self.jobs.get(owner_id, store_id)
+        if job is None:
+            raise HTTPError(404, reason="No deletion found.")
+        self.write(job.status())
+
+
+class MetricsHandler(RequestHandler):
+    """
+    Handler for exporting metrics in the Prometheus text format.
+
+    Methods supported:
+
+    * ``GET /metrics`` - return the current value of all metrics.
+    """
+
+    route = '/metrics'
+
+    @classmethod
+    def mk_urlspec(cls, metrics):
+        return URLSpec(cls.route, cls, kwargs={"metrics": metrics})
+
+    def initialize(self, metrics):
+        self.metrics = metrics
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(self.metrics.render())
+
+
 class ApiApplication(Application):
     """
     An API for a set of collections and adhoc additional methods.
+
+    :param metrics:
+        If given, a :class:`go_store_service.metrics.MetricsRegistry` to
+        record request metrics in. The metrics are served from
+        ``/metrics``.
+    :param int compression_level:
+        The zlib compression level (1 to 9) to compress responses with, for
+        clients that accept gzip or deflate encoded responses. If ``None``,
+        responses aren't compressed.
+    :param int compression_min_size:
+        Responses that are written in one piece and are smaller than this
+        many bytes aren't compressed.
+    :param admission:
+        If given, an
+        :class:`go_store_service.interfaces.IAdmissionControl` provider to
+        check requests with before they're handled, such as
+        :class:`go_store_service.admission.OwnerAdmissionControl`.
+        Rejected requests get a ``429`` response.
     """
 
     collections = ()
 
-    def __init__(self, **settings):
+    def __init__(self, metrics=None, compression_level=6,
+                 compression_min_size=1024, admission=None, **settings):
+        self.metrics = metrics
+        self.admission = admission
+        if metrics is not None:
+            self._request_duration = metrics.histogram(
+                'store_request_duration_seconds',
+                'Time taken to handle requests.',
+                ('route', 'method', 'code'))
+            self._response_bytes = metrics.counter(
+                'store_response_bytes_total',
+                'Response body bytes written.', ('route', 'method'))
+            self._response_objects = metrics.counter(
+                'store_streamed_objects_total',
+                'Objects streamed in responses.', ('route', 'method'))
+            self._admission_rejections = metrics.counter(
+                'store_admission_rejections_total',
+                'Requests rejected by admission control.',
+                ('route', 'reason'))
+        transforms = [ChunkedTransferEncoding]
+        if compression_level is not None:
+            transforms.insert(0, partial(
+                CompressedContentEncoding, level=compression_level,
+                min_size=compression_min_size))
         routes = self._build_routes()
-        Application.__init__(self, routes, **settings)
+        Application.__init__(self, routes, transforms=transforms, **settings)
+
+    def log_request(self, handler):
+        Application.log_request(self, handler)
+        if self.metrics is not None:
+            self._record_request(handler)
+
+    def _record_request(self, handler):
+        route = getattr(handler, 'route', None) or 'unknown'
+        method = handler.request.method
+        self._request_duration.observe(
+            handler.request.request_time(),
+            (route, method, str(handler.get_status())))
+        self._response_bytes.inc(
+            getattr(handler, 'bytes_written', 0), (route, method))
+        self._response_objects.inc(
+            getattr(handler, 'objects_written', 0), (route, method))
+
+    def record_rejection(self, handler, rejection):
+        """
+        Record a request rejected by admission control.
+
+        :param rejection:
+            The :class:`go_store_service.interfaces.AdmissionRejected`
+            exception the request was rejected with.
+        """
+        # Rejections aren't logged, because there may be a lot of them.
+        if self.metrics is not None:
+            route = getattr(handler, 'route', None) or 'unknown'
+            self._admission_rejections.inc(1, (route, rejection.reason))
 
     def _build_routes(self):
         """
@@ -209,6 +1047,14 @@ class ApiApplication(Application):
         for dfn, collection_factory in self.collections:
             routes.extend((
                 CollectionHandler.mk_urlspec(dfn, collection_factory),
+                # Action routes must come before element routes, otherwise
+                # actions will be treated as element ids.
+                BatchGetHandler.mk_urlspec(dfn, collection_factory),
+                BulkHandler.mk_urlspec(dfn, collection_factory),
+                CountHandler.mk_urlspec(dfn, collection_factory),
+                AggregateHandler.mk_urlspec(dfn, collection_factory),
                 ElementHandler.mk_urlspec(dfn, collection_factory),
             ))
+        if self.metrics is not None:
+            routes.append(MetricsHandler.mk_urlspec(self.metrics))
         return routes
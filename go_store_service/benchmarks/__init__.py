@@ -0,0 +1,7 @@
+"""
+Benchmarks for the store service HTTP API and collection backends.
+
+Run them using::
+
+    $ python -m go_store_service.benchmarks.run --help
+"""
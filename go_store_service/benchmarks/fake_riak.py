@@ -0,0 +1,213 @@
+"""
+An in-memory stand-in for a Riak manager.
+
+This is intended for benchmarking the Riak collection backend without a Riak
+cluster. It only implements the parts of a manager that the collection
+backend uses, but it stores data and indexes the way Riak does and can
+simulate a network round trip for each operation.
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bisect import bisect_right
+
+from twisted.internet.defer import (
+    Deferred, inlineCallbacks, gatherResults, succeed)
+from vumi.persist.model import Manager
+
+
+class FakeRiakClientObject(object):
+    """
+    The part of a Riak client's object that is used directly, rather than
+    through vumi's wrapper.
+    """
+
+    def __init__(self, vclock=None):
+        self.vclock = vclock
+
+
+class FakeRiakObject(object):
+    """
+    An object stored in a :class:`FakeRiakManager`.
+    """
+
+    def __init__(self, key, data=None, indexes=(), vclock=None):
+        self.key = key
+        self._data = data
+        self._indexes = set(indexes)
+        # Vumi's Riak objects wrap a client object that holds the vclock.
+        self._riak_obj = FakeRiakClientObject(vclock)
+
+    def get_key(self):
+        return self.key
+
+    def get_data(self):
+        return self._data
+
+    def set_data(self, data):
+        self._data = data
+
+    def set_data_field(self, key, value):
+        self._data[key] = value
+
+    def delete_data_field(self, key):
+        del self._data[key]
+
+    def get_indexes(self):
+        return sorted(self._indexes)
+
+    def set_indexes(self, indexes):
+        self._indexes = set(indexes)
+
+    def add_index(self, index_name, index_value):
+        self._indexes.add((index_name, index_value))
+
+    def remove_index(self, index_name, index_value=None):
+        self._indexes = set(
+            (name, value) for name, value in self._indexes
+            if name != index_name or
+            (index_value is not None and value != index_value))
+
+
+class FakeIndexPage(object):
+    """
+    A page of index query results.
+    """
+
+    def __init__(self, results, continuation):
+        self._results = results
+        self.continuation = continuation
+
+    def __iter__(self):
+        return iter(self._results)
+
+    def __len__(self):
+        return len(self._results)
+
+    def has_next_page(self):
+        return self.continuation is not None
+
+
+class FakeRiakManager(Manager):
+    """
+    A manager that keeps everything in memory.
+
+    :param float latency:
+        Number of seconds to delay the result of each operation by, to
+        simulate a network round trip. If zero, results are returned
+        immediately.
+    :param reactor:
+        Reactor to schedule delayed results with. Defaults to the global
+        reactor.
+    """
+
+    call_decorator = staticmethod(inlineCallbacks)
+
+    def __init__(self, latency=0, reactor=None, bucket_prefix='fake.'):
+        Manager.__init__(self, None, bucket_prefix)
+        if reactor is None:
+            from twisted.internet import reactor
+        self.latency = latency
+        self.reactor = reactor
+        self._buckets = {}
+        self._vclocks = {}
+        self._last_vclock = 0
+
+    def _respond(self, value):
+        if not self.latency:
+            return succeed(value)
+        d = Deferred()
+        self.reactor.callLater(self.latency, d.callback, value)
+        return d
+
+    def _bucket(self, modelcls_or_obj):
+        return self._buckets.setdefault(self.bucket_name(modelcls_or_obj), {})
+
+    def close_manager(self):
+        return succeed(None)
+
+    def should_quote_index_values(self):
+        return False
+
+    def riak_object(self, modelcls, key):
+        return FakeRiakObject(key, {'$VERSION': modelcls.VERSION})
+
+    def store(self, modelobj):
+        riak_object = self._reverse_migrate_riak_object(modelobj)
+        self._bucket(modelobj)[modelobj.key] = (
+            json.dumps(riak_object.get_data()), riak_object.get_indexes())
+        # Each write gets a new vclock, as it would from Riak.
+        self._last_vclock += 1
+        vclock = "vclock-%d" % (self._last_vclock,)
+        self._vclocks[(self.bucket_name(modelobj), modelobj.key)] = vclock
+        modelobj._riak_object._riak_obj.vclock = vclock
+        return self._respond(modelobj)
+
+    def delete(self, modelobj):
+        self._bucket(modelobj).pop(modelobj.key, None)
+        self._vclocks.pop((self.bucket_name(modelobj), modelobj.key), None)
+        return self._respond(None)
+
+    def load(self, modelcls, key, result=None):
+        stored = self._bucket(modelcls).get(key)
+        if stored is None:
+            return self._respond(None)
+        data, indexes = stored
+        riak_object = FakeRiakObject(
+            key, json.loads(data), indexes,
+            self._vclocks.get((self.bucket_name(modelcls), key)))
+        return self._respond(
+            self._migrate_riak_object(modelcls, key, riak_object))
+
+    def _load_multiple(self, modelcls, keys):
+        d = gatherResults([self.load(modelcls, key) for key in keys])
+        d.addCallback(lambda objs: [obj for obj in objs if obj is not None])
+        return d
+
+    def _index_results(self, model, index_name, start_value, end_value):
+        """
+        Return a sorted list of ``(term, key)`` tuples matching an index
+        query.
+        """
+        bucket = self._bucket(model)
+        if index_name == '$bucket':
+            return sorted((key, key) for key in bucket)
+        results = []
+        for key, (_data, indexes) in bucket.iteritems():
+            for name, value in indexes:
+                if name != index_name:
+                    continue
+                if end_value is None:
+                    match = (value == start_value)
+                else:
+                    match = (start_value <= value <= end_value)
+                if match:
+                    results.append((value, key))
+        results.sort()
+        return results
+
+    def _format_results(self, results, return_terms):
+        if return_terms:
+            return results
+        return [key for _term, key in results]
+
+    def index_keys(self, model, index_name, start_value, end_value=None,
+                   return_terms=None):
+        results = self._index_results(
+            model, index_name, start_value, end_value)
+        return self._respond(self._format_results(results, return_terms))
+
+    def index_keys_page(self, model, index_name, start_value, end_value=None,
+                        return_terms=None, max_results=None,
+                        continuation=None):
+        results = self._index_results(
+            model, index_name, start_value, end_value)
+        if continuation is not None:
+            last = tuple(json.loads(urlsafe_b64decode(str(continuation))))
+            results = results[bisect_right(results, last):]
+        next_continuation = None
+        if max_results is not None and len(results) > max_results:
+            results = results[:max_results]
+            next_continuation = urlsafe_b64encode(json.dumps(results[-1]))
+        return self._respond(FakeIndexPage(
+            self._format_results(results, return_terms), next_continuation))
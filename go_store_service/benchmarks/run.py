@@ -0,0 +1,267 @@
+"""
+Benchmark harness for the store service HTTP API.
+
+This starts a :class:`StoreServer` in-process, drives it over HTTP from the
+same reactor and writes one JSON object per benchmark to the output, for
+example::
+
+    $ python -m go_store_service.benchmarks.run --backend=fake_riak \\
+        --latency=0.001 --rows=1000,100000 --output=results.jsonl
+
+Each result contains the request rate and the p50 and p99 request latencies
+in milliseconds.
+"""
+
+import json
+import sys
+import time
+from io import BytesIO
+
+from twisted.internet.defer import inlineCallbacks, returnValue, gatherResults
+from twisted.internet.task import react
+from twisted.python import usage
+from twisted.web.client import (
+    Agent, FileBodyProducer, HTTPConnectionPool, readBody)
+from twisted.web.http_headers import Headers
+
+from go_store_service.benchmarks.fake_riak import FakeRiakManager
+from go_store_service.collections import (
+    InMemoryCollectionBackend, RiakCollectionBackend)
+from go_store_service.server import StoreServer
+
+
+def percentile(sorted_values, pct):
+    """
+    Return the ``pct`` percentile of a sorted list of values.
+    """
+    if not sorted_values:
+        return None
+    index = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def summarise(name, latencies, elapsed, **extra):
+    """
+    Build a result dict for a benchmark.
+
+    :param str name:
+        Name of the benchmark.
+    :param list latencies:
+        Request latencies in seconds.
+    :param float elapsed:
+        Wall clock time the benchmark took, in seconds.
+    """
+    latencies = sorted(latencies)
+    result = {
+        "benchmark": name,
+        "requests": len(latencies),
+        "elapsed_s": elapsed,
+        "req_per_s": len(latencies) / elapsed if elapsed else None,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+    result.update(extra)
+    return result
+
+
+class Options(usage.Options):
+    optParameters = [
+        ["backend", "b", "memory",
+         "Backend to benchmark: 'memory', 'memory_raw' or 'fake_riak'."],
+        ["latency", None, 0.0,
+         "Simulated round trip time for the fake_riak backend, in seconds.",
+         float],
+        ["requests", "n", 1000,
+         "Number of requests for each single object benchmark.", int],
+        ["concurrency", "c", 10, "Number of requests to run at once.", int],
+        ["rows", "r", "1000",
+         "Comma separated list of store sizes to benchmark listings for."],
+        ["listings", None, 5,
+         "Number of listing requests for each store size.", int],
+        ["output", "o", None,
+         "File to write results to. Defaults to standard output."],
+    ]
+
+    def postOptions(self):
+        if self["backend"] not in ("memory", "memory_raw", "fake_riak"):
+            raise usage.UsageError("Unknown backend %r." % (self["backend"],))
+        try:
+            self["rows"] = [int(r) for r in self["rows"].split(",") if r]
+        except ValueError:
+            raise usage.UsageError("Invalid store sizes %r." % (
+                self["rows"],))
+
+
+class Benchmarker(object):
+    """
+    Runs benchmarks against an in-process store server.
+
+    :param reactor:
+        The reactor to run the server and client with.
+    :param backend:
+        The IStoreBackend provider to serve.
+    :param int concurrency:
+        Number of requests to run at once.
+    """
+
+    owner_id = "bench-owner"
+
+    def __init__(self, reactor, backend, concurrency):
+        self.reactor = reactor
+        self.backend = backend
+        self.concurrency = concurrency
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = concurrency
+        self.agent = Agent(reactor, pool=self.pool)
+
+    def start(self):
+        self.server = self.reactor.listenTCP(
+            0, StoreServer(backend=self.backend), interface="127.0.0.1")
+        self.base_url = "http://127.0.0.1:%d" % (self.server.getHost().port,)
+
+    @inlineCallbacks
+    def stop(self):
+        yield self.pool.closeCachedConnections()
+        yield self.server.stopListening()
+
+    def url(self, store_id, object_id=None):
+        url = "%s/%s/stores/%s/keys" % (self.base_url, self.owner_id, store_id)
+        if object_id is not None:
+            url += "/%s" % (object_id,)
+        return url
+
+    @inlineCallbacks
+    def request(self, method, url, body=None):
+        """
+        Make a request and return its latency in seconds.
+        """
+        producer = None
+        if body is not None:
+            producer = FileBodyProducer(BytesIO(body))
+        start = time.time()
+        response = yield self.agent.request(method, url, Headers(), producer)
+        yield readBody(response)
+        latency = time.time() - start
+        if response.code != 200:
+            raise Exception("%s %s returned %s" % (method, url, response.code))
+        returnValue(latency)
+
+    @inlineCallbacks
+    def run_requests(self, name, requests, concurrency=None, **extra):
+        """
+        Run a sequence of requests and return a summary of the results.
+
+        :param str name:
+            Name of the benchmark.
+        :param requests:
+            Iterable of ``(method, url, body)`` tuples.
+        """
+        if concurrency is None:
+            concurrency = self.concurrency
+        requests = iter(requests)
+        latencies = []
+
+        @inlineCallbacks
+        def worker():
+            for method, url, body in requests:
+                latency = yield self.request(method, url, body)
+                latencies.append(latency)
+
+        start = time.time()
+        yield gatherResults([worker() for _ in range(concurrency)])
+        returnValue(summarise(name, latencies, time.time() - start, **extra))
+
+    @inlineCallbacks
+    def populate(self, store_id, rows):
+        """
+        Create ``rows`` rows in a store directly through the backend.
+        """
+        collection = self.backend.get_row_collection(self.owner_id, store_id)
+        batch_size = 1000
+        for start in range(0, rows, batch_size):
+            end = min(start + batch_size, rows)
+            yield collection.create_many([
+                ("row-%08d" % i, {"n": i, "name": "row %d" % i})
+                for i in range(start, end)])
+
+    @inlineCallbacks
+    def bench_single(self, requests):
+        """
+        Benchmark single row creates, gets, updates and deletes.
+        """
+        store_id = "single"
+        body = json.dumps({"name": "bench", "values": range(10)})
+        ids = ["row-%08d" % i for i in range(requests)]
+        yield self.populate(store_id, requests)
+        results = []
+        results.append((yield self.run_requests("get", [
+            ("GET", self.url(store_id, i), None) for i in ids])))
+        results.append((yield self.run_requests("put", [
+            ("PUT", self.url(store_id, i), body) for i in ids])))
+        results.append((yield self.run_requests("delete", [
+            ("DELETE", self.url(store_id, i), None) for i in ids])))
+        results.append((yield self.run_requests("post", [
+            ("POST", self.url(store_id), body) for i in ids])))
+        returnValue(results)
+
+    @inlineCallbacks
+    def bench_listing(self, rows, listings):
+        """
+        Benchmark listing a store containing ``rows`` rows.
+        """
+        store_id = "listing-%d" % (rows,)
+        yield self.populate(store_id, rows)
+        result = yield self.run_requests("list", [
+            ("GET", self.url(store_id), None) for _ in range(listings)],
+            concurrency=1, rows=rows)
+        result["rows_per_s"] = (
+            rows * result["requests"] / result["elapsed_s"])
+        returnValue(result)
+
+
+def make_backend(options, reactor):
+    if options["backend"] == "fake_riak":
+        manager = FakeRiakManager(latency=options["latency"], reactor=reactor)
+        return RiakCollectionBackend(manager)
+    if options["backend"] == "memory_raw":
+        return InMemoryCollectionBackend({}, serialized=True, raw=True)
+    return InMemoryCollectionBackend({})
+
+
+@inlineCallbacks
+def main(reactor, *argv):
+    options = Options()
+    try:
+        options.parseOptions(argv)
+    except usage.UsageError, err:
+        print >> sys.stderr, "%s\n%s" % (options, err)
+        raise SystemExit(1)
+
+    output = sys.stdout
+    if options["output"] is not None:
+        output = open(options["output"], "w")
+
+    def emit(result):
+        result["backend"] = options["backend"]
+        output.write(json.dumps(result, sort_keys=True) + "\n")
+        output.flush()
+
+    benchmarker = Benchmarker(
+        reactor, make_backend(options, reactor), options["concurrency"])
+    benchmarker.start()
+    try:
+        results = yield benchmarker.bench_single(options["requests"])
+        for result in results:
+            emit(result)
+        for rows in options["rows"]:
+            result = yield benchmarker.bench_listing(
+                rows, options["listings"])
+            emit(result)
+    finally:
+        yield benchmarker.stop()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    react(main, sys.argv[1:])
@@ -0,0 +1,364 @@
+import json
+
+from twisted.internet.defer import (
+    gatherResults, inlineCallbacks, maybeDeferred, returnValue)
+from twisted.internet.task import Clock
+
+from vumi.tests.helpers import VumiTestCase
+
+from go_store_service.benchmarks.fake_riak import FakeRiakManager
+from go_store_service.collections import RiakCollectionBackend
+from go_store_service.collections.riak import (
+    RowData, StoreData, StoreStatsData, StoreStatsUpdater, get_vclock)
+from go_store_service.encoding import data_size
+from go_store_service.collections.tests.test_collections import (
+    CommonStoreTests)
+from go_store_service.interfaces import ObjectNotFound
+from go_store_service.query import Query
+from go_store_service.schema import Schema
+
+
+class TestFakeRiakStore(VumiTestCase, CommonStoreTests):
+    def make_store_backend(self):
+        # Rows are loaded before they're created so that the store's stats
+        # stay exact, as the common tests expect.
+        return RiakCollectionBackend(
+            FakeRiakManager(), load_before_create=True)
+
+    @inlineCallbacks
+    def query_ids(self, rows, *conditions):
+        objs = yield rows.query(Query.parse(conditions))
+        objs = yield gatherResults([maybeDeferred(lambda: o) for o in objs])
+        returnValue(sorted(obj["id"] for obj in objs if obj is not None))
+
+    def record_calls(self, manager, name):
+        calls = []
+        method = getattr(manager, name)
+
+        def record_call(modelcls_or_obj, *args, **kw):
+            calls.append(modelcls_or_obj)
+            return method(modelcls_or_obj, *args, **kw)
+
+        self.patch(manager, name, record_call)
+        return calls
+
+    @inlineCallbacks
+    def test_blind_updates(self):
+        """
+        Backends can make updates blind by default, so that objects they've
+        seen recently are saved with the vclock they had without being
+        loaded first.
+        """
+        manager = FakeRiakManager()
+        backend = RiakCollectionBackend(manager, blind_updates=True)
+        rows = backend.get_row_collection("me", "store")
+        yield rows.create("row", {"foo": "bar"})
+        vclock = backend.vclock_hint(RowData, "store:row")
+        self.assertNotEqual(vclock, None)
+        loads = self.record_calls(manager, 'load')
+        stores = self.record_calls(manager, 'store')
+        sent_vclocks = []
+        self.patch(
+            manager, '_reverse_migrate_riak_object',
+            lambda modelobj: sent_vclocks.append(
+                get_vclock(modelobj)) or modelobj._riak_object)
+
+        # The store's schema was loaded by the create and is kept, and only
+        # the store's stats are loaded to update them.
+        row_data = yield rows.update("row", {"foo": "baz"})
+        self.assertEqual(row_data, {"id": "row", "data": {"foo": "baz"}})
+        self.assertEqual(loads, [StoreStatsData])
+        self.assertEqual(sent_vclocks[0], vclock)
+        self.assertEqual(
+            backend.vclock_hint(RowData, "store:row"),
+            get_vclock(stores[0]))
+        stats = yield backend.get_store_stats("me", "store")
+        self.assertEqual(stats["rows"], 1)
+        self.assertEqual(stats["approximate"], True)
+
+    @inlineCallbacks
+    def test_create_with_generated_id(self):
+        """
+        Rows created with a generated id aren't loaded first, and keep the
+        store's stats exact.
+        """
+        manager = FakeRiakManager()
+        backend = RiakCollectionBackend(manager)
+        rows = backend.get_row_collection("me", "store")
+        yield rows.create(None, {})
+        loads = self.record_calls(manager, 'load')
+        row_data = yield rows.create(None, {"n": 1})
+        self.assertEqual(loads, [StoreStatsData])
+        stats = yield backend.get_store_stats("me", "store")
+        self.assertEqual(stats["rows"], 2)
+        self.assertEqual(stats["bytes"], data_size({}) + data_size({"n": 1}))
+        self.assertEqual(stats["approximate"], False)
+        self.assertEqual((yield rows.get(row_data["id"])), row_data)
+
+    @inlineCallbacks
+    def test_create_with_id_blind(self):
+        """
+        Rows created with an id the client chose aren't loaded first. Rows
+        we haven't seen are counted as new and rows we have are overwritten
+        with their vclock, and either way the stats become approximate.
+        """
+        manager = FakeRiakManager()
+        backend = RiakCollectionBackend(manager)
+        rows = backend.get_row_collection("me", "store")
+        yield rows.create(None, {})
+        loads = self.record_calls(manager, 'load')
+        sent_vclocks = []
+        self.patch(
+            manager, '_reverse_migrate_riak_object',
+            lambda modelobj: sent_vclocks.append(
+                (modelobj.key, get_vclock(modelobj))
+            ) or modelobj._riak_object)
+
+        yield rows.create("a", {"n": 1})
+        vclock = backend.vclock_hint(RowData, "store:a")
+        yield rows.create("a", {"n": 2})
+        self.assertEqual(loads, [StoreStatsData, StoreStatsData])
+        self.assertEqual(
+            [v for key, v in sent_vclocks if key == "store:a"],
+            [None, vclock])
+        self.assertEqual(
+            (yield rows.get("a")), {"id": "a", "data": {"n": 2}})
+        stats = yield backend.get_store_stats("me", "store")
+        self.assertEqual(stats["rows"], 2)
+        self.assertEqual(stats["approximate"], True)
+
+    @inlineCallbacks
+    def test_load_before_create(self):
+        manager = FakeRiakManager()
+        backend = RiakCollectionBackend(manager, load_before_create=True)
+        rows = backend.get_row_collection("me", "store")
+        yield rows.create("a", {"n": 1})
+        loads = self.record_calls(manager, 'load')
+        yield rows.create("a", {"n": 2})
+        self.assertEqual(loads, [RowData, StoreStatsData])
+        stats = yield backend.get_store_stats("me", "store")
+        self.assertEqual(
+            (stats["rows"], stats["bytes"], stats["approximate"]),
+            (1, data_size({"n": 2}), False))
+
+    @inlineCallbacks
+    def test_blind_update_without_vclock(self):
+        """
+        Blind updates to objects without a vclock hint load the object, so
+        that missing objects aren't created.
+        """
+        manager = FakeRiakManager()
+        rows = RiakCollectionBackend(
+            manager, blind_updates=True).get_row_collection("me", "store")
+        yield rows.create("row", {"foo": "bar"})
+        other_rows = RiakCollectionBackend(
+            manager, blind_updates=True).get_row_collection("me", "store")
+        yield self.assertFailure(
+            other_rows.update("missing", {}), ObjectNotFound)
+        loads = self.record_calls(manager, 'load')
+        yield other_rows.update("row", {"foo": "baz"})
+        self.assertEqual(loads, [RowData, StoreStatsData])
+
+    @inlineCallbacks
+    def test_vclock_forgotten_on_delete(self):
+        backend = RiakCollectionBackend(FakeRiakManager())
+        rows = backend.get_row_collection("me", "store")
+        yield rows.create("row", {})
+        yield rows.delete("row")
+        self.assertEqual(backend.vclock_hint(RowData, "store:row"), None)
+        yield self.assertFailure(
+            rows.update("row", {}, blind=True), ObjectNotFound)
+
+    @inlineCallbacks
+    def test_listings_dont_keep_vclocks(self):
+        backend = RiakCollectionBackend(FakeRiakManager())
+        rows = backend.get_row_collection("me", "store")
+        yield RiakCollectionBackend(backend.manager).get_row_collection(
+            "me", "store").create("row", {})
+        yield self.query_ids(rows, "foo == 1")
+        yield rows.all()
+        self.assertEqual(backend.vclock_hint(RowData, "store:row"), None)
+        yield rows.get("row")
+        self.assertNotEqual(backend.vclock_hint(RowData, "store:row"), None)
+
+    @inlineCallbacks
+    def test_blind_updates_can_be_turned_off(self):
+        backend = RiakCollectionBackend(
+            FakeRiakManager(), blind_updates=True)
+        rows = backend.get_row_collection("me", "store")
+        yield self.assertFailure(
+            rows.update("missing", {}, blind=False), ObjectNotFound)
+
+    @inlineCallbacks
+    def test_reindex_schema(self):
+        """
+        Rows written before a field was indexed are found by queries on that
+        field while the store is being reindexed, and by the index once it
+        has been.
+        """
+        backend = self.get_store_backend()
+        reindexes = []
+        self.patch(
+            backend, 'reindex_schema',
+            lambda owner_id, store_id: reindexes.append(store_id))
+        stores = yield backend.get_store_collection("me")
+        yield stores.create("store", {})
+        rows = backend.get_row_collection("me", "store")
+        yield rows.create("a", {"n": 1})
+        yield rows.create("b", {"n": "2"})
+
+        yield stores.update("store", {"schema": {
+            "n": {"type": "integer", "index": True}}})
+        self.assertEqual(reindexes, ["store"])
+        rows = backend.get_row_collection("me", "store")
+        self.assertEqual((yield self.query_ids(rows, "n == 1")), ["a"])
+        self.assertEqual(rows._query_schema, Schema())
+
+        reindexed = yield rows.reindex_schema()
+        self.assertEqual(reindexed, 2)
+        self.assertEqual(rows._query_schema, Schema({"n": "integer"}))
+        rows = backend.get_row_collection("me", "store")
+        self.assertEqual((yield self.query_ids(rows, "n == 1")), ["a"])
+        # Row "b" doesn't match the schema, so it isn't indexed.
+        self.assertEqual((yield self.query_ids(rows, "n >= 0")), ["a"])
+
+    @inlineCallbacks
+    def test_schema_change_starts_reindex(self):
+        backend = self.get_store_backend()
+        stores = yield backend.get_store_collection("me")
+        yield stores.create("store", {"schema": {
+            "s": {"type": "string", "index": True}}})
+        rows = backend.get_row_collection("me", "store")
+        yield rows.create("a", {"s": "x", "n": 1})
+
+        yield stores.update("store", {"schema": {
+            "s": {"type": "string", "index": True},
+            "n": {"type": "integer", "index": True}}})
+        # The fake manager responds immediately, so the reindex has already
+        # finished.
+        store = yield backend.manager.load(StoreData, "store")
+        self.assertEqual(store.unindexed, None)
+        rows = backend.get_row_collection("me", "store")
+        self.assertEqual((yield self.query_ids(rows, "n == 1")), ["a"])
+        self.assertEqual(
+            rows._query_schema, Schema({"s": "string", "n": "integer"}))
+
+    @inlineCallbacks
+    def test_unindexed_fields_kept_until_reindexed(self):
+        """
+        Fields stay unindexed across schema changes until a reindex covers
+        them, and fields that are no longer indexed are forgotten.
+        """
+        backend = self.get_store_backend()
+        self.patch(backend, 'reindex_schema', lambda owner_id, store_id: None)
+        stores = yield backend.get_store_collection("me")
+        yield stores.create("store", {})
+        yield stores.update("store", {"schema": {
+            "n": {"type": "integer", "index": True}}})
+        yield stores.update("store", {"schema": {
+            "n": {"type": "integer", "index": True},
+            "s": {"type": "string", "index": True}}})
+        store = yield backend.manager.load(StoreData, "store")
+        self.assertEqual(store.unindexed, {"n": "integer", "s": "string"})
+        yield stores.update("store", {"schema": {
+            "n": {"type": "integer", "index": True}}})
+        store = yield backend.manager.load(StoreData, "store")
+        self.assertEqual(store.unindexed, {"n": "integer"})
+
+    @inlineCallbacks
+    def test_store_migrated_from_version_1(self):
+        manager = FakeRiakManager()
+        manager._bucket(StoreData)["store"] = (json.dumps({
+            "$VERSION": 1, "owner_id": "me", "data": {"foo": "bar"},
+        }), [("owner_id_bin", "me")])
+        store = yield manager.load(StoreData, "store")
+        self.assertEqual(
+            (store.data, store.unindexed), ({"foo": "bar"}, None))
+        stores = RiakCollectionBackend(manager).get_store_collection("me")
+        yield stores.update("store", {"foo": "baz"})
+        store_keys = yield stores.all_keys()
+        self.assertEqual(store_keys, ["store"])
+
+    @inlineCallbacks
+    def test_query_indexes_are_per_store(self):
+        backend = self.get_store_backend()
+        stores = yield backend.get_store_collection("me")
+        schema = {"schema": {"s": {"type": "string", "index": True}}}
+        yield stores.create("store1", schema)
+        yield stores.create("store2", schema)
+        rows1 = backend.get_row_collection("me", "store1")
+        rows2 = backend.get_row_collection("me", "store2")
+        yield rows1.create("a", {"s": "x"})
+        yield rows2.create("b", {"s": "x"})
+        self.assertEqual((yield self.query_ids(rows1, "s == x")), ["a"])
+        self.assertEqual((yield self.query_ids(rows2, "s ^= x")), ["b"])
+
+    @inlineCallbacks
+    def test_recount_stats(self):
+        """
+        Stats made approximate by blind updates are made exact again by
+        recounting the rows.
+        """
+        backend = RiakCollectionBackend(FakeRiakManager())
+        rows = backend.get_row_collection("me", "store")
+        yield rows.create("a", {"n": 1})
+        yield rows.create("b", {"n": 1})
+        yield rows.update("b", {"n": 2}, blind=True)
+        stats = yield backend.get_store_stats("me", "store")
+        self.assertEqual((stats["rows"], stats["approximate"]), (2, True))
+
+        stats = yield rows.recount_stats()
+        self.assertEqual(stats["rows"], 2)
+        self.assertEqual(stats["bytes"], 2 * data_size({"n": 1}))
+        self.assertEqual(stats["approximate"], False)
+        self.assertEqual(stats, (yield backend.get_store_stats("me", "store")))
+
+    @inlineCallbacks
+    def test_count_from_stats(self):
+        """
+        Rows are counted from the store's stats if they're exact, and by
+        listing the store's keys otherwise.
+        """
+        backend = self.get_store_backend()
+        rows = backend.get_row_collection("me", "store")
+        yield rows.create("a", {})
+        yield rows.create("b", {})
+        all_keys = rows.all_keys
+        self.patch(rows, 'all_keys', lambda: 1 / 0)
+        self.assertEqual((yield rows.count()), 2)
+
+        self.patch(rows, 'all_keys', all_keys)
+        yield rows.update("b", {"n": 1}, blind=True)
+        self.assertEqual((yield rows.count()), 2)
+        other_rows = backend.get_row_collection("me", "other_store")
+        self.assertEqual((yield other_rows.count()), 0)
+
+    def test_stats_changes_merged(self):
+        """
+        Changes to a store's stats that are made while they're being
+        written are written together afterwards.
+        """
+        clock = Clock()
+        manager = FakeRiakManager(latency=1, reactor=clock)
+        updater = StoreStatsUpdater(manager, reactor=clock)
+        saves = []
+        store = manager.store
+
+        def record_store(modelobj):
+            saves.append(modelobj.key)
+            return store(modelobj)
+
+        self.patch(manager, 'store', record_store)
+        d1 = updater.change("store", rows=1, size=10)
+        d2 = updater.change("store", rows=1, size=5)
+        d3 = updater.change("store", rows=-1, size=-10)
+        # Each write is a load and a save.
+        clock.pump([1] * 4)
+        for d in (d1, d2, d3):
+            self.assertEqual(self.successResultOf(d), None)
+        self.assertEqual(saves, ["store", "store"])
+        stats = updater.get("store")
+        clock.advance(1)
+        self.assertEqual(self.successResultOf(stats), {
+            "rows": 1, "bytes": 5, "last_modified": 0,
+            "approximate": False})
@@ -0,0 +1,62 @@
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.python import usage
+from twisted.trial.unittest import TestCase
+
+from go_store_service.benchmarks.run import (
+    Benchmarker, Options, percentile, summarise)
+from go_store_service.collections import InMemoryCollectionBackend
+
+
+class TestHelpers(TestCase):
+    def test_percentile(self):
+        values = range(101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 50), None)
+
+    def test_summarise(self):
+        result = summarise("get", [0.002, 0.001, 0.003], 2.0, rows=5)
+        self.assertEqual(result, {
+            "benchmark": "get",
+            "requests": 3,
+            "elapsed_s": 2.0,
+            "req_per_s": 1.5,
+            "p50_ms": 2.0,
+            "p99_ms": 3.0,
+            "rows": 5,
+        })
+
+
+class TestOptions(TestCase):
+    def test_rows(self):
+        options = Options()
+        options.parseOptions(["--rows", "10,200"])
+        self.assertEqual(options["rows"], [10, 200])
+
+    def test_unknown_backend(self):
+        options = Options()
+        self.assertRaises(
+            usage.UsageError, options.parseOptions, ["--backend", "foo"])
+
+
+class TestBenchmarker(TestCase):
+    def setUp(self):
+        self.benchmarker = Benchmarker(
+            reactor, InMemoryCollectionBackend({}), 2)
+        self.benchmarker.start()
+        self.addCleanup(self.benchmarker.stop)
+
+    @inlineCallbacks
+    def test_bench_single(self):
+        results = yield self.benchmarker.bench_single(4)
+        self.assertEqual(
+            [(r["benchmark"], r["requests"]) for r in results],
+            [("get", 4), ("put", 4), ("delete", 4), ("post", 4)])
+
+    @inlineCallbacks
+    def test_bench_listing(self):
+        result = yield self.benchmarker.bench_listing(10, 2)
+        self.assertEqual(result["benchmark"], "list")
+        self.assertEqual(result["requests"], 2)
+        self.assertEqual(result["rows"], 10)
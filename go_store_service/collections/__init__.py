@@ -4,12 +4,35 @@ Package containing collection implementations.
 Available implementations are imported from subpackages.
 """
 
+from go_store_service.collections.forwarding import ForwardingCollection
+
 from go_store_service.collections.inmemory import (
     InMemoryCollection, InMemoryCollectionBackend)
 
 from go_store_service.collections.riak import RiakCollectionBackend
 
+from go_store_service.collections.cached import (
+    CachedCollection, CachedCollectionBackend)
+
+from go_store_service.collections.instrumented import (
+    InstrumentedCollection, InstrumentedCollectionBackend)
+
+from go_store_service.collections.coalescing import (
+    CoalescingCollection, CoalescingCollectionBackend)
+
+from go_store_service.collections.cascading import (
+    CascadingStoreCollection, CascadingCollectionBackend)
+
+from go_store_service.collections.stats import (
+    StatsStoreCollection, StatsCollectionBackend)
+
 __all__ = [
+    'ForwardingCollection',
     'InMemoryCollection', 'InMemoryCollectionBackend',
     'RiakCollectionBackend',
+    'CachedCollection', 'CachedCollectionBackend',
+    'InstrumentedCollection', 'InstrumentedCollectionBackend',
+    'CoalescingCollection', 'CoalescingCollectionBackend',
+    'CascadingStoreCollection', 'CascadingCollectionBackend',
+    'StatsStoreCollection', 'StatsCollectionBackend',
 ]
@@ -0,0 +1,269 @@
+from collections import OrderedDict
+
+from twisted.internet.defer import maybeDeferred, succeed
+from zope.interface import implementer
+
+from go_store_service.collections.forwarding import ForwardingCollection
+from go_store_service.encoding import object_version
+from go_store_service.interfaces import IStoreBackend
+from go_store_service.projection import project_object
+
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """
+    A size-bounded least-recently-used cache with optional expiry.
+
+    :param int max_size:
+        Maximum number of entries to keep.
+    :param float ttl:
+        Number of seconds an entry may be used for, or ``None`` if entries
+        don't expire.
+    :param reactor:
+        Used to tell the time. Defaults to the global reactor.
+    :param metrics:
+        If given, a :class:`go_store_service.metrics.MetricsRegistry` to
+        count hits, misses and evictions in, as
+        ``store_cache_hits_total``, ``store_cache_misses_total`` and
+        ``store_cache_evictions_total``.
+    """
+
+    def __init__(self, max_size, ttl=None, reactor=None, metrics=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.max_size = max_size
+        self.ttl = ttl
+        self.reactor = reactor
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._counters = None
+        if metrics is not None:
+            self._counters = {
+                "hits": metrics.counter(
+                    'store_cache_hits_total', 'Object cache hits.'),
+                "misses": metrics.counter(
+                    'store_cache_misses_total', 'Object cache misses.'),
+                "evictions": metrics.counter(
+                    'store_cache_evictions_total',
+                    'Objects evicted from the object cache.'),
+            }
+
+    def _count(self, name):
+        setattr(self, name, getattr(self, name) + 1)
+        if self._counters is not None:
+            self._counters[name].inc()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Return the value for ``key``, or ``default`` if the key isn't cached
+        or has expired.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            expires, value = entry
+            if expires is None or expires > self.reactor.seconds():
+                self._entries[key] = entry
+                self._count("hits")
+                return value
+        self._count("misses")
+        return default
+
+    def set(self, key, value, generation=None):
+        """
+        Cache ``value`` for ``key``.
+
+        If ``generation`` is given and anything has been invalidated since
+        :attr:`generation` had that value, the value may be stale and isn't
+        cached.
+        """
+        if generation is not None and generation != self.generation:
+            return
+        expires = None
+        if self.ttl is not None:
+            expires = self.reactor.seconds() + self.ttl
+        self._entries.pop(key, None)
+        self._entries[key] = (expires, value)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._count("evictions")
+
+    def invalidate(self, key):
+        """
+        Remove ``key`` from the cache.
+        """
+        self.generation += 1
+        self._entries.pop(key, None)
+
+    def stats(self):
+        """
+        Return a dict of cache counters.
+        """
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class CachedCollection(ForwardingCollection):
+    """
+    A collection that caches the objects returned by another collection.
+
+    Objects handed out from the cache are shared between callers and must
+    not be modified.
+
+    :param collection:
+        The ICollection provider to cache objects from.
+    :param LRUCache cache:
+        The cache to store objects in.
+    :param tuple prefix:
+        Prefix for this collection's cache keys.
+    """
+
+    def __init__(self, collection, cache, prefix):
+        super(CachedCollection, self).__init__(collection)
+        self._cache = cache
+        self._prefix = prefix
+
+    def _key(self, object_id):
+        return self._prefix + (object_id,)
+
+    def _cache_object(self, obj, object_id, generation):
+        self._cache.set(self._key(object_id), obj, generation)
+        return obj
+
+    def _invalidate_object(self, obj, object_id=None):
+        if object_id is None and obj is not None:
+            object_id = obj['id']
+        if object_id is not None:
+            self._cache.invalidate(self._key(object_id))
+        return obj
+
+    def _invalidate_results(self, results):
+        for success, obj in results:
+            if success:
+                self._invalidate_object(obj)
+        return results
+
+    def _fetch(self, obj, object_id, generation):
+        d = maybeDeferred(lambda: obj)
+        d.addCallback(self._cache_object, object_id, generation)
+        return d
+
+    def get(self, object_id, fields=None):
+        obj = self._cache.get(self._key(object_id), _MISSING)
+        if obj is not _MISSING:
+            return succeed(project_object(obj, fields))
+        generation = self._cache.generation
+        # Whole objects are fetched and cached, so that they can be used for
+        # requests for any set of fields.
+        d = self._fetch(
+            self._collection.get(object_id), object_id, generation)
+        if fields is not None:
+            d.addCallback(project_object, fields)
+        return d
+
+    # Versions of cached objects are found without a backend call, and
+    # uncached objects are fetched and cached to find theirs, so a caller
+    # that goes on to get the object doesn't call the backend again.
+    cheap_versions = True
+
+    def _version(self, obj):
+        return None if obj is None else object_version(obj)
+
+    def get_version(self, object_id):
+        d = self.get(object_id)
+        d.addCallback(self._version)
+        return d
+
+    def _merge_many(self, fetched, object_ids, objs, generation):
+        fetched = iter(fetched)
+        for i, object_id in enumerate(object_ids):
+            if objs[i] is _MISSING:
+                objs[i] = self._fetch(next(fetched), object_id, generation)
+        return objs
+
+    def get_many(self, object_ids):
+        objs = [self._cache.get(self._key(object_id), _MISSING)
+                for object_id in object_ids]
+        missing_ids = [
+            object_id for object_id, obj in zip(object_ids, objs)
+            if obj is _MISSING]
+        generation = self._cache.generation
+        d = maybeDeferred(self._collection.get_many, missing_ids)
+        d.addCallback(self._merge_many, object_ids, objs, generation)
+        return d
+
+    def create(self, object_id, data):
+        d = maybeDeferred(self._collection.create, object_id, data)
+        d.addCallback(self._invalidate_object, object_id)
+        return d
+
+    def create_many(self, objects):
+        d = maybeDeferred(self._collection.create_many, objects)
+        d.addCallback(self._invalidate_results)
+        return d
+
+    def update(self, object_id, data, version=None, blind=None):
+        d = maybeDeferred(
+            self._collection.update, object_id, data, version, blind)
+        d.addBoth(self._invalidate_object, object_id)
+        return d
+
+    def delete(self, object_id, version=None):
+        d = maybeDeferred(self._collection.delete, object_id, version)
+        d.addBoth(self._invalidate_object, object_id)
+        return d
+
+
+@implementer(IStoreBackend)
+class CachedCollectionBackend(object):
+    """
+    A backend that caches objects read from another backend.
+
+    Writes made through this backend invalidate the cached objects they
+    affect. Writes made through other processes are only seen once cached
+    objects expire, so ``ttl`` should be set if there is more than one
+    process.
+
+    :param backend:
+        The IStoreBackend provider to cache objects from.
+    :param int max_size:
+        Maximum number of objects to cache.
+    :param float ttl:
+        Number of seconds to cache objects for, or ``None`` to cache them
+        until they're evicted or invalidated.
+    :param reactor:
+        Used to tell the time. Defaults to the global reactor.
+    :param metrics:
+        If given, a :class:`go_store_service.metrics.MetricsRegistry` to
+        count cache hits, misses and evictions in. See :class:`LRUCache`.
+    """
+
+    def __init__(self, backend, max_size, ttl=None, reactor=None,
+                 metrics=None):
+        self.backend = IStoreBackend(backend)
+        self.cache = LRUCache(
+            max_size, ttl=ttl, reactor=reactor, metrics=metrics)
+
+    def get_store_collection(self, owner_id):
+        return CachedCollection(
+            self.backend.get_store_collection(owner_id), self.cache,
+            ('stores', owner_id))
+
+    def get_row_collection(self, owner_id, store_id):
+        return CachedCollection(
+            self.backend.get_row_collection(owner_id, store_id), self.cache,
+            ('rows', owner_id, store_id))
+
+    def get_store_stats(self, owner_id, store_id):
+        return self.backend.get_store_stats(owner_id, store_id)
@@ -0,0 +1,324 @@
+from twisted.internet.defer import (
+    Deferred, DeferredList, DeferredSemaphore, inlineCallbacks, maybeDeferred,
+    succeed)
+from twisted.internet.task import deferLater
+from twisted.python import log
+from zope.interface import implementer
+
+from go_store_service.collections.forwarding import ForwardingCollection
+from go_store_service.interfaces import ICollection, IStoreBackend
+
+
+class RateLimiter(object):
+    """
+    Spaces out work so that at most ``rate`` units of it are started per
+    second, however many jobs share the limiter.
+
+    :param float rate:
+        Maximum number of units of work to start per second.
+    :param reactor:
+        Used to tell the time and to wait. Defaults to the global reactor.
+    """
+
+    def __init__(self, rate, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.rate = rate
+        self.reactor = reactor
+        self._next_start = None
+
+    def wait(self, count):
+        """
+        Reserve ``count`` units of work.
+
+        :returns:
+            A deferred that fires when the work may be started.
+        """
+        now = self.reactor.seconds()
+        start = now
+        if self._next_start is not None:
+            start = max(start, self._next_start)
+        self._next_start = start + count / float(self.rate)
+        if start <= now:
+            return succeed(None)
+        return deferLater(self.reactor, start - now, lambda: None)
+
+
+class DeletionJob(object):
+    """
+    A background job that deletes every row in a row collection.
+
+    The rows are listed a page at a time, using the collection's index of
+    the store's keys, and each page is deleted before the next is listed,
+    so the job never holds more than a page of keys. Rows created while the
+    job is running may or may not be deleted.
+
+    :param rows:
+        The ICollection provider to delete rows from.
+    :param int batch_size:
+        Number of rows to list and delete at a time.
+    :param int concurrency:
+        Maximum number of deletes to have in flight at once.
+    :param RateLimiter limiter:
+        The limiter to limit the rate of deletes with, or ``None`` to delete
+        rows as fast as the backend allows.
+    :param reactor:
+        Used to tell the time. Defaults to the global reactor.
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, rows, batch_size, concurrency, limiter=None,
+                 reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.rows = ICollection(rows)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.limiter = limiter
+        self.reactor = reactor
+        self.state = self.PENDING
+        self.total = None
+        self.deleted = 0
+        self.failed = 0
+        self.started = None
+        self.finished = None
+        self._waiters = []
+
+    def is_finished(self):
+        return self.state in (self.DONE, self.FAILED)
+
+    def wait(self):
+        """
+        Return a deferred that fires once the job has finished.
+        """
+        if self.is_finished():
+            return succeed(None)
+        d = Deferred()
+        self._waiters.append(d)
+        return d
+
+    def status(self):
+        """
+        Return a dict describing the job's progress. The ``total`` is the
+        number of rows found so far, which is only final once the job has
+        finished.
+        """
+        return {
+            "status": self.state,
+            "total": self.total,
+            "deleted": self.deleted,
+            "failed": self.failed,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+    def _count_results(self, results):
+        for success, result in results:
+            if success:
+                self.deleted += 1
+            else:
+                self.failed += 1
+                log.err(result, "Failed to delete row.")
+
+    @inlineCallbacks
+    def _delete_batch(self, object_ids):
+        if self.limiter is not None:
+            yield self.limiter.wait(len(object_ids))
+        semaphore = DeferredSemaphore(self.concurrency)
+        results = yield DeferredList([
+            semaphore.run(maybeDeferred, self.rows.delete, object_id)
+            for object_id in object_ids], consumeErrors=True)
+        self._count_results(results)
+
+    @inlineCallbacks
+    def _run(self):
+        self.total = 0
+        cursor = None
+        while True:
+            # The cursor is after the last key listed, so deleting the rows
+            # it has passed doesn't change the pages that are still to come.
+            object_ids, cursor = yield maybeDeferred(
+                self.rows.page_keys, self.batch_size, cursor)
+            self.total += len(object_ids)
+            if object_ids:
+                yield self._delete_batch(object_ids)
+            if cursor is None:
+                break
+
+    def _finish(self, _result):
+        self.finished = self.reactor.seconds()
+        if self.state == self.RUNNING:
+            self.state = self.DONE
+        waiters, self._waiters = self._waiters, []
+        for d in waiters:
+            d.callback(None)
+
+    def _fail(self, failure):
+        self.state = self.FAILED
+        log.err(failure, "Failed to delete rows.")
+
+    def run(self):
+        """
+        Delete the rows.
+
+        :returns:
+            A deferred that fires once the job has finished. It never fails,
+            the job's status says whether it succeeded.
+        """
+        self.state = self.RUNNING
+        self.started = self.reactor.seconds()
+        d = self._run()
+        d.addErrback(self._fail)
+        d.addBoth(self._finish)
+        return d
+
+
+class DeletionJobs(object):
+    """
+    The row deletion jobs for deleted stores.
+
+    :param int batch_size:
+        Number of rows each job deletes in a batch.
+    :param int concurrency:
+        Maximum number of deletes each job has in flight at once.
+    :param float rate:
+        Maximum number of rows to delete per second across all jobs, or
+        ``None``.
+    :param float keep_for:
+        Number of seconds to keep the status of finished jobs for.
+    :param reactor:
+        Used to tell the time. Defaults to the global reactor.
+    """
+
+    DEFAULT_BATCH_SIZE = 100
+    DEFAULT_CONCURRENCY = 8
+    DEFAULT_KEEP_FOR = 3600
+
+    def __init__(self, batch_size=None, concurrency=None, rate=None,
+                 keep_for=None, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        if batch_size is None:
+            batch_size = self.DEFAULT_BATCH_SIZE
+        if concurrency is None:
+            concurrency = self.DEFAULT_CONCURRENCY
+        if keep_for is None:
+            keep_for = self.DEFAULT_KEEP_FOR
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate = rate
+        self.limiter = None
+        if rate is not None:
+            # One limiter is shared by all jobs, so that deleting several
+            # stores at once doesn't multiply the load on the backend.
+            self.limiter = RateLimiter(rate, reactor=reactor)
+        self.keep_for = keep_for
+        self.reactor = reactor
+        self._jobs = {}
+
+    def _forget_old_jobs(self):
+        expired = self.reactor.seconds() - self.keep_for
+        for key, job in self._jobs.items():
+            if job.is_finished() and job.finished <= expired:
+                del self._jobs[key]
+
+    def get(self, owner_id, store_id):
+        """
+        Return the :class:`DeletionJob` for a store, or ``None`` if there
+        isn't one.
+        """
+        self._forget_old_jobs()
+        return self._jobs.get((owner_id, store_id))
+
+    def start(self, owner_id, store_id, rows):
+        """
+        Start deleting a store's rows, unless they're already being deleted.
+
+        :param rows:
+            The store's row collection.
+        :returns:
+            The :class:`DeletionJob` deleting the rows.
+        """
+        self._forget_old_jobs()
+        key = (owner_id, store_id)
+        job = self._jobs.get(key)
+        if job is not None and not job.is_finished():
+            return job
+        job = self._jobs[key] = DeletionJob(
+            rows, self.batch_size, self.concurrency, limiter=self.limiter,
+            reactor=self.reactor)
+        job.run()
+        return job
+
+
+class CascadingStoreCollection(ForwardingCollection):
+    """
+    A collection of stores that deletes a store's rows in the background
+    when the store is deleted.
+
+    :param collection:
+        The ICollection provider for the owner's stores.
+    :param backend:
+        The IStoreBackend provider to get row collections from.
+    :param DeletionJobs jobs:
+        The jobs to start row deletions with.
+    :param str owner_id:
+        The owner of the stores.
+    """
+
+    def __init__(self, collection, backend, jobs, owner_id):
+        super(CascadingStoreCollection, self).__init__(collection)
+        self._backend = backend
+        self._jobs = jobs
+        self.owner_id = owner_id
+
+    def _delete_rows(self, result, store_id):
+        # Rows are deleted even if the store didn't exist, so that rows left
+        # behind by stores deleted without cascading can be cleaned up.
+        self._jobs.start(
+            self.owner_id, store_id,
+            self._backend.get_row_collection(self.owner_id, store_id))
+        return result
+
+    def delete(self, object_id, version=None):
+        d = maybeDeferred(self._collection.delete, object_id, version)
+        d.addCallback(self._delete_rows, object_id)
+        return d
+
+
+@implementer(IStoreBackend)
+class CascadingCollectionBackend(object):
+    """
+    A backend that deletes a store's rows when the store is deleted.
+
+    Rows are deleted by background jobs, so deleting a store doesn't wait
+    for its rows to be deleted. The progress of each job can be checked
+    with :meth:`DeletionJobs.get`.
+
+    :param backend:
+        The IStoreBackend provider to wrap.
+    :param DeletionJobs jobs:
+        The jobs to delete rows with. A new :class:`DeletionJobs` is created
+        if this isn't given.
+    """
+
+    def __init__(self, backend, jobs=None):
+        self.backend = IStoreBackend(backend)
+        if jobs is None:
+            jobs = DeletionJobs()
+        self.jobs = jobs
+
+    def get_store_collection(self, owner_id):
+        return CascadingStoreCollection(
+            self.backend.get_store_collection(owner_id), self.backend,
+            self.jobs, owner_id)
+
+    def get_row_collection(self, owner_id, store_id):
+        return self.backend.get_row_collection(owner_id, store_id)
+
+    def get_store_stats(self, owner_id, store_id):
+        return self.backend.get_store_stats(owner_id, store_id)
@@ -0,0 +1,371 @@
+from collections import OrderedDict
+from uuid import uuid4
+
+from twisted.internet.defer import (
+    Deferred, DeferredList, DeferredSemaphore, maybeDeferred, succeed)
+from twisted.python import log
+from twisted.python.failure import Failure
+from zope.interface import implementer
+
+from go_store_service.collections.forwarding import ForwardingCollection
+from go_store_service.encoding import data_version
+from go_store_service.interfaces import IStoreBackend
+from go_store_service.projection import project_object
+
+
+# Writes are acknowledged once they've been written to the backend.
+DURABILITY_WRITTEN = 'written'
+# Writes are acknowledged as soon as they've been queued. Writes that fail
+# are logged, but the client isn't told.
+DURABILITY_QUEUED = 'queued'
+
+DURABILITY_MODES = (DURABILITY_WRITTEN, DURABILITY_QUEUED)
+
+# How blind each value of an update's ``blind`` argument is. ``None`` uses
+# the backend's default, which might be either.
+_BLINDNESS = {False: 0, None: 1, True: 2}
+
+
+class PendingWrite(object):
+    """
+    A write of an object that later writes to the same object are merged
+    into until it is flushed.
+
+    :param str object_id:
+        The id of the object to write.
+    """
+
+    def __init__(self, object_id):
+        self.object_id = object_id
+        self.collection = None
+        self.data = None
+        self.create = False
+        # Nothing has asked for a write that isn't blind yet.
+        self.blind = True
+        self._waiters = []
+
+    def merge(self, collection, data, create, blind=None):
+        """
+        Replace the data to write. Only the latest data is written.
+
+        :param collection:
+            The ICollection provider to write the object to.
+        :param bool create:
+            If ``True``, the object is written with ``create`` rather than
+            ``update``.
+        :param bool blind:
+            Passed to ``update``. See
+            :meth:`go_store_service.interfaces.ICollection.update`.
+        """
+        self.collection = collection
+        self.data = data
+        # Creating an object overwrites it, but updating a missing object
+        # fails, so a write that creates the object must still create it
+        # once later updates have been merged into it.
+        self.create = self.create or create
+        # The merged update is only as blind as the least blind of the
+        # updates merged into it, so that it's never blind if any of them
+        # asked not to be.
+        self.blind = min(self.blind, blind, key=_BLINDNESS.get)
+
+    def wait(self):
+        """
+        Return a deferred that fires with the result of the write.
+        """
+        d = Deferred()
+        self._waiters.append(d)
+        return d
+
+    def fire(self, result):
+        """
+        Pass the result of the write to everything waiting for it.
+        """
+        waiters, self._waiters = self._waiters, []
+        for d in waiters:
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+
+class WriteQueue(object):
+    """
+    A queue of writes that merges writes to the same object and flushes them
+    in batches.
+
+    A write waits for ``delay`` seconds before it's flushed, and any writes
+    to the same object in that time replace its data, so an object that's
+    written many times a second is only written to the backend once per
+    ``delay``. Writes to the same object are written to the backend in the
+    order they were flushed.
+
+    :param float delay:
+        Number of seconds to wait for writes to merge before flushing them.
+    :param int write_window:
+        Maximum number of writes to have in flight at once.
+    :param reactor:
+        Used to schedule flushes. Defaults to the global reactor.
+    """
+
+    def __init__(self, delay, write_window, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.delay = delay
+        self.reactor = reactor
+        self.writes = 0
+        self.merged = 0
+        self._semaphore = DeferredSemaphore(write_window)
+        self._pending = OrderedDict()
+        self._in_flight = {}
+        self._delayed_flush = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def get(self, key):
+        """
+        Return the latest :class:`PendingWrite` for ``key`` that hasn't
+        finished being written, or ``None`` if there isn't one.
+        """
+        write = self._pending.get(key)
+        if write is None:
+            write = self._in_flight.get(key)
+        return write
+
+    def enqueue(self, key, collection, object_id, data, create=False,
+                blind=None):
+        """
+        Queue a write, merging it into any pending write for the same key.
+
+        :returns:
+            A deferred that fires with the result of the write once it's been
+            flushed.
+        """
+        write = self._pending.get(key)
+        if write is None:
+            write = self._pending[key] = PendingWrite(object_id)
+            if self._delayed_flush is None:
+                self._delayed_flush = self.reactor.callLater(
+                    self.delay, self.flush)
+        else:
+            self.merged += 1
+        write.merge(collection, data, create, blind)
+        return write.wait()
+
+    def flush(self):
+        """
+        Start writing all pending writes.
+
+        :returns:
+            A deferred that fires once they've all been written. Failed
+            writes are reported to their writers, not here.
+        """
+        if self._delayed_flush is not None and self._delayed_flush.active():
+            self._delayed_flush.cancel()
+        self._delayed_flush = None
+        pending, self._pending = self._pending, OrderedDict()
+        return DeferredList([
+            self._start(key, write) for key, write in pending.iteritems()])
+
+    def settle(self, key):
+        """
+        Write any pending write for ``key`` immediately.
+
+        :returns:
+            A deferred that fires once all queued writes for ``key`` have
+            been written. It never fails.
+        """
+        write = self._pending.pop(key, None)
+        if write is not None:
+            return self._start(key, write)
+        write = self._in_flight.get(key)
+        if write is None:
+            return succeed(None)
+        d = write.wait()
+        d.addErrback(lambda _failure: None)
+        return d
+
+    def _start(self, key, write):
+        previous = self._in_flight.get(key)
+        self._in_flight[key] = write
+        if previous is None:
+            d = succeed(None)
+        else:
+            # Wait for the earlier write to the same object so that writes
+            # can't be reordered.
+            d = previous.wait()
+            d.addErrback(lambda _failure: None)
+        d.addCallback(lambda _: self._semaphore.run(self._write, write))
+        d.addBoth(self._finished, key, write)
+        return d
+
+    def _write(self, write):
+        self.writes += 1
+        if write.create:
+            return maybeDeferred(
+                write.collection.create, write.object_id, write.data)
+        return maybeDeferred(
+            write.collection.update, write.object_id, write.data,
+            blind=write.blind)
+
+    def _finished(self, result, key, write):
+        if self._in_flight.get(key) is write:
+            del self._in_flight[key]
+        write.fire(result)
+
+    def stats(self):
+        """
+        Return a dict of queue counters.
+        """
+        return {
+            "pending": len(self._pending),
+            "writes": self.writes,
+            "merged": self.merged,
+        }
+
+
+class CoalescingCollection(ForwardingCollection):
+    """
+    A collection that queues writes to another collection so that repeated
+    writes to the same object can be merged.
+
+    Creates and updates without a version are queued. Updates with a version
+    and deletes are written immediately, after any queued writes to the same
+    object. :meth:`get` and :meth:`get_version` see queued writes, but
+    listings, queries, counts and store stats only see them once they've been
+    written.
+
+    Queued data is shared with the caller and must not be modified.
+
+    :param collection:
+        The ICollection provider to write to.
+    :param WriteQueue queue:
+        The queue to merge writes in.
+    :param tuple prefix:
+        Prefix for this collection's queue keys.
+    :param str durability:
+        When writes are acknowledged. One of :data:`DURABILITY_MODES`.
+    """
+
+    def __init__(self, collection, queue, prefix,
+                 durability=DURABILITY_WRITTEN):
+        if durability not in DURABILITY_MODES:
+            raise ValueError("Invalid durability mode: %r" % (durability,))
+        super(CoalescingCollection, self).__init__(collection)
+        self._queue = queue
+        self._prefix = prefix
+        self.durability = durability
+
+    def _key(self, object_id):
+        return self._prefix + (object_id,)
+
+    def _log_failure(self, failure):
+        log.err(failure, "Queued write failed.")
+
+    def _enqueue(self, object_id, data, create, blind=None):
+        d = self._queue.enqueue(
+            self._key(object_id), self._collection, object_id, data,
+            create=create, blind=blind)
+        if self.durability == DURABILITY_WRITTEN:
+            return d
+        d.addErrback(self._log_failure)
+        return succeed({'id': object_id, 'data': data})
+
+    def get(self, object_id, fields=None):
+        write = self._queue.get(self._key(object_id))
+        if write is not None:
+            return succeed(project_object(
+                {'id': object_id, 'data': write.data}, fields))
+        return self._collection.get(object_id, fields=fields)
+
+    def get_version(self, object_id):
+        write = self._queue.get(self._key(object_id))
+        if write is not None:
+            return succeed(data_version(write.data))
+        return self._collection.get_version(object_id)
+
+    def create(self, object_id, data):
+        if object_id is None:
+            object_id = uuid4().hex
+        return self._enqueue(object_id, data, create=True)
+
+    def create_many(self, objects):
+        return DeferredList([
+            self.create(object_id, data) for object_id, data in objects],
+            consumeErrors=True)
+
+    def update(self, object_id, data, version=None, blind=None):
+        assert object_id is not None  # TODO: Something better than assert.
+        if version is None:
+            return self._enqueue(object_id, data, create=False, blind=blind)
+        d = self._queue.settle(self._key(object_id))
+        d.addCallback(
+            lambda _: self._collection.update(object_id, data, version))
+        return d
+
+    def delete(self, object_id, version=None):
+        d = self._queue.settle(self._key(object_id))
+        d.addCallback(lambda _: self._collection.delete(object_id, version))
+        return d
+
+
+@implementer(IStoreBackend)
+class CoalescingCollectionBackend(object):
+    """
+    A backend that merges repeated writes to the same object within a short
+    window and writes them to another backend in batches.
+
+    This is meant to sit in front of a backend such as
+    :class:`go_store_service.collections.RiakCollectionBackend`, where each
+    write is a round trip, for objects such as counters that are written
+    many times a second. Queued writes are lost if the process exits before
+    they're flushed, so :meth:`flush` should be called before shutting
+    down.
+
+    :param backend:
+        The IStoreBackend provider to write to.
+    :param float delay:
+        Number of seconds to wait for writes to merge before flushing them.
+    :param int write_window:
+        Maximum number of writes to have in flight at once.
+    :param str durability:
+        When writes are acknowledged, either :data:`DURABILITY_WRITTEN`
+        (once they've been written to the backend) or
+        :data:`DURABILITY_QUEUED` (as soon as they've been queued).
+    :param reactor:
+        Used to schedule flushes. Defaults to the global reactor.
+    """
+
+    DEFAULT_DELAY = 0.05
+    DEFAULT_WRITE_WINDOW = 32
+
+    def __init__(self, backend, delay=None, write_window=None,
+                 durability=DURABILITY_WRITTEN, reactor=None):
+        if delay is None:
+            delay = self.DEFAULT_DELAY
+        if write_window is None:
+            write_window = self.DEFAULT_WRITE_WINDOW
+        if durability not in DURABILITY_MODES:
+            raise ValueError("Invalid durability mode: %r" % (durability,))
+        self.backend = IStoreBackend(backend)
+        self.durability = durability
+        self.queue = WriteQueue(delay, write_window, reactor=reactor)
+
+    def flush(self):
+        """
+        Start writing all queued writes. See :meth:`WriteQueue.flush`.
+        """
+        return self.queue.flush()
+
+    def get_store_collection(self, owner_id):
+        return CoalescingCollection(
+            self.backend.get_store_collection(owner_id), self.queue,
+            ('stores', owner_id), durability=self.durability)
+
+    def get_row_collection(self, owner_id, store_id):
+        return CoalescingCollection(
+            self.backend.get_row_collection(owner_id, store_id), self.queue,
+            ('rows', owner_id, store_id), durability=self.durability)
+
+    def get_store_stats(self, owner_id, store_id):
+        return self.backend.get_store_stats(owner_id, store_id)
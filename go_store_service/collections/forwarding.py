@@ -0,0 +1,65 @@
+from zope.interface import implementer
+
+from go_store_service.interfaces import ICollection
+
+
+@implementer(ICollection)
+class ForwardingCollection(object):
+    """
+    A collection that passes every call on to another collection.
+
+    Collections that wrap another collection subclass this and only override
+    the methods they change.
+
+    :param collection:
+        The ICollection provider to pass calls on to.
+    """
+
+    def __init__(self, collection):
+        self._collection = ICollection(collection)
+
+    @property
+    def cheap_versions(self):
+        return self._collection.cheap_versions
+
+    def all_keys(self):
+        return self._collection.all_keys()
+
+    def all(self, fields=None):
+        return self._collection.all(fields=fields)
+
+    def page_keys(self, limit, cursor):
+        return self._collection.page_keys(limit, cursor)
+
+    def page(self, limit, cursor, fields=None):
+        return self._collection.page(limit, cursor, fields=fields)
+
+    def query(self, query, fields=None):
+        return self._collection.query(query, fields=fields)
+
+    def count(self, query=None):
+        return self._collection.count(query)
+
+    def aggregate(self, aggregation, query=None):
+        return self._collection.aggregate(aggregation, query)
+
+    def get(self, object_id, fields=None):
+        return self._collection.get(object_id, fields=fields)
+
+    def get_version(self, object_id):
+        return self._collection.get_version(object_id)
+
+    def get_many(self, object_ids):
+        return self._collection.get_many(object_ids)
+
+    def create(self, object_id, data):
+        return self._collection.create(object_id, data)
+
+    def create_many(self, objects):
+        return self._collection.create_many(objects)
+
+    def update(self, object_id, data, version=None, blind=None):
+        return self._collection.update(object_id, data, version, blind)
+
+    def delete(self, object_id, version=None):
+        return self._collection.delete(object_id, version)
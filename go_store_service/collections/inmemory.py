@@ -1,10 +1,20 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bisect import bisect_left, bisect_right, insort
 from copy import deepcopy
 from uuid import uuid4
 
-from twisted.internet.defer import Deferred
+from twisted.internet.defer import Deferred, fail
+from twisted.python.failure import Failure
 from zope.interface import implementer
 
-from go_store_service.interfaces import ICollection, IStoreBackend
+from go_store_service.encoding import (
+    RawJson, data_size, data_version, json_dumps)
+from go_store_service.interfaces import (
+    ICollection, IStoreBackend, ObjectNotFound, SchemaViolation,
+    VersionConflict)
+from go_store_service.projection import project
+from go_store_service.schema import Schema
 
 
 def defer_async(value, reactor=None):
@@ -15,15 +25,55 @@ def defer_async(value, reactor=None):
     return d
 
 
+def stored_size(value, serialized):
+    """
+    Return the size of an object's data from its stored value. Serialized
+    values are the encoded data, so they don't need to be encoded again.
+    """
+    if serialized:
+        return len(value)
+    return data_size(value)
+
+
 @implementer(ICollection)
 class InMemoryCollection(object):
     """
     A Collection implementation backed by an in-memory dict.
+
+    :param dict data:
+        The dict to store objects in.
+    :param bool serialized:
+        If ``True``, objects are stored as encoded JSON strings rather than
+        as copies of the original objects. Decoding JSON is much cheaper than
+        deep-copying large objects.
+    :param bool raw:
+        If ``True`` (and ``serialized`` is ``True``), objects are read as
+        :class:`go_store_service.encoding.RawJson` without decoding the
+        stored JSON. Raw objects can be written out by handlers but can't be
+        inspected without decoding them.
+    :param dict versions:
+        The dict to cache object versions in. Versions are calculated when
+        they're first needed after an object is written.
+    :param list sorted_ids:
+        The sorted list of object ids to page through. It's kept up to date
+        as objects are written, so it should be shared by all collections
+        for the same dict. If ``None``, it's built the first time a page is
+        fetched.
     """
 
-    def __init__(self, data, reactor=None):
+    # Versions are cached, so finding one doesn't decode the object.
+    cheap_versions = True
+
+    def __init__(self, data, reactor=None, serialized=False, raw=False,
+                 versions=None, sorted_ids=None):
         self._data = data
         self.reactor = reactor
+        self.serialized = serialized
+        self.raw = raw and serialized
+        if versions is None:
+            versions = {}
+        self._versions = versions
+        self._sorted_ids = sorted_ids
 
     def _defer(self, value):
         """
@@ -53,53 +103,387 @@ class InMemoryCollection(object):
         """
         return True
 
+    def _encode_value(self, data):
+        """
+        Convert data into a value that can be stored without being affected by
+        later changes to the original data.
+        """
+        if self.serialized:
+            return json_dumps(data)
+        return deepcopy(data)
+
+    def _decode_value(self, value):
+        """
+        Convert a stored value into data that can be handed out without later
+        changes to it affecting the stored value.
+        """
+        if self.serialized:
+            return json.loads(value)
+        return deepcopy(value)
+
     def _set_data(self, object_id, data):
         key = self._id_to_key(object_id)
-        self._data[key] = deepcopy(data)
-        return self._format_data(object_id, self._data[key])
+        is_new = key not in self._data
+        self._data[key] = self._encode_value(data)
+        self._versions.pop(key, None)
+        if is_new and self._sorted_ids is not None:
+            insort(self._sorted_ids, object_id)
+        # We stored a copy, so we can hand the caller's data back unchanged.
+        return self._format_data(object_id, data)
+
+    def _remove_data(self, object_id):
+        key = self._id_to_key(object_id)
+        if key not in self._data:
+            return
+        del self._data[key]
+        self._versions.pop(key, None)
+        if self._sorted_ids is not None:
+            del self._sorted_ids[bisect_left(self._sorted_ids, object_id)]
 
     def _get_data(self, object_id):
         key = self._id_to_key(object_id)
         if key not in self._data:
             return None
-        return self._format_data(object_id, self._data[key])
+        return self._format_data(
+            object_id, self._decode_value(self._data[key]))
+
+    def _get_projected(self, object_id, fields):
+        """
+        Like :meth:`_get_data`, but only returns the given fields.
+
+        Only the selected fields are copied, so large unselected values
+        aren't copied at all.
+        """
+        key = self._id_to_key(object_id)
+        if key not in self._data:
+            return None
+        value = self._data[key]
+        if self.serialized:
+            # The decoded value is ours, so there's no need to copy it.
+            data = project(json.loads(value), fields)
+        else:
+            data = deepcopy(project(value, fields))
+        return self._format_data(object_id, data)
+
+    def _get_object(self, object_id, fields=None):
+        """
+        Like :meth:`_get_data`, but returns a :class:`RawJson` object if this
+        collection reads raw objects and only returns the given fields if
+        ``fields`` isn't ``None``.
+        """
+        if fields is not None:
+            return self._get_projected(object_id, fields)
+        if not self.raw:
+            return self._get_data(object_id)
+        key = self._id_to_key(object_id)
+        if key not in self._data:
+            return None
+        return RawJson.for_object(
+            object_id, self._data[key], version=self._versions.get(key))
+
+    def _get_version(self, object_id):
+        key = self._id_to_key(object_id)
+        if key not in self._data:
+            return None
+        version = self._versions.get(key)
+        if version is None:
+            value = self._data[key]
+            if self.serialized:
+                value = json.loads(value)
+            # The stored value isn't modified, so there's no need to copy it.
+            version = self._versions[key] = data_version(value)
+        return version
+
+    def _check_version(self, object_id, version):
+        if version is not None and self._get_version(object_id) != version:
+            raise VersionConflict(
+                "Object %r does not have version %r." % (object_id, version))
+
+    def _iter_values(self, object_ids, query=None):
+        """
+        Generate ``(object_id, data)`` tuples for the given objects, leaving
+        out objects that don't exist or don't match ``query``.
+
+        The data is the stored value itself (or its decoded JSON), so it
+        must not be modified or handed out.
+        """
+        for object_id in object_ids:
+            key = self._id_to_key(object_id)
+            if key not in self._data:
+                # Deleted since we listed the keys.
+                continue
+            value = self._data[key]
+            if self.serialized:
+                value = json.loads(value)
+            if query is None or query.matches(value):
+                yield object_id, value
+
+    def _query_ids(self, query):
+        """
+        Return the ids of the objects that might match a query. This may be
+        overridden in subclasses that can narrow down the candidates.
+        """
+        return self._get_keys()
+
+    def _iter_matches(self, object_ids, query, fields):
+        """
+        Generate the objects that match a query. Each object is only checked
+        when the next result is asked for, so results can be streamed out
+        without checking the whole collection first.
+        """
+        for object_id, value in self._iter_values(object_ids, query):
+            if self.serialized and not self.raw:
+                # The decoded value is ours, so we can hand it out.
+                yield self._format_data(object_id, project(value, fields))
+            else:
+                yield self._get_object(object_id, fields)
 
     def _format_data(self, object_id, data):
-        return {'id': object_id, 'data': deepcopy(data)}
+        return {'id': object_id, 'data': data}
 
     def _get_keys(self):
         return [
             self._key_to_id(key) for key in self._data
             if self._is_my_key(key)]
 
+    def _count_keys(self):
+        """
+        Return the number of keys that belong to this collection. This should
+        be overridden in subclasses that override :meth:`_is_my_key`.
+        """
+        return len(self._data)
+
+    def _encode_cursor(self, object_id):
+        return urlsafe_b64encode(json.dumps(object_id))
+
+    def _decode_cursor(self, cursor):
+        try:
+            return json.loads(urlsafe_b64decode(str(cursor)))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor: %r" % (cursor,))
+
+    def _get_sorted_ids(self):
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self._get_keys())
+        return self._sorted_ids
+
+    def _get_page_keys(self, limit, cursor):
+        keys = self._get_sorted_ids()
+        start = 0
+        if cursor is not None:
+            start = bisect_right(keys, self._decode_cursor(cursor))
+        page_keys = keys[start:start + limit]
+        next_cursor = None
+        if start + limit < len(keys):
+            next_cursor = self._encode_cursor(page_keys[-1])
+        return page_keys, next_cursor
+
     def all_keys(self):
         return self._defer(self._get_keys())
 
-    def all(self):
+    def all(self, fields=None):
         return self._defer([
-            self._get_data(object_id) for object_id in self._get_keys()])
-
-    def get(self, object_id):
-        return self._defer(self._get_data(object_id))
+            self._get_object(object_id, fields)
+            for object_id in self._get_keys()])
+
+    def page_keys(self, limit, cursor):
+        try:
+            page = self._get_page_keys(limit, cursor)
+        except ValueError:
+            return fail()
+        return self._defer(page)
+
+    def page(self, limit, cursor, fields=None):
+        try:
+            page_keys, next_cursor = self._get_page_keys(limit, cursor)
+        except ValueError:
+            return fail()
+        return self._defer((
+            [self._get_object(object_id, fields) for object_id in page_keys],
+            next_cursor))
+
+    def query(self, query, fields=None):
+        return self._defer(
+            self._iter_matches(self._query_ids(query), query, fields))
+
+    def count(self, query=None):
+        if query is None:
+            return self._defer(self._count_keys())
+        return self._defer(sum(
+            1 for _ in self._iter_values(self._query_ids(query), query)))
+
+    def aggregate(self, aggregation, query=None):
+        if query is None:
+            object_ids = self._get_keys()
+        else:
+            object_ids = self._query_ids(query)
+        return self._defer(aggregation.aggregate(
+            value for _, value in self._iter_values(object_ids, query)))
+
+    def get(self, object_id, fields=None):
+        if self.raw and fields is None:
+            # Fetching the version caches it, so the raw object is returned
+            # with its version and callers don't have to decode and hash it.
+            self._get_version(object_id)
+        return self._defer(self._get_object(object_id, fields))
+
+    def get_version(self, object_id):
+        return self._defer(self._get_version(object_id))
+
+    def get_many(self, object_ids):
+        return self._defer([
+            self._get_object(object_id) for object_id in object_ids])
 
     def create(self, object_id, data):
         if object_id is None:
             object_id = uuid4().hex
-        response = self._set_data(object_id, data)
+        try:
+            response = self._set_data(object_id, data)
+        except SchemaViolation:
+            return fail()
         return self._defer(response)
 
-    def update(self, object_id, data):
+    def create_many(self, objects):
+        results = []
+        for object_id, data in objects:
+            if object_id is None:
+                object_id = uuid4().hex
+            try:
+                results.append((True, self._set_data(object_id, data)))
+            except Exception:
+                results.append((False, Failure()))
+        return self._defer(results)
+
+    def update(self, object_id, data, version=None, blind=None):
         assert object_id is not None  # TODO: Something better than assert.
-        assert self._id_to_key(object_id) in self._data
-        response = self._set_data(object_id, data)
+        try:
+            # Checking that the object exists is as cheap as not checking, so
+            # blind updates aren't any different here.
+            if self._id_to_key(object_id) not in self._data:
+                raise ObjectNotFound("Object %r not found." % (object_id,))
+            self._check_version(object_id, version)
+            response = self._set_data(object_id, data)
+        except (ObjectNotFound, VersionConflict, SchemaViolation):
+            return fail()
         return self._defer(response)
 
-    def delete(self, object_id):
+    def delete(self, object_id, version=None):
+        try:
+            self._check_version(object_id, version)
+        except VersionConflict:
+            return fail()
         data = self._get_data(object_id)
-        self._data.pop(self._id_to_key(object_id), None)
+        self._remove_data(object_id)
         return self._defer(data)
 
 
+class InMemoryIndex(object):
+    """
+    A sorted index of the entries for a store's indexed fields. See
+    :mod:`go_store_service.schema`.
+
+    :ivar schema:
+        The :class:`go_store_service.schema.Schema` the index was built for.
+    """
+
+    def __init__(self):
+        self.schema = None
+        self._entries = []
+        self._object_entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def reset(self, schema):
+        """
+        Remove all entries and start indexing for a new schema.
+        """
+        self.schema = schema
+        self._entries = []
+        self._object_entries = {}
+
+    def set(self, object_id, entries):
+        """
+        Replace an object's index entries.
+        """
+        self.remove(object_id)
+        for entry in entries:
+            insort(self._entries, (entry, object_id))
+        if entries:
+            self._object_entries[object_id] = entries
+
+    def remove(self, object_id):
+        """
+        Remove an object's index entries.
+        """
+        for entry in self._object_entries.pop(object_id, ()):
+            del self._entries[bisect_left(self._entries, (entry, object_id))]
+
+    def lookup(self, start, end):
+        """
+        Return the ids of objects with entries between ``start`` and ``end``
+        (inclusive), in entry order.
+        """
+        object_ids = []
+        seen = set()
+        i = bisect_left(self._entries, (start,))
+        while i < len(self._entries) and self._entries[i][0] <= end:
+            object_id = self._entries[i][1]
+            if object_id not in seen:
+                seen.add(object_id)
+                object_ids.append(object_id)
+            i += 1
+        return object_ids
+
+
+class InMemoryStats(object):
+    """
+    The stats of a store's rows, updated as rows are written. See
+    :meth:`go_store_service.interfaces.IStoreBackend.get_store_stats`.
+
+    The size of each row is kept, so that the total can be updated without
+    looking at a row's previous data.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.last_modified = None
+        self._sizes = {}
+
+    def set(self, object_id, size, now):
+        """
+        Record that a row was written.
+        """
+        old_size = self._sizes.get(object_id)
+        if old_size is None:
+            self.rows += 1
+        else:
+            self.bytes -= old_size
+        self._sizes[object_id] = size
+        self.bytes += size
+        self.last_modified = now
+
+    def remove(self, object_id, now):
+        """
+        Record that a row was deleted.
+        """
+        size = self._sizes.pop(object_id, None)
+        if size is None:
+            return
+        self.rows -= 1
+        self.bytes -= size
+        self.last_modified = now
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "last_modified": self.last_modified,
+            "approximate": False,
+        }
+
+
 @implementer(ICollection)
 class InMemoryStoreCollection(InMemoryCollection):
     """
@@ -107,9 +491,17 @@ class InMemoryStoreCollection(InMemoryCollection):
     Forgets things easily.
     """
 
-    def __init__(self, data, owner_id, reactor=None):
+    def __init__(self, data, owner_id, reactor=None, serialized=False,
+                 raw=False, versions=None, sorted_ids=None):
         self.owner_id = owner_id
-        super(InMemoryStoreCollection, self).__init__(data, reactor=reactor)
+        super(InMemoryStoreCollection, self).__init__(
+            data, reactor=reactor, serialized=serialized, raw=raw,
+            versions=versions, sorted_ids=sorted_ids)
+
+    def _set_data(self, object_id, data):
+        # Check the schema before anything is written.
+        Schema.from_store_data(data)
+        return super(InMemoryStoreCollection, self)._set_data(object_id, data)
 
 
 @implementer(ICollection)
@@ -117,46 +509,195 @@ class InMemoryRowCollection(InMemoryCollection):
     """
     A table of rows belonging to a store.
     Forgets things easily.
+
+    Fields declared as indexed in the store's schema are indexed when rows
+    are written, and queries on those fields only check the rows the index
+    selects. If the schema changes, the index is rebuilt the next time it's
+    used.
+
+    :param get_schema:
+        Callable that returns the store's current
+        :class:`go_store_service.schema.Schema`. If ``None``, no fields are
+        indexed.
+    :param InMemoryIndex index:
+        The index to maintain. It should be shared by all collections for
+        the same store.
+    :param InMemoryStats stats:
+        The store's stats, to update as rows are written. They should be
+        shared by all collections for the same store.
     """
 
-    def __init__(self, data, owner_id, store_id, reactor=None):
+    def __init__(self, data, owner_id, store_id, reactor=None,
+                 serialized=False, raw=False, versions=None, get_schema=None,
+                 index=None, stats=None, sorted_ids=None):
         self.owner_id = owner_id
         self.store_id = store_id
-        super(InMemoryRowCollection, self).__init__(data, reactor=reactor)
-
-    def _id_to_key(self, object_id):
-        """
-        Convert object_id into a key for the internal datastore.
-        """
-        return (self.store_id, object_id)
-
-    def _key_to_id(self, key):
+        if get_schema is None:
+            get_schema = Schema
+        self._get_schema = get_schema
+        if index is None:
+            index = InMemoryIndex()
+        self._index = index
+        if stats is None:
+            stats = InMemoryStats()
+        self._stats = stats
+        super(InMemoryRowCollection, self).__init__(
+            data, reactor=reactor, serialized=serialized, raw=raw,
+            versions=versions, sorted_ids=sorted_ids)
+
+    def _get_index(self):
         """
-        Convert an internal datastore key into an object_id.
+        Return the index, rebuilding it first if the schema has changed.
         """
-        store_id, object_id = key
-        assert store_id == self.store_id
-        return object_id
+        schema = self._get_schema()
+        if self._index.schema != schema:
+            self._index.reset(schema)
+            for key, value in self._data.iteritems():
+                if self.serialized:
+                    value = json.loads(value)
+                # Rows written before the schema was declared might not match
+                # it, so fields with the wrong type are left out.
+                self._index.set(
+                    self._key_to_id(key),
+                    schema.index_entries(value, strict=False))
+        return self._index
 
-    def _is_my_key(self, key):
-        """
-        Exclude keys for rows belonging to different stores.
-        """
-        store_id, _object_id = key
-        return store_id == self.store_id
+    def _set_data(self, object_id, data):
+        index = self._get_index()
+        # This checks the data against the schema before anything is written.
+        entries = index.schema.index_entries(data)
+        response = super(InMemoryRowCollection, self)._set_data(
+            object_id, data)
+        index.set(object_id, entries)
+        value = self._data[self._id_to_key(object_id)]
+        self._stats.set(
+            object_id, stored_size(value, self.serialized), self._seconds())
+        return response
+
+    def _remove_data(self, object_id):
+        super(InMemoryRowCollection, self)._remove_data(object_id)
+        self._index.remove(object_id)
+        self._stats.remove(object_id, self._seconds())
+
+    def _seconds(self):
+        reactor = self.reactor
+        if reactor is None:
+            from twisted.internet import reactor
+        return reactor.seconds()
+
+    def _query_ids(self, query):
+        index = self._get_index()
+        entry_range = index.schema.index_range(query)
+        if entry_range is None:
+            return super(InMemoryRowCollection, self)._query_ids(query)
+        return index.lookup(*entry_range)
 
 
 @implementer(IStoreBackend)
 class InMemoryCollectionBackend(object):
-    def __init__(self, stores):
+    """
+    A backend that keeps everything in a dict.
+
+    Stores are kept in ``stores['stores'][owner_id]`` and rows are kept in
+    ``stores['rows'][owner_id][store_id]``, so each collection only ever
+    touches its own objects.
+
+    :param dict stores:
+        The dict to store everything in.
+    :param bool serialized:
+        If ``True``, objects are stored as encoded JSON strings. See
+        :class:`InMemoryCollection`.
+    :param bool raw:
+        If ``True`` (and ``serialized`` is ``True``), objects are read as
+        pre-encoded JSON. See :class:`InMemoryCollection`.
+    :param reactor:
+        Used to fire results and tell the time. Defaults to the global
+        reactor.
+    """
+
+    def __init__(self, stores, serialized=False, raw=False, reactor=None):
         self._stores = stores
+        self.serialized = serialized
+        self.raw = raw
+        self.reactor = reactor
         self._stores.setdefault('stores', {})
         self._stores.setdefault('rows', {})
+        # Cached object versions, laid out the same way as the objects.
+        self._versions = {'stores': {}, 'rows': {}}
+        # Row indexes and parsed store schemas, by (owner_id, store_id).
+        self._indexes = {}
+        self._schemas = {}
+        # Row stats, by (owner_id, store_id).
+        self._stats = {}
+        # Sorted object ids for paging, by ('stores', owner_id) or
+        # ('rows', owner_id, store_id).
+        self._sorted_ids = {}
+
+    def _get_schema(self, owner_id, store_id):
+        """
+        Return the schema of a store. The parsed schema is cached until the
+        store is written to.
+        """
+        value = self._stores['stores'].get(owner_id, {}).get(store_id)
+        cached = self._schemas.get((owner_id, store_id))
+        if cached is not None and cached[0] is value:
+            return cached[1]
+        data = value
+        if self.serialized and value is not None:
+            data = json.loads(value)
+        schema = Schema.from_store_data(data)
+        self._schemas[(owner_id, store_id)] = (value, schema)
+        return schema
+
+    def _get_stats(self, owner_id, store_id):
+        """
+        Return the stats of a store's rows. Rows that were already in the
+        dict the backend was created with are counted the first time the
+        stats are needed.
+        """
+        stats = self._stats.get((owner_id, store_id))
+        if stats is None:
+            stats = self._stats[(owner_id, store_id)] = InMemoryStats()
+            rows = self._stores['rows'].get(owner_id, {}).get(store_id, {})
+            for object_id, value in rows.iteritems():
+                stats.set(
+                    object_id, stored_size(value, self.serialized), None)
+        return stats
+
+    def _get_sorted_ids(self, key, objects):
+        """
+        Return the sorted ids of the objects in a dict. They're sorted the
+        first time they're needed and kept up to date by the collections
+        after that.
+        """
+        sorted_ids = self._sorted_ids.get(key)
+        if sorted_ids is None:
+            sorted_ids = self._sorted_ids[key] = sorted(objects)
+        return sorted_ids
 
     def get_store_collection(self, owner_id):
         stores = self._stores['stores'].setdefault(owner_id, {})
-        return InMemoryStoreCollection(stores, owner_id)
+        versions = self._versions['stores'].setdefault(owner_id, {})
+        return InMemoryStoreCollection(
+            stores, owner_id, reactor=self.reactor,
+            serialized=self.serialized, raw=self.raw, versions=versions,
+            sorted_ids=self._get_sorted_ids(('stores', owner_id), stores))
 
     def get_row_collection(self, owner_id, store_id):
-        rows = self._stores['rows'].setdefault(owner_id, {})
-        return InMemoryRowCollection(rows, owner_id, store_id)
+        owner_rows = self._stores['rows'].setdefault(owner_id, {})
+        rows = owner_rows.setdefault(store_id, {})
+        owner_versions = self._versions['rows'].setdefault(owner_id, {})
+        versions = owner_versions.setdefault(store_id, {})
+        index = self._indexes.setdefault(
+            (owner_id, store_id), InMemoryIndex())
+        return InMemoryRowCollection(
+            rows, owner_id, store_id, reactor=self.reactor,
+            serialized=self.serialized, raw=self.raw, versions=versions,
+            get_schema=lambda: self._get_schema(owner_id, store_id),
+            index=index, stats=self._get_stats(owner_id, store_id),
+            sorted_ids=self._get_sorted_ids(
+                ('rows', owner_id, store_id), rows))
+
+    def get_store_stats(self, owner_id, store_id):
+        return defer_async(
+            self._get_stats(owner_id, store_id).as_dict(), self.reactor)
@@ -0,0 +1,124 @@
+from twisted.internet.defer import maybeDeferred
+from zope.interface import implementer
+
+from go_store_service.collections.forwarding import ForwardingCollection
+from go_store_service.interfaces import IStoreBackend
+
+
+class InstrumentedCollection(ForwardingCollection):
+    """
+    A collection that records how long calls to another collection take.
+
+    Call durations are recorded in the ``store_backend_duration_seconds``
+    histogram, labelled with the collection type and method name. For methods
+    that return iterables of deferreds (such as :meth:`all`), only the time
+    taken to return the iterable is recorded.
+
+    :param collection:
+        The ICollection provider to instrument.
+    :param histogram:
+        The :class:`go_store_service.metrics.Histogram` to record call
+        durations in.
+    :param str collection_type:
+        Label for the kind of collection, e.g. ``'stores'`` or ``'rows'``.
+    :param reactor:
+        Used to tell the time. Defaults to the global reactor.
+    """
+
+    def __init__(self, collection, histogram, collection_type, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        super(InstrumentedCollection, self).__init__(collection)
+        self._histogram = histogram
+        self._collection_type = collection_type
+        self.reactor = reactor
+
+    def _record(self, result, method, start):
+        self._histogram.observe(
+            self.reactor.seconds() - start, (self._collection_type, method))
+        return result
+
+    def _call(self, method, *args):
+        start = self.reactor.seconds()
+        d = maybeDeferred(getattr(self._collection, method), *args)
+        d.addBoth(self._record, method, start)
+        return d
+
+    def all_keys(self):
+        return self._call('all_keys')
+
+    def all(self, fields=None):
+        return self._call('all', fields)
+
+    def page_keys(self, limit, cursor):
+        return self._call('page_keys', limit, cursor)
+
+    def page(self, limit, cursor, fields=None):
+        return self._call('page', limit, cursor, fields)
+
+    def query(self, query, fields=None):
+        return self._call('query', query, fields)
+
+    def count(self, query=None):
+        return self._call('count', query)
+
+    def aggregate(self, aggregation, query=None):
+        return self._call('aggregate', aggregation, query)
+
+    def get(self, object_id, fields=None):
+        return self._call('get', object_id, fields)
+
+    def get_version(self, object_id):
+        return self._call('get_version', object_id)
+
+    def get_many(self, object_ids):
+        return self._call('get_many', object_ids)
+
+    def create(self, object_id, data):
+        return self._call('create', object_id, data)
+
+    def create_many(self, objects):
+        return self._call('create_many', objects)
+
+    def update(self, object_id, data, version=None, blind=None):
+        return self._call('update', object_id, data, version, blind)
+
+    def delete(self, object_id, version=None):
+        return self._call('delete', object_id, version)
+
+
+@implementer(IStoreBackend)
+class InstrumentedCollectionBackend(object):
+    """
+    A backend that records how long calls to another backend's collections
+    take.
+
+    :param backend:
+        The IStoreBackend provider to instrument.
+    :param metrics:
+        The :class:`go_store_service.metrics.MetricsRegistry` to record
+        metrics in.
+    :param reactor:
+        Used to tell the time. Defaults to the global reactor.
+    """
+
+    def __init__(self, backend, metrics, reactor=None):
+        self.backend = IStoreBackend(backend)
+        self.histogram = metrics.histogram(
+            'store_backend_duration_seconds',
+            'Time taken by collection method calls.',
+            ('collection', 'method'))
+        self.reactor = reactor
+
+    def get_store_collection(self, owner_id):
+        return InstrumentedCollection(
+            self.backend.get_store_collection(owner_id), self.histogram,
+            'stores', reactor=self.reactor)
+
+    def get_row_collection(self, owner_id, store_id):
+        return InstrumentedCollection(
+            self.backend.get_row_collection(owner_id, store_id),
+            self.histogram, 'rows', reactor=self.reactor)
+
+    def get_store_stats(self, owner_id, store_id):
+        return self.backend.get_store_stats(owner_id, store_id)
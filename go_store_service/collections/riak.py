@@ -1,27 +1,477 @@
+from collections import deque
+from functools import partial
 from uuid import uuid4
 
-from twisted.internet.defer import inlineCallbacks, returnValue
-from vumi.persist.fields import Json
-from vumi.persist.model import Model
+from twisted.internet.defer import (
+    Deferred, DeferredList, DeferredLock, DeferredSemaphore, fail,
+    inlineCallbacks, returnValue, succeed)
+from twisted.python import log
+from vumi.persist.fields import Boolean, Integer, Json, Unicode
+from vumi.persist.model import Model, ModelMigrator
 from zope.interface import implementer
 
-from go_store_service.interfaces import ICollection, IStoreBackend
+from go_store_service.aggregation import Aggregation
+from go_store_service.collections.cached import LRUCache
+from go_store_service.encoding import data_size, data_version
+from go_store_service.interfaces import (
+    ICollection, IStoreBackend, ObjectNotFound, SchemaViolation,
+    VersionConflict)
+from go_store_service.projection import project_object
+from go_store_service.schema import Schema
+
+
+# Secondary index holding the entries for the fields indexed by store
+# schemas. Entries are prefixed with the store id, so that each store's
+# entries sort together.
+SCHEMA_INDEX = 'schema_bin'
+
+
+def _to_unicode(value):
+    """
+    Index fields are :class:`Unicode` fields, so ids that arrive as byte
+    strings need to be decoded before they're stored.
+    """
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+
+def model_version(model_obj):
+    """
+    Return the version of a loaded model object, or ``None`` if there is no
+    object.
+
+    The object has to be loaded to calculate its version, because the Riak
+    manager doesn't give us access to object metadata without loading it.
+    """
+    if model_obj is None:
+        return None
+    return data_version(model_obj.data)
+
+
+def check_update(model_obj, object_id, version):
+    """
+    Raise :class:`ObjectNotFound` if the object being updated doesn't exist,
+    or :class:`VersionConflict` if ``version`` is given and doesn't match its
+    version.
+    """
+    if model_obj is None:
+        raise ObjectNotFound("Object %r not found." % (object_id,))
+    check_version(model_obj, object_id, version)
+
+
+def riak_object(model_obj, client=False):
+    """
+    Return the Riak object behind a vumi model object: vumi's wrapper, or
+    if ``client`` is ``True``, the Riak client's object that it wraps.
+
+    Vumi doesn't expose either, so this relies on vumi's internals. It's the
+    only place that does, so that if they change the error says what broke
+    rather than being an :exc:`AttributeError` from wherever the object was
+    used.
+
+    :raises RuntimeError:
+        If the model object doesn't have the expected attributes.
+    """
+    path = ('_riak_object', '_riak_obj') if client else ('_riak_object',)
+    obj = model_obj
+    for attr in path:
+        try:
+            obj = getattr(obj, attr)
+        except AttributeError:
+            raise RuntimeError(
+                "Can't find %s on %r. The Riak collection backend relies on"
+                " vumi model objects keeping their Riak object there." % (
+                    '.'.join(path), model_obj))
+    return obj
+
+
+def get_vclock(model_obj):
+    """
+    Return the vclock of a loaded or saved model object. Models don't
+    expose it, so it's read from the Riak client's object.
+    """
+    return riak_object(model_obj, client=True).vclock
+
+
+def set_vclock(model_obj, vclock):
+    """
+    Set the vclock a model object is saved with, so that the save replaces
+    the version of the object the vclock came from.
+    """
+    riak_object(model_obj, client=True).vclock = vclock
+
+
+def unindexed_fields(store_model, schema):
+    """
+    Return the fields (and their index types) of a store's new schema whose
+    index entries haven't been built for all of the store's rows, as a dict
+    or ``None``.
+
+    Fields that were indexed with the same type by the store's old schema
+    already have their entries, unless they're still waiting for them.
+    """
+    try:
+        old_schema = Schema.from_store_data(store_model.data)
+    except SchemaViolation:
+        # Stores written before schemas were checked might not have a valid
+        # one, in which case none of their fields were indexed.
+        old_schema = Schema()
+    unindexed = dict(store_model.unindexed or {})
+    for path, index_type in schema.indexes.iteritems():
+        if old_schema.indexes.get(path) != index_type:
+            unindexed[path] = index_type
+    unindexed = dict(
+        (path, index_type) for path, index_type in unindexed.iteritems()
+        if schema.indexes.get(path) == index_type)
+    return unindexed or None
+
+
+def check_version(model_obj, object_id, version):
+    """
+    Raise :class:`VersionConflict` if ``version`` is given and doesn't match
+    the loaded object's version.
+    """
+    if version is not None and model_version(model_obj) != version:
+        raise VersionConflict(
+            "Object %r does not have version %r." % (object_id, version))
+
+
+def match_object(obj, query, fields):
+    """
+    Return ``obj``, projected to the given fields, if it matches the query.
+    Otherwise return ``None``.
+
+    Objects are stored as single JSON documents that Riak can't look inside
+    without MapReduce, so queries are evaluated here after loading each
+    object.
+    """
+    if obj is None or not query.matches(obj['data']):
+        return None
+    return project_object(obj, fields)
+
+
+@inlineCallbacks
+def aggregate_objects(objs, aggregation):
+    """
+    Aggregate the data of objects as they're fetched. Only the running
+    totals are kept, so each object can be discarded once it's been added.
+
+    Aggregating with Riak's MapReduce would need custom map and reduce
+    functions to be installed on the cluster, so objects are fetched and
+    aggregated here instead.
+
+    :param objs:
+        Iterable of deferreds that fire with objects or ``None``, such as
+        the iterables returned by :func:`pipelined_fetch`.
+    :param aggregation:
+        The :class:`go_store_service.aggregation.Aggregation` to apply.
+    """
+    aggregator = aggregation.aggregator()
+    for obj_deferred in objs:
+        obj = yield obj_deferred
+        if obj is not None:
+            aggregator.add(obj['data'])
+    returnValue(aggregator.results())
+
+
+def _result_count(results):
+    [result] = results
+    return result['count']
+
+
+def pipelined_fetch(fetch, keys, window):
+    """
+    Fetch objects for a sequence of keys, keeping up to ``window`` fetches in
+    flight at once.
+
+    Results are yielded in key order. Each fetch is started before the
+    results of earlier fetches are consumed, so a consumer that waits on each
+    result in turn only waits for roughly ``len(keys) / window`` round trips.
+
+    :param fetch:
+        Callable that takes a key and returns a deferred.
+    :param keys:
+        Iterable of keys to fetch.
+    :param int window:
+        Maximum number of fetches to have in flight at once.
+    """
+    # This is a generator, it shouldn't have @inlineCallbacks.
+    pending = deque()
+    for key in keys:
+        pending.append(fetch(key))
+        if len(pending) >= window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+def bounded_calls(func, args_list, window):
+    """
+    Call a function for each set of arguments, keeping up to ``window`` calls
+    in flight at once.
+
+    :param func:
+        Callable that returns a deferred.
+    :param args_list:
+        Iterable of argument tuples to call ``func`` with.
+    :param int window:
+        Maximum number of calls to have in flight at once.
+    :returns:
+        A deferred that fires with a list of ``(success, result)`` tuples in
+        the same order as ``args_list``.
+    """
+    semaphore = DeferredSemaphore(window)
+    return DeferredList(
+        [semaphore.run(func, *args) for args in args_list],
+        consumeErrors=True)
+
+
+class StoreDataMigrator(ModelMigrator):
+    def migrate_from_unversioned(self, mdata):
+        """
+        Unversioned stores have no owner index. We can't recover the owner
+        from the object itself, so ``owner_id`` is left empty until the store
+        is reindexed with :meth:`StoreCollection.reindex`.
+        """
+        mdata.set_value('$VERSION', 1)
+        mdata.copy_values('data')
+        mdata.set_value('owner_id', None, index='owner_id_bin')
+        return mdata
+
+    def migrate_from_1(self, mdata):
+        """
+        Version 2 keeps track of indexed fields whose indexes are still
+        being built. Older stores had to be reindexed by hand when their
+        schema changed, so their indexes are assumed to have been built.
+        """
+        mdata.set_value('$VERSION', 2)
+        mdata.copy_values('owner_id', 'data')
+        mdata.copy_indexes('owner_id_bin')
+        mdata.set_value('unindexed', None)
+        return mdata
 
 
 class StoreData(Model):
+    VERSION = 2
+    MIGRATOR = StoreDataMigrator
+
+    owner_id = Unicode(index=True, null=True)
     data = Json(null=True)
+    # Fields (and their index types) that are indexed by the store's schema
+    # but whose index entries haven't been built for all of the store's rows
+    # yet. See :meth:`RowCollection.reindex_schema`.
+    unindexed = Json(null=True)
+
+
+class RowDataMigrator(ModelMigrator):
+    def migrate_from_unversioned(self, mdata):
+        """
+        Unversioned rows have no indexes. The ``store_id`` is recovered from
+        the row key, but ``owner_id`` is left empty until the row is
+        reindexed with :meth:`RowCollection.reindex`.
+        """
+        store_id, _sep, _object_id = mdata.riak_object.key.partition(':')
+        mdata.set_value('$VERSION', 1)
+        mdata.copy_values('data')
+        mdata.set_value('owner_id', None, index='owner_id_bin')
+        mdata.set_value('store_id', store_id, index='store_id_bin')
+        return mdata
 
 
 class RowData(Model):
+    VERSION = 1
+    MIGRATOR = RowDataMigrator
+
+    owner_id = Unicode(index=True, null=True)
+    store_id = Unicode(index=True, null=True)
     data = Json(null=True)
 
 
+class StoreStatsData(Model):
+    """
+    The stats of a store's rows, keyed by store id. See
+    :meth:`go_store_service.interfaces.IStoreBackend.get_store_stats`.
+    """
+
+    rows = Integer(default=0)
+    bytes = Integer(default=0)
+    # Seconds since the epoch, which a Timestamp field can't hold.
+    last_modified = Json(null=True)
+    approximate = Boolean(default=False)
+
+
+def format_stats(stats_model):
+    """
+    Return the stats held by a :class:`StoreStatsData` object, or zero
+    counts if there isn't one.
+    """
+    if stats_model is None:
+        return {
+            "rows": 0,
+            "bytes": 0,
+            "last_modified": None,
+            "approximate": False,
+        }
+    return {
+        "rows": stats_model.rows,
+        "bytes": stats_model.bytes,
+        "last_modified": stats_model.last_modified,
+        "approximate": stats_model.approximate,
+    }
+
+
+class StatsChange(object):
+    """
+    Changes to a store's stats that haven't been written yet.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.last_modified = None
+        self.approximate = False
+        self._waiters = []
+
+    def add(self, rows, size, now, approximate=False):
+        self.rows += rows
+        self.bytes += size
+        self.last_modified = now
+        self.approximate = self.approximate or approximate
+
+    def wait(self):
+        d = Deferred()
+        self._waiters.append(d)
+        return d
+
+    def fire(self):
+        waiters, self._waiters = self._waiters, []
+        for d in waiters:
+            d.callback(None)
+
+
+class StoreStatsUpdater(object):
+    """
+    Applies changes to the stats of stores.
+
+    Riak can't increment a value in place, so each change is a load and a
+    save of the store's :class:`StoreStatsData`. Changes to a store that
+    arrive while its stats are being written are merged and written
+    together afterwards, so a burst of row writes only writes the stats a
+    few times and changes made by this process are never lost. Changes made
+    by other processes at the same time may be, see
+    :meth:`RowCollection.recount_stats`.
+
+    :param manager:
+        Riak manager to store the stats in.
+    :param reactor:
+        Used to tell the time. Defaults to the global reactor.
+    """
+
+    def __init__(self, manager, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self._stats = manager.proxy(StoreStatsData)
+        self._pending = {}
+        self._writing = set()
+
+    def get(self, store_id):
+        """
+        Return a deferred that fires with a store's stats.
+        """
+        d = self._stats.load(store_id)
+        d.addCallback(format_stats)
+        return d
+
+    def exact_rows(self, store_id):
+        """
+        Return a deferred that fires with a store's number of rows, or
+        ``None`` if it isn't known exactly. It isn't known for stores that
+        have no stats, which might have rows written before stats were kept,
+        or for stores whose stats are approximate.
+        """
+        d = self._stats.load(store_id)
+        d.addCallback(
+            lambda stats_model: None
+            if stats_model is None or stats_model.approximate
+            else stats_model.rows)
+        return d
+
+    def change(self, store_id, rows=0, size=0, approximate=False):
+        """
+        Change a store's stats.
+
+        :param int rows:
+            Number of rows added, or removed if negative.
+        :param int size:
+            Number of bytes added, or removed if negative.
+        :param bool approximate:
+            ``True`` if the counts might no longer be right.
+        :returns:
+            A deferred that fires once the change has been written. It never
+            fails, failures are logged.
+        """
+        change = self._pending.get(store_id)
+        if change is None:
+            change = self._pending[store_id] = StatsChange()
+        change.add(rows, size, self.reactor.seconds(), approximate)
+        d = change.wait()
+        if store_id not in self._writing:
+            self._write_next(store_id)
+        return d
+
+    def _write_next(self, store_id):
+        change = self._pending.pop(store_id, None)
+        if change is None:
+            self._writing.discard(store_id)
+            return
+        self._writing.add(store_id)
+        d = self._write(store_id, change)
+        d.addErrback(log.err, "Failed to update store stats.")
+        d.addCallback(lambda _: change.fire())
+        d.addCallback(lambda _: self._write_next(store_id))
+
+    @inlineCallbacks
+    def _write(self, store_id, change):
+        stats_model = yield self._stats.load(store_id)
+        if stats_model is None:
+            stats_model = self._stats(store_id)
+        stats_model.rows += change.rows
+        stats_model.bytes += change.bytes
+        stats_model.last_modified = change.last_modified
+        stats_model.approximate = (
+            stats_model.approximate or change.approximate)
+        yield stats_model.save()
+
+    @inlineCallbacks
+    def replace(self, store_id, rows, size):
+        """
+        Replace a store's stats with exact counts, clearing
+        ``approximate``.
+        """
+        stats_model = yield self._stats.load(store_id)
+        if stats_model is None:
+            stats_model = self._stats(store_id)
+        stats_model.rows = rows
+        stats_model.bytes = size
+        stats_model.approximate = False
+        yield stats_model.save()
+
+
 @implementer(ICollection)
 class StoreCollection(object):
     """
     A collection of stores belonging to an owner.
+
+    When an update adds fields to the indexes declared by a store's schema,
+    the store's rows are reindexed in the background. See
+    :meth:`RiakCollectionBackend.reindex_schema`.
     """
 
+    # Finding a store's version loads it.
+    cheap_versions = False
+
     def __init__(self, backend, owner_id):
         self._backend = backend
         self.owner_id = owner_id
@@ -33,46 +483,189 @@ class StoreCollection(object):
         return {'id': model_obj.key, 'data': model_obj.data}
 
     def all_keys(self):
-        return self._stores.all_keys()
+        return self._stores.index_keys('owner_id', self.owner_id)
+
+    @inlineCallbacks
+    def reindex(self, object_ids):
+        """
+        Add the owner index to stores created before stores were indexed.
+
+        The owner of an unindexed store can't be determined from the store
+        itself, so the caller must provide the ids of the stores that belong
+        to this collection's owner.
+
+        :param list object_ids:
+            Ids of stores belonging to this owner.
+        :returns:
+            The number of stores that were reindexed.
+        """
+        reindexed = 0
+        for object_id in object_ids:
+            obj = yield self._stores.load(object_id)
+            if obj is None or obj.owner_id == self.owner_id:
+                continue
+            obj.owner_id = _to_unicode(self.owner_id)
+            yield obj.save()
+            reindexed += 1
+        returnValue(reindexed)
+
+    def _all_iterator(self, keys, fields=None):
+        return pipelined_fetch(
+            partial(self._fetch, fields=fields), keys,
+            self._backend.fetch_window)
+
+    def all(self, fields=None):
+        d = self.all_keys()
+        d.addCallback(self._all_iterator, fields)
+        return d
+
+    def _format_page(self, index_page):
+        return list(index_page), index_page.continuation
+
+    def page_keys(self, limit, cursor):
+        d = self._stores.index_keys_page(
+            'owner_id', self.owner_id, max_results=limit,
+            continuation=cursor)
+        d.addCallback(self._format_page)
+        return d
 
-    def _all_iterator(self, keys):
-        for key in keys:
-            yield self.get(key)
+    def _page_iterator(self, page, fields):
+        keys, next_cursor = page
+        return self._all_iterator(keys, fields), next_cursor
 
-    def all(self):
+    def page(self, limit, cursor, fields=None):
+        d = self.page_keys(limit, cursor)
+        d.addCallback(self._page_iterator, fields)
+        return d
+
+    def _query_iterator(self, keys, query, fields):
+        return pipelined_fetch(
+            partial(self._get_matching, query=query, fields=fields), keys,
+            self._backend.fetch_window)
+
+    def query(self, query, fields=None):
         d = self.all_keys()
-        d.addCallback(self._all_iterator)
+        d.addCallback(self._query_iterator, query, fields)
         return d
 
-    def get(self, object_id):
+    def count(self, query=None):
+        if query is not None:
+            d = self.aggregate(Aggregation(), query)
+            d.addCallback(_result_count)
+            return d
+        # Stores aren't counted as they're written the way rows are, because
+        # owners have few stores and listing the keys of an owner's stores
+        # is a single index query that doesn't load them.
+        d = self.all_keys()
+        d.addCallback(len)
+        return d
+
+    def aggregate(self, aggregation, query=None):
+        if query is None:
+            d = self.all()
+        else:
+            d = self.query(query)
+        d.addCallback(aggregate_objects, aggregation)
+        return d
+
+    def _get_matching(self, object_id, query, fields):
+        d = self._fetch(object_id)
+        d.addCallback(match_object, query, fields)
+        return d
+
+    def _load(self, object_id):
+        """
+        Load a store, keeping its vclock for blind updates.
+        """
         d = self._stores.load(object_id)
+        d.addCallback(self._backend.remember_vclock)
+        return d
+
+    def _format_loaded(self, d, fields):
         d.addCallback(self._format_data)
+        if fields is not None:
+            d.addCallback(project_object, fields)
         return d
 
+    def _fetch(self, object_id, fields=None):
+        # Listed stores don't have their vclocks kept, so that listings
+        # don't push out the vclocks of stores that are being updated.
+        return self._format_loaded(self._stores.load(object_id), fields)
+
+    def get(self, object_id, fields=None):
+        return self._format_loaded(self._load(object_id), fields)
+
+    def get_version(self, object_id):
+        d = self._load(object_id)
+        d.addCallback(model_version)
+        return d
+
+    def get_many(self, object_ids):
+        return succeed(self._all_iterator(object_ids))
+
     def create(self, object_id, data):
+        try:
+            # Check the schema before anything is written.
+            Schema.from_store_data(data)
+        except SchemaViolation:
+            return fail()
         if object_id is None:
             object_id = uuid4().hex
-        store_model = self._stores(object_id, data=data)
+        store_model = self._stores(
+            object_id, owner_id=_to_unicode(self.owner_id), data=data)
         d = store_model.save()
+        d.addCallback(self._backend.remember_vclock)
         d.addCallback(self._format_data)
         return d
 
-    @inlineCallbacks
-    def update(self, object_id, data):
+    def create_many(self, objects):
+        return bounded_calls(
+            self.create, objects, self._backend.write_window)
+
+    def update(self, object_id, data, version=None, blind=None):
         assert object_id is not None  # TODO: Something better than assert.
-        obj = yield self._stores.load(object_id)
-        assert obj is not None  # TODO: Something better than assert.
+        try:
+            schema = Schema.from_store_data(data)
+        except SchemaViolation:
+            return fail()
+        # The old schema is needed to tell whether the store's rows have to
+        # be reindexed, so stores that declare indexes aren't updated blind.
+        if not schema.indexes and self._backend.is_blind(blind, version):
+            vclock = self._backend.vclock_hint(StoreData, object_id)
+            if vclock is not None:
+                return self._blind_update(object_id, data, vclock)
+        return self._update(object_id, data, version, schema)
+
+    def _blind_update(self, object_id, data, vclock):
+        store_model = self._stores(
+            object_id, owner_id=_to_unicode(self.owner_id), data=data)
+        set_vclock(store_model, vclock)
+        d = store_model.save()
+        d.addCallback(self._backend.remember_vclock)
+        d.addCallback(self._format_data)
+        return d
+
+    @inlineCallbacks
+    def _update(self, object_id, data, version, schema):
+        obj = yield self._load(object_id)
+        check_update(obj, object_id, version)
+        obj.unindexed = unindexed_fields(obj, schema)
         obj.data = data
         yield obj.save()
+        self._backend.remember_vclock(obj)
+        if obj.unindexed:
+            self._backend.reindex_schema(self.owner_id, object_id)
         returnValue(self._format_data(obj))
 
     @inlineCallbacks
-    def delete(self, object_id):
+    def delete(self, object_id, version=None):
         store_model = yield self._stores.load(object_id)
+        check_version(store_model, object_id, version)
         if store_model is None:
             returnValue(None)
         store_data = self._format_data(store_model)
         yield store_model.delete()
+        self._backend.forget_vclock(StoreData, object_id)
         returnValue(store_data)
 
 
@@ -80,17 +673,77 @@ class StoreCollection(object):
 class RowCollection(object):
     """
     A table of rows belonging to a store.
+
+    Fields declared as indexed in the store's schema are added to the
+    :data:`SCHEMA_INDEX` secondary index when rows are written, and queries
+    on those fields only load the rows the index selects. The schema is
+    loaded the first time it's needed and then kept for the lifetime of the
+    collection, so collections shouldn't be kept for long. Rows written
+    before a field was indexed are only indexed by :meth:`reindex_schema`,
+    and queries on the field check every row until that has finished.
+
+    The store's stats are updated as rows are written. Rows created with a
+    generated id are known to be new, so they're written without loading
+    anything. Rows created with an id the client chose might already exist,
+    so, like blind updates, they're written without loading the row and mark
+    the stats as approximate until :meth:`recount_stats` is run, unless the
+    backend was asked to load rows before creating them. Rows are counted
+    from the stats unless they're approximate, so stores that had rows
+    before stats were kept must have :meth:`recount_stats` run once.
     """
 
+    # Finding a row's version loads it.
+    cheap_versions = False
+
     def __init__(self, backend, owner_id, store_id):
         self._backend = backend
         self.owner_id = owner_id
         self.store_id = store_id
         self._rows = backend.manager.proxy(RowData)
+        self._stores = backend.manager.proxy(StoreData)
+        self._schema = None
+        self._query_schema = None
 
     def _key(self, object_id):
         return '%s:%s' % (self.store_id, object_id)
 
+    def _cache_schema(self, store):
+        if store is None:
+            self._schema = self._query_schema = Schema()
+        else:
+            self._schema = Schema.from_store_data(store.data)
+            self._query_schema = self._schema.without(store.unindexed or {})
+        return self._schema
+
+    def _load_schema(self):
+        """
+        Return a deferred that fires with the store's schema.
+        """
+        if self._schema is not None:
+            return succeed(self._schema)
+        d = self._stores.load(self.store_id)
+        d.addCallback(self._cache_schema)
+        return d
+
+    def _load_query_schema(self):
+        """
+        Return a deferred that fires with the store's schema without the
+        fields that haven't been reindexed yet, which are the fields that
+        queries can use the index for.
+        """
+        d = self._load_schema()
+        d.addCallback(lambda _: self._query_schema)
+        return d
+
+    def _index_value(self, entry):
+        return '%s/%s' % (_to_unicode(self.store_id).encode('utf-8'), entry)
+
+    def _set_schema_indexes(self, model_obj, entries):
+        obj = riak_object(model_obj)
+        obj.remove_index(SCHEMA_INDEX)
+        for entry in entries:
+            obj.add_index(SCHEMA_INDEX, self._index_value(entry))
+
     def _key_to_id(self, key):
         store_id, _sep, object_id = key.partition(':')
         assert store_id == self.store_id
@@ -109,59 +762,467 @@ class RowCollection(object):
                 yield key
 
     def all_keys(self):
-        d = self._rows.all_keys()
+        d = self._rows.index_keys('store_id', self.store_id)
         d.addCallback(self._keys_for_store)
         d.addCallback(list)
         return d
 
-    def _all_iterator(self, keys):
-        for key in keys:
-            yield self.get(key)
+    @inlineCallbacks
+    def reindex(self):
+        """
+        Add owner and store indexes to rows created before rows were indexed.
 
-    def all(self):
+        This has to list every key in the bucket to find unindexed rows, so
+        it should be run once per store as a migration rather than as part of
+        normal operation.
+
+        :returns:
+            The number of rows that were reindexed.
+        """
+        keys = yield self._rows.all_keys()
+        reindexed = 0
+        for object_id in list(self._keys_for_store(keys)):
+            obj = yield self._rows.load(self._key(object_id))
+            if obj is None or obj.owner_id == self.owner_id:
+                continue
+            obj.owner_id = _to_unicode(self.owner_id)
+            obj.store_id = _to_unicode(self.store_id)
+            yield obj.save()
+            reindexed += 1
+        returnValue(reindexed)
+
+    @inlineCallbacks
+    def reindex_schema(self):
+        """
+        Rebuild the schema indexes of all rows in the store from the store's
+        current schema. This is started in the background when fields are
+        added to the indexes declared by a store's schema, and must be run
+        by hand if that was interrupted.
+
+        Rows that don't match the schema are left out of the indexes for the
+        fields they don't match.
+
+        :returns:
+            The number of rows that were reindexed.
+        """
+        self._schema = None
+        schema = yield self._load_schema()
+        keys = yield self.all_keys()
+        reindexed = 0
+        for object_id in keys:
+            obj = yield self._rows.load(self._key(object_id))
+            if obj is None:
+                continue
+            self._set_schema_indexes(
+                obj, schema.index_entries(obj.data, strict=False))
+            yield obj.save()
+            reindexed += 1
+        yield self._mark_indexed(schema)
+        returnValue(reindexed)
+
+    @inlineCallbacks
+    def _mark_indexed(self, schema):
+        """
+        Record that the fields indexed by ``schema`` have been reindexed, so
+        that queries can use their indexes. Fields whose index type has
+        changed since are still waiting for another reindex.
+        """
+        store = yield self._stores.load(self.store_id)
+        if store is None or not store.unindexed:
+            return
+        unindexed = dict(
+            (path, index_type)
+            for path, index_type in store.unindexed.iteritems()
+            if schema.indexes.get(path) != index_type)
+        store.unindexed = unindexed or None
+        yield store.save()
+        self._cache_schema(store)
+
+    @inlineCallbacks
+    def recount_stats(self):
+        """
+        Replace the store's stats with counts of its rows. This must be run
+        for stores that had rows before stats were kept, and fixes stats
+        that are approximate or were changed by several processes at once.
+
+        Rows written while the rows are being counted may be miscounted.
+
+        :returns:
+            The new stats.
+        """
+        keys = yield self.all_keys()
+        rows = 0
+        size = 0
+        for obj_deferred in self._all_iterator(keys):
+            obj = yield obj_deferred
+            if obj is not None:
+                rows += 1
+                size += data_size(obj['data'])
+        yield self._backend.stats.replace(self.store_id, rows, size)
+        stats = yield self._backend.stats.get(self.store_id)
+        returnValue(stats)
+
+    def _all_iterator(self, keys, fields=None):
+        return pipelined_fetch(
+            partial(self._fetch, fields=fields), keys,
+            self._backend.fetch_window)
+
+    def all(self, fields=None):
         d = self.all_keys()
-        d.addCallback(self._all_iterator)
+        d.addCallback(self._all_iterator, fields)
         return d
 
-    def get(self, object_id):
+    def _format_page(self, index_page):
+        return list(self._keys_for_store(index_page)), index_page.continuation
+
+    def page_keys(self, limit, cursor):
+        d = self._rows.index_keys_page(
+            'store_id', self.store_id, max_results=limit,
+            continuation=cursor)
+        d.addCallback(self._format_page)
+        return d
+
+    def _page_iterator(self, page, fields):
+        keys, next_cursor = page
+        return self._all_iterator(keys, fields), next_cursor
+
+    def page(self, limit, cursor, fields=None):
+        d = self.page_keys(limit, cursor)
+        d.addCallback(self._page_iterator, fields)
+        return d
+
+    def _query_iterator(self, keys, query, fields):
+        return pipelined_fetch(
+            partial(self._get_matching, query=query, fields=fields), keys,
+            self._backend.fetch_window)
+
+    def _query_keys(self, schema, query):
+        entry_range = schema.index_range(query)
+        if entry_range is None:
+            return self.all_keys()
+        start, end = entry_range
+        d = self._backend.manager.index_keys(
+            RowData, SCHEMA_INDEX, self._index_value(start),
+            self._index_value(end))
+        d.addCallback(self._keys_for_store)
+        d.addCallback(list)
+        return d
+
+    def query(self, query, fields=None):
+        d = self._load_query_schema()
+        d.addCallback(self._query_keys, query)
+        d.addCallback(self._query_iterator, query, fields)
+        return d
+
+    def _count_keys(self, rows):
+        if rows is not None:
+            return rows
+        # Only the store's keys are listed, no rows are loaded.
+        d = self.all_keys()
+        d.addCallback(len)
+        return d
+
+    def count(self, query=None):
+        if query is not None:
+            d = self.aggregate(Aggregation(), query)
+            d.addCallback(_result_count)
+            return d
+        # The store's stats are used if they're exact, so that counting
+        # doesn't list every key.
+        d = self._backend.stats.exact_rows(self.store_id)
+        d.addCallback(self._count_keys)
+        return d
+
+    def aggregate(self, aggregation, query=None):
+        if query is None:
+            d = self.all()
+        else:
+            d = self.query(query)
+        d.addCallback(aggregate_objects, aggregation)
+        return d
+
+    def _get_matching(self, object_id, query, fields):
+        d = self._fetch(object_id)
+        d.addCallback(match_object, query, fields)
+        return d
+
+    def _load(self, object_id):
+        """
+        Load a row, keeping its vclock for blind updates.
+        """
         d = self._rows.load(self._key(object_id))
+        d.addCallback(self._backend.remember_vclock)
+        return d
+
+    def _format_loaded(self, d, fields):
         d.addCallback(self._format_data)
+        if fields is not None:
+            d.addCallback(project_object, fields)
+        return d
+
+    def _fetch(self, object_id, fields=None):
+        # Listed rows don't have their vclocks kept, so that listings don't
+        # push out the vclocks of rows that are being updated.
+        return self._format_loaded(
+            self._rows.load(self._key(object_id)), fields)
+
+    def get(self, object_id, fields=None):
+        return self._format_loaded(self._load(object_id), fields)
+
+    def get_version(self, object_id):
+        d = self._load(object_id)
+        d.addCallback(model_version)
         return d
 
+    def get_many(self, object_ids):
+        return succeed(self._all_iterator(object_ids))
+
+    def _new_row(self, object_id, data, entries):
+        row_model = self._rows(
+            self._key(object_id), owner_id=_to_unicode(self.owner_id),
+            store_id=_to_unicode(self.store_id), data=data)
+        self._set_schema_indexes(row_model, entries)
+        return row_model
+
+    @inlineCallbacks
+    def _save_row(self, obj, data, entries):
+        """
+        Replace the data of a loaded row and update the store's stats.
+        """
+        old_size = data_size(obj.data)
+        obj.data = data
+        self._set_schema_indexes(obj, entries)
+        yield obj.save()
+        self._backend.remember_vclock(obj)
+        yield self._backend.stats.change(
+            self.store_id, size=data_size(data) - old_size)
+
+    @inlineCallbacks
+    def _write_blind(self, object_id, data, entries, vclock, rows=0, size=0):
+        """
+        Write a row without loading it first, using ``vclock`` if it isn't
+        ``None``. We don't know whether the row is new or how big it was,
+        so ``rows`` and ``size`` are our best guess at how the store's stats
+        change, and the stats are marked as approximate.
+        """
+        row_model = self._new_row(object_id, data, entries)
+        if vclock is not None:
+            set_vclock(row_model, vclock)
+        yield row_model.save()
+        self._backend.remember_vclock(row_model)
+        yield self._backend.stats.change(
+            self.store_id, rows=rows, size=size, approximate=True)
+        returnValue(self._format_data(row_model))
+
+    @inlineCallbacks
     def create(self, object_id, data):
+        schema = yield self._load_schema()
+        # This checks the data against the schema before anything is written.
+        entries = schema.index_entries(data)
         if object_id is None:
+            # A generated id can't belong to an existing row, so there's
+            # nothing to load.
             object_id = uuid4().hex
-        row_model = self._rows(self._key(object_id), data=data)
-        d = row_model.save()
-        d.addCallback(self._format_data)
-        return d
+            row_model = None
+        elif self._backend.load_before_create:
+            # The existing row is loaded to update the stats, and so that
+            # it's overwritten with its vclock instead of creating a sibling.
+            row_model = yield self._rows.load(self._key(object_id))
+        else:
+            # Rows we haven't seen recently are most likely new.
+            vclock = self._backend.vclock_hint(RowData, self._key(object_id))
+            if vclock is None:
+                result = yield self._write_blind(
+                    object_id, data, entries, vclock, rows=1,
+                    size=data_size(data))
+            else:
+                result = yield self._write_blind(
+                    object_id, data, entries, vclock)
+            returnValue(result)
+        if row_model is not None:
+            yield self._save_row(row_model, data, entries)
+            returnValue(self._format_data(row_model))
+        row_model = self._new_row(object_id, data, entries)
+        yield row_model.save()
+        self._backend.remember_vclock(row_model)
+        yield self._backend.stats.change(
+            self.store_id, rows=1, size=data_size(data))
+        returnValue(self._format_data(row_model))
 
     @inlineCallbacks
-    def update(self, object_id, data):
+    def _blind_update(self, object_id, data, vclock):
+        schema = yield self._load_schema()
+        result = yield self._write_blind(
+            object_id, data, schema.index_entries(data), vclock)
+        returnValue(result)
+
+    def create_many(self, objects):
+        # The schema is loaded first so that each create doesn't load it.
+        d = self._load_schema()
+        d.addCallback(
+            lambda _: bounded_calls(
+                self.create, objects, self._backend.write_window))
+        return d
+
+    def update(self, object_id, data, version=None, blind=None):
         assert object_id is not None  # TODO: Something better than assert.
-        obj = yield self._rows.load(self._key(object_id))
-        assert obj is not None  # TODO: Something better than assert.
-        obj.data = data
-        yield obj.save()
+        if self._backend.is_blind(blind, version):
+            vclock = self._backend.vclock_hint(RowData, self._key(object_id))
+            if vclock is not None:
+                return self._blind_update(object_id, data, vclock)
+        return self._update(object_id, data, version)
+
+    @inlineCallbacks
+    def _update(self, object_id, data, version):
+        schema = yield self._load_schema()
+        entries = schema.index_entries(data)
+        obj = yield self._load(object_id)
+        check_update(obj, object_id, version)
+        yield self._save_row(obj, data, entries)
         returnValue(self._format_data(obj))
 
     @inlineCallbacks
-    def delete(self, object_id):
+    def delete(self, object_id, version=None):
         row_model = yield self._rows.load(self._key(object_id))
+        check_version(row_model, object_id, version)
         if row_model is None:
             returnValue(None)
         row_data = self._format_data(row_model)
         yield row_model.delete()
+        self._backend.forget_vclock(RowData, self._key(object_id))
+        yield self._backend.stats.change(
+            self.store_id, rows=-1, size=-data_size(row_model.data))
         returnValue(row_data)
 
 
 @implementer(IStoreBackend)
 class RiakCollectionBackend(object):
-    def __init__(self, manager):
+    """
+    :param manager:
+        Riak manager to store collection data in.
+    :param int fetch_window:
+        Maximum number of object loads to have in flight at once when
+        listing a collection.
+    :param int write_window:
+        Maximum number of object saves to have in flight at once when
+        creating many objects.
+    :param bool blind_updates:
+        Whether updates are blind by default. A blind update saves the
+        object without loading it first, using the vclock this process got
+        the last time it loaded or saved the object, which halves the round
+        trips of an update. Objects this process hasn't seen recently are
+        loaded as usual, so updates to objects that don't exist still fail.
+        If another process has written the object since, the vclock is out
+        of date and the update may create siblings in buckets that allow
+        them. Blind updates to rows make the store's stats approximate.
+    :param bool load_before_create:
+        Whether rows created with an id the client chose are loaded first,
+        so that the store's stats stay exact and an existing row is
+        overwritten with its current vclock. Otherwise they're written
+        blind, like blind updates, and make the store's stats approximate.
+        Rows created with a generated id are never loaded first.
+    :param int vclock_hints:
+        Number of recently seen vclocks to keep for blind updates.
+    :param reactor:
+        Used to tell the time. Defaults to the global reactor.
+    """
+
+    DEFAULT_FETCH_WINDOW = 32
+    DEFAULT_WRITE_WINDOW = 32
+    DEFAULT_VCLOCK_HINTS = 10000
+
+    def __init__(self, manager, fetch_window=None, write_window=None,
+                 blind_updates=False, load_before_create=False,
+                 vclock_hints=None, reactor=None):
         self.manager = manager
+        self.stats = StoreStatsUpdater(manager, reactor=reactor)
+        if fetch_window is None:
+            fetch_window = self.DEFAULT_FETCH_WINDOW
+        self.fetch_window = fetch_window
+        if write_window is None:
+            write_window = self.DEFAULT_WRITE_WINDOW
+        self.write_window = write_window
+        self.blind_updates = blind_updates
+        self.load_before_create = load_before_create
+        if vclock_hints is None:
+            vclock_hints = self.DEFAULT_VCLOCK_HINTS
+        self._vclock_hints = LRUCache(vclock_hints, reactor=reactor)
+        # Locks that keep each store to one schema reindex at a time.
+        self._reindex_locks = {}
+
+    def remember_vclock(self, model_obj):
+        """
+        Keep the vclock of an object that was just loaded or saved, so that
+        it can be updated blind. Returns the object, so that it can be used
+        as a callback.
+        """
+        if model_obj is not None:
+            self._vclock_hints.set(
+                (type(model_obj).__name__, model_obj.key),
+                get_vclock(model_obj))
+        return model_obj
+
+    def forget_vclock(self, modelcls, key):
+        """
+        Forget the vclock of an object that was deleted.
+        """
+        self._vclock_hints.invalidate((modelcls.__name__, key))
+
+    def vclock_hint(self, modelcls, key):
+        """
+        Return the vclock kept for an object, or ``None`` if there isn't
+        one.
+        """
+        return self._vclock_hints.get((modelcls.__name__, key))
+
+    def reindex_schema(self, owner_id, store_id):
+        """
+        Rebuild a store's schema indexes in the background. See
+        :meth:`RowCollection.reindex_schema`.
+
+        If the store is already being reindexed, it's reindexed again once
+        that has finished, because the schema may have changed since the
+        running reindex loaded it.
+
+        :returns:
+            A deferred that fires when the reindex has finished. Errors are
+            logged rather than passed on.
+        """
+        lock = self._reindex_locks.get(store_id)
+        if lock is None:
+            lock = self._reindex_locks[store_id] = DeferredLock()
+        rows = self.get_row_collection(owner_id, store_id)
+        d = lock.run(rows.reindex_schema)
+        d.addErrback(log.err, "Failed to reindex store %r." % (store_id,))
+        d.addBoth(self._forget_reindex_lock, store_id, lock)
+        return d
+
+    def _forget_reindex_lock(self, result, store_id, lock):
+        if not lock.locked and self._reindex_locks.get(store_id) is lock:
+            del self._reindex_locks[store_id]
+        return result
+
+    def is_blind(self, blind, version):
+        """
+        Return ``True`` if an update should be blind. Updates with a version
+        are never blind, because the version can only be checked by loading
+        the object.
+
+        :param bool blind:
+            Whether the update was asked to be blind, or ``None`` to use
+            :attr:`blind_updates`.
+        """
+        if version is not None:
+            return False
+        if blind is None:
+            return self.blind_updates
+        return blind
 
     def get_store_collection(self, owner_id):
         return StoreCollection(self, owner_id)
 
     def get_row_collection(self, owner_id, store_id):
         return RowCollection(self, owner_id, store_id)
+
+    def get_store_stats(self, owner_id, store_id):
+        return self.stats.get(store_id)
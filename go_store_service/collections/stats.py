@@ -0,0 +1,72 @@
+from twisted.internet.defer import maybeDeferred
+from zope.interface import implementer
+
+from go_store_service.collections.forwarding import ForwardingCollection
+from go_store_service.encoding import RawJson
+from go_store_service.interfaces import IStoreBackend
+
+
+class StatsStoreCollection(ForwardingCollection):
+    """
+    A collection of stores that includes the stats of a store's rows when
+    the store is fetched on its own. See
+    :meth:`go_store_service.interfaces.IStoreBackend.get_store_stats`.
+
+    Stores are returned as ``{"id": ..., "data": ..., "stats": ...}``. The
+    stats aren't part of the store's data, so they don't change its
+    version. Listings don't include stats, because each store's stats would
+    be another read.
+
+    :param collection:
+        The ICollection provider for the owner's stores.
+    :param backend:
+        The IStoreBackend provider to get stats from.
+    :param str owner_id:
+        The owner of the stores.
+    """
+
+    def __init__(self, collection, backend, owner_id):
+        super(StatsStoreCollection, self).__init__(collection)
+        self._backend = backend
+        self.owner_id = owner_id
+
+    def _add_stats(self, obj, object_id):
+        if obj is None:
+            return None
+        if isinstance(obj, RawJson):
+            obj = obj.decode()
+        d = maybeDeferred(
+            self._backend.get_store_stats, self.owner_id, object_id)
+        # The object might be cached, so it's copied rather than modified.
+        d.addCallback(lambda stats: dict(obj, stats=stats))
+        return d
+
+    def get(self, object_id, fields=None):
+        d = maybeDeferred(self._collection.get, object_id, fields=fields)
+        d.addCallback(self._add_stats, object_id)
+        return d
+
+
+@implementer(IStoreBackend)
+class StatsCollectionBackend(object):
+    """
+    A backend that includes a store's stats when the store is fetched. See
+    :class:`StatsStoreCollection`.
+
+    :param backend:
+        The IStoreBackend provider to wrap.
+    """
+
+    def __init__(self, backend):
+        self.backend = IStoreBackend(backend)
+
+    def get_store_collection(self, owner_id):
+        return StatsStoreCollection(
+            self.backend.get_store_collection(owner_id), self.backend,
+            owner_id)
+
+    def get_row_collection(self, owner_id, store_id):
+        return self.backend.get_row_collection(owner_id, store_id)
+
+    def get_store_stats(self, owner_id, store_id):
+        return self.backend.get_store_stats(owner_id, store_id)
@@ -0,0 +1,187 @@
+from twisted.internet.defer import (
+    inlineCallbacks, gatherResults, maybeDeferred)
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from go_store_service.collections.cached import (
+    LRUCache, CachedCollectionBackend)
+from go_store_service.collections.inmemory import InMemoryCollectionBackend
+from go_store_service.encoding import data_version
+from go_store_service.metrics import MetricsRegistry
+
+
+class TestLRUCache(TestCase):
+    def test_get_missing(self):
+        cache = LRUCache(2)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.get("a", "default"), "default")
+        self.assertEqual(cache.stats(), {
+            "size": 0, "hits": 0, "misses": 2, "evictions": 0})
+
+    def test_set_and_get(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats(), {
+            "size": 1, "hits": 1, "misses": 0, "evictions": 0})
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_metrics(self):
+        metrics = MetricsRegistry()
+        cache = LRUCache(1, metrics=metrics)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+        cache.set("b", 2)
+        self.assertEqual(
+            [metrics.counter(name, "").value() for name in [
+                'store_cache_hits_total', 'store_cache_misses_total',
+                'store_cache_evictions_total']],
+            [1, 1, 1])
+
+    def test_ttl(self):
+        clock = Clock()
+        cache = LRUCache(2, ttl=10, reactor=clock)
+        cache.set("a", 1)
+        clock.advance(9)
+        self.assertEqual(cache.get("a"), 1)
+        clock.advance(1)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.invalidate("a")
+        self.assertEqual(cache.get("a"), None)
+
+    def test_set_stale_generation(self):
+        cache = LRUCache(2)
+        generation = cache.generation
+        cache.invalidate("a")
+        cache.set("a", 1, generation)
+        self.assertEqual(cache.get("a"), None)
+        cache.set("a", 2, cache.generation)
+        self.assertEqual(cache.get("a"), 2)
+
+
+class TestCachedCollection(TestCase):
+    def setUp(self):
+        self.data = {}
+        self.inner = InMemoryCollectionBackend(self.data)
+        self.backend = CachedCollectionBackend(self.inner, 10)
+
+    def get_rows(self):
+        return self.backend.get_row_collection("me", "store")
+
+    @inlineCallbacks
+    def test_get_cached(self):
+        yield self.inner.get_row_collection("me", "store").create("a", 1)
+        row = yield self.get_rows().get("a")
+        self.assertEqual(row, {"id": "a", "data": 1})
+        self.data["rows"]["me"]["store"]["a"] = 2
+        row = yield self.get_rows().get("a")
+        self.assertEqual(row, {"id": "a", "data": 1})
+        self.assertEqual(self.backend.cache.hits, 1)
+        self.assertEqual(self.backend.cache.misses, 1)
+
+    @inlineCallbacks
+    def test_get_fields_cached(self):
+        yield self.inner.get_row_collection("me", "store").create(
+            "a", {"x": 1, "y": 2})
+        row = yield self.get_rows().get("a", fields=["x"])
+        self.assertEqual(row, {"id": "a", "data": {"x": 1}})
+        row = yield self.get_rows().get("a", fields=["y"])
+        self.assertEqual(row, {"id": "a", "data": {"y": 2}})
+        row = yield self.get_rows().get("a")
+        self.assertEqual(row, {"id": "a", "data": {"x": 1, "y": 2}})
+        self.assertEqual(self.backend.cache.hits, 2)
+        self.assertEqual(self.backend.cache.misses, 1)
+
+    @inlineCallbacks
+    def test_get_many_cached(self):
+        rows = self.get_rows()
+        yield self.inner.get_row_collection("me", "store").create("a", 1)
+        yield self.inner.get_row_collection("me", "store").create("b", 2)
+        yield rows.get("a")
+        self.data["rows"]["me"]["store"]["a"] = 3
+        objs = yield rows.get_many(["b", "missing", "a"])
+        objs = yield gatherResults([maybeDeferred(lambda: o) for o in objs])
+        self.assertEqual(objs, [
+            {"id": "b", "data": 2}, None, {"id": "a", "data": 1}])
+        self.assertEqual(len(self.backend.cache), 3)
+
+    @inlineCallbacks
+    def test_update_invalidates(self):
+        rows = self.get_rows()
+        yield rows.create("a", 1)
+        yield rows.get("a")
+        yield rows.update("a", 2)
+        row = yield rows.get("a")
+        self.assertEqual(row, {"id": "a", "data": 2})
+
+    @inlineCallbacks
+    def test_delete_invalidates(self):
+        rows = self.get_rows()
+        yield rows.create("a", 1)
+        yield rows.get("a")
+        yield rows.delete("a")
+        row = yield rows.get("a")
+        self.assertEqual(row, None)
+
+    @inlineCallbacks
+    def test_create_invalidates_missing(self):
+        rows = self.get_rows()
+        row = yield rows.get("a")
+        self.assertEqual(row, None)
+        yield rows.create("a", 1)
+        row = yield rows.get("a")
+        self.assertEqual(row, {"id": "a", "data": 1})
+
+    @inlineCallbacks
+    def test_create_many_invalidates(self):
+        rows = self.get_rows()
+        yield rows.get("a")
+        yield rows.create_many([("a", 1)])
+        row = yield rows.get("a")
+        self.assertEqual(row, {"id": "a", "data": 1})
+
+    @inlineCallbacks
+    def test_collections_cached_separately(self):
+        rows = self.get_rows()
+        other_rows = self.backend.get_row_collection("me", "other_store")
+        yield rows.create("a", 1)
+        yield rows.get("a")
+        row = yield other_rows.get("a")
+        self.assertEqual(row, None)
+
+    @inlineCallbacks
+    def test_get_version_cached(self):
+        yield self.inner.get_row_collection("me", "store").create("a", 1)
+        yield self.get_rows().get("a")
+        self.data["rows"]["me"]["store"]["a"] = 2
+        version = yield self.get_rows().get_version("a")
+        self.assertEqual(version, data_version(1))
+
+    @inlineCallbacks
+    def test_get_version_not_cached(self):
+        yield self.inner.get_row_collection("me", "store").create("a", 1)
+        version = yield self.get_rows().get_version("a")
+        self.assertEqual(version, data_version(1))
+        missing = yield self.get_rows().get_version("b")
+        self.assertEqual(missing, None)
+        # The object was cached to find its version, so getting it next
+        # doesn't go to the backend.
+        row = yield self.get_rows().get("a")
+        self.assertEqual(row, {"id": "a", "data": 1})
+        self.assertEqual(self.backend.cache.hits, 1)
@@ -0,0 +1,214 @@
+from twisted.internet.defer import fail, inlineCallbacks, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+from vumi.tests.helpers import VumiTestCase
+from zope.interface import implementer
+
+from go_store_service.collections.cascading import (
+    CascadingCollectionBackend, DeletionJob, DeletionJobs, RateLimiter)
+from go_store_service.collections.inmemory import InMemoryCollectionBackend
+from go_store_service.collections.tests.test_collections import (
+    CommonStoreTests)
+from go_store_service.interfaces import ICollection
+
+
+class DummyError(Exception):
+    """
+    Exception for use in tests.
+    """
+
+
+@implementer(ICollection)
+class FakeRows(object):
+    """
+    Just enough of a row collection to delete rows from synchronously.
+    """
+
+    def __init__(self, object_ids, broken=()):
+        self.object_ids = list(object_ids)
+        self.broken = set(broken)
+
+    def page_keys(self, limit, cursor):
+        object_ids = sorted(self.object_ids)
+        if cursor is not None:
+            object_ids = [i for i in object_ids if i > cursor]
+        page = object_ids[:limit]
+        if len(object_ids) <= limit:
+            return succeed((page, None))
+        return succeed((page, page[-1]))
+
+    def delete(self, object_id, version=None):
+        if object_id in self.broken:
+            return fail(DummyError(object_id))
+        self.object_ids.remove(object_id)
+        return succeed({"id": object_id, "data": None})
+
+
+class TestDeletionJob(TestCase):
+    def test_run(self):
+        clock = Clock()
+        rows = FakeRows(["a", "b", "c"])
+        job = DeletionJob(rows, batch_size=2, concurrency=1, reactor=clock)
+        self.assertEqual(job.status()["status"], "pending")
+        clock.advance(5)
+        d = job.run()
+        self.assertEqual(self.successResultOf(d), None)
+        self.assertEqual(rows.object_ids, [])
+        self.successResultOf(job.wait())
+        self.assertEqual(job.status(), {
+            "status": "done", "total": 3, "deleted": 3, "failed": 0,
+            "started": 5, "finished": 5})
+
+    def test_paged(self):
+        rows = FakeRows(["a", "b", "c", "d", "e"])
+        pages = []
+        page_keys = rows.page_keys
+
+        def record_page_keys(limit, cursor):
+            pages.append((cursor, sorted(rows.object_ids)))
+            return page_keys(limit, cursor)
+
+        rows.page_keys = record_page_keys
+        job = DeletionJob(rows, batch_size=2, concurrency=1, reactor=Clock())
+        self.successResultOf(job.run())
+        self.assertEqual(rows.object_ids, [])
+        # Each page is deleted before the next one is listed.
+        self.assertEqual(pages, [
+            (None, ["a", "b", "c", "d", "e"]),
+            ("b", ["c", "d", "e"]),
+            ("d", ["e"]),
+        ])
+        self.assertEqual(job.status()["total"], 5)
+
+    def test_rate_limit(self):
+        clock = Clock()
+        rows = FakeRows(["a", "b", "c", "d", "e"])
+        job = DeletionJob(
+            rows, batch_size=2, concurrency=2,
+            limiter=RateLimiter(1, reactor=clock), reactor=clock)
+        d = job.run()
+        self.assertEqual(rows.object_ids, ["c", "d", "e"])
+        self.assertEqual(job.status()["total"], 4)
+        clock.advance(2)
+        self.assertEqual(rows.object_ids, ["e"])
+        self.assertNoResult(d)
+        clock.advance(1)
+        self.assertEqual(rows.object_ids, ["e"])
+        clock.advance(1)
+        self.assertEqual(rows.object_ids, [])
+        self.successResultOf(d)
+        self.assertEqual(job.status()["status"], "done")
+
+    def test_failed_deletes(self):
+        rows = FakeRows(["a", "b", "c"], broken=["b"])
+        job = DeletionJob(rows, batch_size=10, concurrency=2, reactor=Clock())
+        self.successResultOf(job.run())
+        self.assertEqual(rows.object_ids, ["b"])
+        status = job.status()
+        self.assertEqual(
+            (status["status"], status["deleted"], status["failed"]),
+            ("done", 2, 1))
+        self.assertEqual(len(self.flushLoggedErrors(DummyError)), 1)
+
+    def test_failed_listing(self):
+        rows = FakeRows([])
+        rows.page_keys = lambda limit, cursor: fail(DummyError())
+        job = DeletionJob(rows, batch_size=10, concurrency=2, reactor=Clock())
+        self.successResultOf(job.run())
+        self.assertEqual(job.status()["status"], "failed")
+        self.assertEqual(len(self.flushLoggedErrors(DummyError)), 1)
+
+
+class TestRateLimiter(TestCase):
+    def test_wait(self):
+        clock = Clock()
+        limiter = RateLimiter(2, reactor=clock)
+        self.successResultOf(limiter.wait(4))
+        d = limiter.wait(1)
+        clock.advance(1.5)
+        self.assertNoResult(d)
+        clock.advance(0.5)
+        self.successResultOf(d)
+        # Time spent idle isn't saved up for later.
+        clock.advance(10)
+        self.successResultOf(limiter.wait(2))
+        self.assertNoResult(limiter.wait(1))
+
+
+class TestDeletionJobs(TestCase):
+    def test_start(self):
+        clock = Clock()
+        jobs = DeletionJobs(reactor=clock, keep_for=10)
+        rows = FakeRows(["a"])
+        job = jobs.start("me", "store", rows)
+        self.assertEqual(jobs.get("me", "store"), job)
+        self.assertEqual(jobs.get("me", "other"), None)
+        self.assertEqual(job.status()["status"], "done")
+        self.assertEqual(rows.object_ids, [])
+        clock.advance(9)
+        self.assertEqual(jobs.get("me", "store"), job)
+        clock.advance(1)
+        self.assertEqual(jobs.get("me", "store"), None)
+
+    def test_start_while_running(self):
+        clock = Clock()
+        jobs = DeletionJobs(batch_size=1, rate=1, reactor=clock)
+        job = jobs.start("me", "store", FakeRows(["a", "b"]))
+        self.assertEqual(job.status()["status"], "running")
+        self.assertEqual(jobs.start("me", "store", FakeRows([])), job)
+        clock.advance(1)
+        clock.advance(1)
+        self.assertEqual(job.status()["status"], "done")
+        new_job = jobs.start("me", "store", FakeRows([]))
+        self.assertNotEqual(new_job, job)
+        self.assertEqual(jobs.get("me", "store"), new_job)
+
+    def test_rate_shared(self):
+        clock = Clock()
+        jobs = DeletionJobs(batch_size=1, rate=1, reactor=clock)
+        rows1 = FakeRows(["a", "b"])
+        rows2 = FakeRows(["c", "d"])
+        jobs.start("me", "store1", rows1)
+        jobs.start("me", "store2", rows2)
+        remaining = lambda: (rows1.object_ids, rows2.object_ids)
+        # Deletes are spaced out across both jobs, in the order they were
+        # asked for.
+        self.assertEqual(remaining(), (["b"], ["c", "d"]))
+        clock.advance(1)
+        self.assertEqual(remaining(), ([], ["c", "d"]))
+        clock.advance(1)
+        self.assertEqual(remaining(), ([], ["d"]))
+        clock.advance(1)
+        self.assertEqual(remaining(), ([], []))
+
+
+class TestCascadingCollectionBackend(TestCase):
+    def setUp(self):
+        self.data = {}
+        self.jobs = DeletionJobs()
+        self.backend = CascadingCollectionBackend(
+            InMemoryCollectionBackend(self.data), self.jobs)
+
+    @inlineCallbacks
+    def test_delete_store_deletes_rows(self):
+        stores = self.backend.get_store_collection("me")
+        yield stores.create("store", {})
+        rows = self.backend.get_row_collection("me", "store")
+        yield rows.create("a", {})
+        yield rows.create("b", {})
+        other_rows = self.backend.get_row_collection("me", "other")
+        yield other_rows.create("c", {})
+
+        store_data = yield stores.delete("store")
+        self.assertEqual(store_data, {"id": "store", "data": {}})
+        job = self.jobs.get("me", "store")
+        self.assertEqual(job.state, "running")
+        yield job.wait()
+        self.assertEqual(job.status()["deleted"], 2)
+        self.assertEqual(self.data["rows"]["me"]["store"], {})
+        self.assertEqual(self.data["rows"]["me"]["other"], {"c": {}})
+
+
+class TestCascadingInMemoryStore(VumiTestCase, CommonStoreTests):
+    def make_store_backend(self):
+        return CascadingCollectionBackend(InMemoryCollectionBackend({}))
@@ -0,0 +1,188 @@
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+from vumi.tests.helpers import VumiTestCase
+
+from go_store_service.collections.coalescing import (
+    CoalescingCollectionBackend, DURABILITY_QUEUED, PendingWrite)
+from go_store_service.collections.inmemory import InMemoryCollectionBackend
+from go_store_service.collections.tests.test_collections import (
+    CommonStoreTests)
+from go_store_service.encoding import data_version
+from go_store_service.interfaces import (
+    ObjectNotFound, SchemaViolation, VersionConflict)
+
+
+class TestCoalescingCollection(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.data = {}
+        self.inner = InMemoryCollectionBackend(self.data)
+
+    def mk_rows(self, **kw):
+        self.backend = CoalescingCollectionBackend(
+            self.inner, delay=1, reactor=self.clock, **kw)
+        return self.backend.get_row_collection("me", "store")
+
+    def stored(self):
+        return self.data["rows"]["me"]["store"]
+
+    @inlineCallbacks
+    def test_merges_updates(self):
+        rows = self.mk_rows()
+        yield self.inner.get_row_collection("me", "store").create("a", 0)
+        results = [rows.update("a", i) for i in range(1, 4)]
+        self.assertEqual(self.stored(), {"a": 0})
+        self.clock.advance(1)
+        for d in results:
+            result = yield d
+            self.assertEqual(result, {"id": "a", "data": 3})
+        self.assertEqual(self.stored(), {"a": 3})
+        self.assertEqual(self.backend.queue.stats(), {
+            "pending": 0, "writes": 1, "merged": 2})
+
+    @inlineCallbacks
+    def test_update_merged_into_create(self):
+        rows = self.mk_rows()
+        d1 = rows.create("a", 1)
+        d2 = rows.update("a", 2)
+        self.clock.advance(1)
+        yield d1
+        yield d2
+        self.assertEqual(self.stored(), {"a": 2})
+
+    @inlineCallbacks
+    def test_blind_update_merged(self):
+        rows = self.mk_rows()
+        yield self.inner.get_row_collection("me", "store").create("a", 0)
+        d1 = rows.update("a", 1, blind=True)
+        d2 = rows.update("a", 2)
+        self.clock.advance(1)
+        yield d1
+        yield d2
+        self.assertEqual(self.stored(), {"a": 2})
+
+    def test_merged_blindness(self):
+        """
+        Merged updates are only blind if all of them asked to be, and aren't
+        blind if any of them asked not to be.
+        """
+        for blinds, expected in [
+                ([True], True),
+                ([True, True], True),
+                ([True, None], None),
+                ([None, True], None),
+                ([True, False], False),
+                ([False, None, True], False),
+                ([None, False], False)]:
+            write = PendingWrite("a")
+            for blind in blinds:
+                write.merge(None, {}, False, blind)
+            self.assertEqual(write.blind, expected)
+
+    @inlineCallbacks
+    def test_create_generates_id(self):
+        rows = self.mk_rows()
+        d = rows.create(None, {"foo": "bar"})
+        self.clock.advance(1)
+        result = yield d
+        self.assertEqual(self.stored(), {result["id"]: {"foo": "bar"}})
+
+    @inlineCallbacks
+    def test_create_many(self):
+        rows = self.mk_rows()
+        d = rows.create_many([("a", 1), ("b", 2), ("a", 3)])
+        self.clock.advance(1)
+        results = yield d
+        self.assertEqual(results, [
+            (True, {"id": "a", "data": 3}),
+            (True, {"id": "b", "data": 2}),
+            (True, {"id": "a", "data": 3}),
+        ])
+        self.assertEqual(self.stored(), {"a": 3, "b": 2})
+        self.assertEqual(self.backend.queue.writes, 2)
+
+    @inlineCallbacks
+    def test_failed_write(self):
+        stores = self.inner.get_store_collection("me")
+        yield stores.create("store", {"schema": {
+            "n": {"type": "integer", "index": True}}})
+        rows = self.mk_rows()
+        d = rows.create("a", {"n": "1"})
+        self.clock.advance(1)
+        yield self.assertFailure(d, SchemaViolation)
+
+    @inlineCallbacks
+    def test_get_sees_queued_writes(self):
+        rows = self.mk_rows()
+        rows.create("a", {"foo": "bar", "baz": 1})
+        result = yield rows.get("a")
+        self.assertEqual(result, {"id": "a", "data": {"foo": "bar", "baz": 1}})
+        result = yield rows.get("a", fields=["baz"])
+        self.assertEqual(result, {"id": "a", "data": {"baz": 1}})
+        version = yield rows.get_version("a")
+        self.assertEqual(version, data_version({"foo": "bar", "baz": 1}))
+        keys = yield rows.all_keys()
+        self.assertEqual(keys, [])
+
+    @inlineCallbacks
+    def test_delete_waits_for_queued_writes(self):
+        rows = self.mk_rows()
+        created = rows.create("a", 1)
+        result = yield rows.delete("a")
+        self.assertEqual(result, {"id": "a", "data": 1})
+        yield created
+        self.assertEqual(self.stored(), {})
+        # The flush that was scheduled has nothing left to write.
+        self.clock.advance(1)
+        self.assertEqual(self.backend.queue.writes, 1)
+
+    @inlineCallbacks
+    def test_update_with_version(self):
+        rows = self.mk_rows()
+        rows.create("a", 1)
+        yield self.assertFailure(
+            rows.update("a", 2, version=data_version(0)), VersionConflict)
+        result = yield rows.update("a", 2, version=data_version(1))
+        self.assertEqual(result, {"id": "a", "data": 2})
+        self.assertEqual(self.stored(), {"a": 2})
+
+    @inlineCallbacks
+    def test_durability_queued(self):
+        rows = self.mk_rows(durability=DURABILITY_QUEUED)
+        result = yield rows.create("a", 1)
+        self.assertEqual(result, {"id": "a", "data": 1})
+        self.assertEqual(self.stored(), {})
+        yield self.backend.flush()
+        self.assertEqual(self.stored(), {"a": 1})
+
+    @inlineCallbacks
+    def test_durability_queued_failure_logged(self):
+        rows = self.mk_rows(durability=DURABILITY_QUEUED)
+        yield rows.update("missing", 1)
+        yield self.backend.flush()
+        [failure] = self.flushLoggedErrors(ObjectNotFound)
+
+    @inlineCallbacks
+    def test_writes_to_same_object_are_ordered(self):
+        rows = self.mk_rows()
+        rows.create("a", 1)
+        first = self.backend.flush()
+        self.assertEqual(self.backend.queue.get(("rows", "me", "store", "a"))
+                         .data, 1)
+        second = rows.update("a", 2)
+        self.backend.flush()
+        yield first
+        yield second
+        self.assertEqual(self.stored(), {"a": 2})
+
+    def test_invalid_durability(self):
+        self.assertRaises(
+            ValueError, CoalescingCollectionBackend, self.inner,
+            durability="sometimes")
+
+
+class TestCoalescingInMemoryStore(VumiTestCase, CommonStoreTests):
+    def make_store_backend(self):
+        return CoalescingCollectionBackend(
+            InMemoryCollectionBackend({}), delay=0)
@@ -6,9 +6,17 @@ from twisted.trial.unittest import SkipTest
 from vumi.tests.helpers import VumiTestCase, PersistenceHelper
 from zope.interface.verify import verifyObject
 
+from go_store_service.aggregation import Aggregation
 from go_store_service.collections import (
-    InMemoryCollectionBackend, RiakCollectionBackend)
-from go_store_service.interfaces import ICollection, IStoreBackend
+    InMemoryCollectionBackend, RiakCollectionBackend, CachedCollectionBackend,
+    InstrumentedCollectionBackend)
+from go_store_service.collections.riak import StoreData, RowData
+from go_store_service.encoding import data_size, data_version
+from go_store_service.interfaces import (
+    ICollection, IStoreBackend, ObjectNotFound, SchemaViolation,
+    VersionConflict)
+from go_store_service.metrics import MetricsRegistry
+from go_store_service.query import Query
 
 
 def skip_for_backend(*backends):
@@ -71,6 +79,25 @@ class CommonStoreTests(object):
         d.addCallback(lambda objs: [o for o in objs if o is not None])
         return d
 
+    @inlineCallbacks
+    def filtered_paged_keys(self, collection, limit):
+        """
+        Get all keys in a collection by walking through pages of keys. Some
+        backends may have some index deletion lag, so we might need to filter
+        the results. This implementation doesn't do any filtering, but
+        subclasses can override.
+
+        This returns a list of pages of keys.
+        """
+        pages = []
+        cursor = None
+        while True:
+            keys, cursor = yield collection.page_keys(limit, cursor)
+            pages.append(keys)
+            if cursor is None:
+                break
+        returnValue(pages)
+
     def ensure_equal(self, foo, bar, msg=None):
         """
         Similar to .assertEqual(), but raises an exception instead of failing.
@@ -168,6 +195,53 @@ class CommonStoreTests(object):
         all_store_data = yield self.filtered_all(stores)
         self.assertEqual(all_store_data, [store_data])
 
+    @inlineCallbacks
+    def test_store_collection_all_keys_empty_stores_for_other_owner(self):
+        """
+        Listing all stores returns an empty list when no stores exist for the
+        owner, even when stores exist for other owners.
+        """
+        backend = self.get_store_backend()
+        stores = yield backend.get_store_collection("me")
+        other_stores = yield backend.get_store_collection("other")
+        yield other_stores.create(None, {})
+
+        store_keys = yield self.filtered_all_keys(stores)
+        self.assertEqual(store_keys, [])
+
+    @inlineCallbacks
+    def test_store_collection_page_keys(self):
+        """
+        Stores can be listed a page at a time.
+        """
+        stores = yield self.get_empty_store_collection()
+        for key in ['a', 'b', 'c']:
+            yield stores.create(key, {})
+        other_stores = yield self.get_store_backend().get_store_collection(
+            "other")
+        yield other_stores.create('d', {})
+
+        pages = yield self.filtered_paged_keys(stores, 2)
+        self.assertEqual(pages[:2], [['a', 'b'], ['c']])
+        self.assertEqual(sum(pages, []), ['a', 'b', 'c'])
+
+    @inlineCallbacks
+    def test_store_collection_page(self):
+        """
+        Stores can be retrieved a page at a time.
+        """
+        stores = yield self.get_empty_store_collection()
+        for key in ['a', 'b', 'c']:
+            yield stores.create(key, {'name': key})
+
+        objs, cursor = yield stores.page(2, None)
+        objs = yield gatherResults([maybeDeferred(lambda: o) for o in objs])
+        self.assertEqual(objs, [
+            {'id': 'a', 'data': {'name': 'a'}},
+            {'id': 'b', 'data': {'name': 'b'}},
+        ])
+        self.assertNotEqual(cursor, None)
+
     @inlineCallbacks
     def test_store_collection_get_missing_object(self):
         """
@@ -178,6 +252,20 @@ class CommonStoreTests(object):
         store_data = yield stores.get('missing')
         self.assertEqual(store_data, None)
 
+    @inlineCallbacks
+    def test_store_collection_get_many(self):
+        """
+        Asking for many objects returns them in the order they were asked
+        for, with None for objects that don't exist.
+        """
+        stores = yield self.get_empty_store_collection()
+        store_a = yield stores.create('a', {'name': 'a'})
+        store_b = yield stores.create('b', {'name': 'b'})
+
+        objs = yield stores.get_many(['b', 'missing', 'a'])
+        objs = yield gatherResults([maybeDeferred(lambda: o) for o in objs])
+        self.assertEqual(objs, [store_b, None, store_a])
+
     @inlineCallbacks
     def test_store_collection_create_and_get_null_data(self):
         """
@@ -247,6 +335,25 @@ class CommonStoreTests(object):
         got_data = yield stores.get('key')
         self.assertEqual(store_data, got_data)
 
+    @inlineCallbacks
+    def test_store_collection_create_many(self):
+        """
+        Creating many objects returns a result for each object and generates
+        ids where necessary.
+        """
+        stores = yield self.get_empty_store_collection()
+
+        results = yield stores.create_many([('a', {'foo': 1}), (None, 'bar')])
+        [(success_a, store_a), (success_b, store_b)] = results
+        self.assertEqual((success_a, success_b), (True, True))
+        self.assertEqual(store_a, {'id': 'a', 'data': {'foo': 1}})
+        self.assertEqual(store_b, {'id': store_b['id'], 'data': 'bar'})
+
+        got_data = yield stores.get('a')
+        self.assertEqual(got_data, store_a)
+        got_data = yield stores.get(store_b['id'])
+        self.assertEqual(got_data, store_b)
+
     @inlineCallbacks
     def test_store_collection_delete_missing_store(self):
         stores = yield self.get_empty_store_collection()
@@ -282,6 +389,28 @@ class CommonStoreTests(object):
         store_data = yield stores.get(store_key)
         self.assertEqual(store_data, {'id': store_key, 'data': {'foo': 'bar'}})
 
+    @inlineCallbacks
+    def test_store_collection_get_version(self):
+        stores = yield self.get_empty_store_collection()
+        version = yield stores.get_version("missing")
+        self.assertEqual(version, None)
+
+        yield stores.create("store", {"foo": "bar"})
+        version = yield stores.get_version("store")
+        self.assertEqual(version, data_version({"foo": "bar"}))
+
+    @inlineCallbacks
+    def test_store_collection_update_with_version(self):
+        stores = yield self.get_empty_store_collection()
+        yield stores.create("store", {"foo": "bar"})
+        version = yield stores.get_version("store")
+        yield self.assertFailure(
+            maybeDeferred(
+                stores.update, "store", {"foo": "baz"}, "old-version"),
+            VersionConflict)
+        store_data = yield stores.update("store", {"foo": "baz"}, version)
+        self.assertEqual(store_data, {'id': "store", 'data': {'foo': 'baz'}})
+
     ##############################################
     # Tests for row collection functionality.
 
@@ -364,6 +493,281 @@ class CommonStoreTests(object):
         all_row_data = yield self.filtered_all(rows)
         self.assertEqual(all_row_data, [])
 
+    @inlineCallbacks
+    def test_row_collection_page_keys(self):
+        """
+        Rows can be listed a page at a time.
+        """
+        rows = yield self.get_empty_row_collection()
+        for key in ['a', 'b', 'c']:
+            yield rows.create(key, {})
+        other_rows = yield self.get_store_backend().get_row_collection(
+            "me", "other_store")
+        yield other_rows.create('d', {})
+
+        pages = yield self.filtered_paged_keys(rows, 2)
+        self.assertEqual(pages[:2], [['a', 'b'], ['c']])
+        self.assertEqual(sum(pages, []), ['a', 'b', 'c'])
+
+    @inlineCallbacks
+    def test_row_collection_page(self):
+        """
+        Rows can be retrieved a page at a time.
+        """
+        rows = yield self.get_empty_row_collection()
+        for key in ['a', 'b', 'c']:
+            yield rows.create(key, {'name': key})
+
+        objs, cursor = yield rows.page(2, None)
+        objs = yield gatherResults([maybeDeferred(lambda: o) for o in objs])
+        self.assertEqual(objs, [
+            {'id': 'a', 'data': {'name': 'a'}},
+            {'id': 'b', 'data': {'name': 'b'}},
+        ])
+        self.assertNotEqual(cursor, None)
+
+    @inlineCallbacks
+    def test_row_collection_get_fields(self):
+        """
+        Only the requested fields of a row are returned.
+        """
+        rows = yield self.get_empty_row_collection()
+        yield rows.create("row", {
+            "name": "a", "address": {"city": "b", "street": "c"}, "n": 1})
+
+        row_data = yield rows.get("row", fields=["name", "address.city"])
+        self.assertEqual(row_data, {
+            "id": "row", "data": {"name": "a", "address": {"city": "b"}}})
+        row_data = yield rows.get("missing", fields=["name"])
+        self.assertEqual(row_data, None)
+
+    @inlineCallbacks
+    def test_row_collection_all_fields(self):
+        """
+        Only the requested fields of each row are listed.
+        """
+        rows = yield self.get_empty_row_collection()
+        for key in ['a', 'b']:
+            yield rows.create(key, {'name': key, 'extra': [key] * 10})
+
+        objs = yield rows.all(fields=["name"])
+        objs = yield gatherResults([maybeDeferred(lambda: o) for o in objs])
+        self.assertEqual(sorted(objs, key=lambda obj: obj['id']), [
+            {'id': 'a', 'data': {'name': 'a'}},
+            {'id': 'b', 'data': {'name': 'b'}},
+        ])
+
+    @inlineCallbacks
+    def test_row_collection_page_fields(self):
+        """
+        Only the requested fields of each row in a page are returned.
+        """
+        rows = yield self.get_empty_row_collection()
+        for key in ['a', 'b', 'c']:
+            yield rows.create(key, {'name': key, 'extra': key})
+
+        objs, cursor = yield rows.page(2, None, fields=["name"])
+        objs = yield gatherResults([maybeDeferred(lambda: o) for o in objs])
+        self.assertEqual(objs, [
+            {'id': 'a', 'data': {'name': 'a'}},
+            {'id': 'b', 'data': {'name': 'b'}},
+        ])
+
+    @inlineCallbacks
+    def test_row_collection_query(self):
+        """
+        Only rows that match a query are returned.
+        """
+        rows = yield self.get_empty_row_collection()
+        yield rows.create("a", {"status": "active", "n": 1})
+        yield rows.create("b", {"status": "inactive", "n": 2})
+        yield rows.create("c", {"status": "active", "n": 3})
+        yield rows.create("d", "active")
+
+        objs = yield rows.query(
+            Query.parse(['status == "active"', 'n >= 2']))
+        objs = yield gatherResults([maybeDeferred(lambda: o) for o in objs])
+        self.assertEqual([o for o in objs if o is not None], [
+            {"id": "c", "data": {"status": "active", "n": 3}},
+        ])
+
+    @inlineCallbacks
+    def test_row_collection_count(self):
+        """
+        Rows can be counted, optionally only those that match a query.
+        """
+        rows = yield self.get_empty_row_collection()
+        count = yield rows.count()
+        self.assertEqual(count, 0)
+        yield rows.create("a", {"status": "active", "n": 1})
+        yield rows.create("b", {"status": "inactive", "n": 2})
+        yield rows.create("c", {"status": "active", "n": 3})
+        yield rows.delete("b")
+        count = yield rows.count()
+        self.assertEqual(count, 2)
+        count = yield rows.count(Query.parse(['n > 1']))
+        self.assertEqual(count, 1)
+
+    @inlineCallbacks
+    def test_store_collection_count(self):
+        """
+        Stores can be counted.
+        """
+        stores = yield self.get_empty_store_collection()
+        yield stores.create("a", {})
+        yield stores.create("b", {"name": "b"})
+        count = yield stores.count()
+        self.assertEqual(count, 2)
+        count = yield stores.count(Query.parse(['name == "b"']))
+        self.assertEqual(count, 1)
+
+    @inlineCallbacks
+    def test_store_stats(self):
+        """
+        Each store's row count, total size and last modified time are kept
+        up to date as its rows are written.
+        """
+        backend = self.get_store_backend()
+        stats = yield backend.get_store_stats("me", "store")
+        self.assertEqual(stats, {
+            "rows": 0,
+            "bytes": 0,
+            "last_modified": None,
+            "approximate": False,
+        })
+        rows = yield backend.get_row_collection("me", "store")
+        yield rows.create("a", {"n": 1})
+        yield rows.create("b", {"n": "two"})
+        yield rows.create("a", {"n": 10})
+        yield rows.update("b", {"n": 2})
+        yield rows.create("c", {"n": 3})
+        yield rows.delete("c")
+        yield rows.delete("missing")
+        other_rows = yield backend.get_row_collection("me", "other")
+        yield other_rows.create("a", {"n": 4})
+
+        stats = yield backend.get_store_stats("me", "store")
+        self.assertEqual(stats["rows"], 2)
+        self.assertEqual(
+            stats["bytes"], data_size({"n": 10}) + data_size({"n": 2}))
+        self.assertNotEqual(stats["last_modified"], None)
+        self.assertEqual(stats["approximate"], False)
+        other_stats = yield backend.get_store_stats("me", "other")
+        self.assertEqual(other_stats["rows"], 1)
+
+    @inlineCallbacks
+    def test_row_collection_aggregate(self):
+        """
+        Rows can be counted and summed in groups.
+        """
+        rows = yield self.get_empty_row_collection()
+        yield rows.create("a", {"status": "paid", "amount": 5})
+        yield rows.create("b", {"status": "paid", "amount": 2.5})
+        yield rows.create("c", {"status": "new", "amount": 1})
+        yield rows.create("d", {"amount": "lots"})
+
+        results = yield rows.aggregate(
+            Aggregation(group_by="status", sums=["amount"]))
+        self.assertEqual(results, [
+            {"group": None, "count": 1, "sum": {"amount": 0}},
+            {"group": "new", "count": 1, "sum": {"amount": 1}},
+            {"group": "paid", "count": 2, "sum": {"amount": 7.5}},
+        ])
+
+        results = yield rows.aggregate(
+            Aggregation(sums=["amount"]), Query.parse(["amount < 5"]))
+        self.assertEqual(results, [
+            {"group": None, "count": 2, "sum": {"amount": 3.5}},
+        ])
+
+    @inlineCallbacks
+    def test_row_collection_query_fields(self):
+        """
+        Only the requested fields of rows that match a query are returned.
+        """
+        rows = yield self.get_empty_row_collection()
+        yield rows.create("a", {"status": "active", "n": 1})
+        yield rows.create("b", {"status": "inactive", "n": 2})
+
+        objs = yield rows.query(
+            Query.parse(['status ^= "act"']), fields=["n"])
+        objs = yield gatherResults([maybeDeferred(lambda: o) for o in objs])
+        self.assertEqual([o for o in objs if o is not None], [
+            {"id": "a", "data": {"n": 1}},
+        ])
+
+    @inlineCallbacks
+    def test_store_collection_invalid_schema(self):
+        """
+        Stores with invalid schemas can't be written.
+        """
+        backend = self.get_store_backend()
+        stores = yield backend.get_store_collection("me")
+        yield self.assertFailure(
+            maybeDeferred(stores.create, "store", {"schema": []}),
+            SchemaViolation)
+        yield stores.create("store", {})
+        yield self.assertFailure(
+            maybeDeferred(stores.update, "store", {"schema": {
+                "a": {"type": "float", "index": True}}}),
+            SchemaViolation)
+
+    @inlineCallbacks
+    def get_schema_row_collection(self, schema):
+        backend = self.get_store_backend()
+        stores = yield backend.get_store_collection("me")
+        yield stores.create("store", {"schema": schema})
+        rows = yield backend.get_row_collection("me", "store")
+        returnValue(rows)
+
+    @inlineCallbacks
+    def test_row_collection_schema_violation(self):
+        """
+        Rows whose indexed fields have the wrong type can't be written.
+        """
+        rows = yield self.get_schema_row_collection({
+            "n": {"type": "integer", "index": True}})
+        yield self.assertFailure(
+            maybeDeferred(rows.create, "row", {"n": "1"}), SchemaViolation)
+        yield rows.create("row", {"n": 1})
+        yield self.assertFailure(
+            maybeDeferred(rows.update, "row", {"n": 1.5}), SchemaViolation)
+        row_data = yield rows.get("row")
+        self.assertEqual(row_data, {"id": "row", "data": {"n": 1}})
+
+        [(success, failure)] = yield rows.create_many([("row2", {"n": "1"})])
+        self.assertEqual(success, False)
+        self.assertTrue(failure.check(SchemaViolation))
+
+    @inlineCallbacks
+    def test_row_collection_query_indexed(self):
+        """
+        Queries on indexed fields return the same rows as other queries.
+        """
+        rows = yield self.get_schema_row_collection({
+            "status": {"type": "string", "index": True},
+            "n": {"type": "integer", "index": True}})
+        yield rows.create("a", {"status": "active", "n": 1})
+        yield rows.create("b", {"status": "inactive", "n": 2})
+        yield rows.create("c", {"status": "active", "n": 3})
+        yield rows.create("d", {"n": -4})
+        yield rows.update("a", {"status": "inactive", "n": 1})
+        yield rows.delete("b")
+
+        @inlineCallbacks
+        def query(*conditions):
+            objs = yield rows.query(Query.parse(conditions))
+            objs = yield gatherResults(
+                [maybeDeferred(lambda: o) for o in objs])
+            returnValue(sorted(o["id"] for o in objs if o is not None))
+
+        self.assertEqual((yield query('status == "active"')), ["c"])
+        self.assertEqual((yield query('status ^= "in"')), ["a"])
+        self.assertEqual((yield query('n > 1')), ["c"])
+        self.assertEqual((yield query('n <= 1')), ["a", "d"])
+        self.assertEqual((yield query('n >= -4', 'n < 3')), ["a", "d"])
+        self.assertEqual((yield query('n == 3', 'status == "x"')), [])
+
     @inlineCallbacks
     def test_row_collection_get_missing_object(self):
         """
@@ -374,6 +778,20 @@ class CommonStoreTests(object):
         row_data = yield rows.get('missing')
         self.assertEqual(row_data, None)
 
+    @inlineCallbacks
+    def test_row_collection_get_many(self):
+        """
+        Asking for many objects returns them in the order they were asked
+        for, with None for objects that don't exist.
+        """
+        rows = yield self.get_empty_row_collection()
+        row_a = yield rows.create('a', {'name': 'a'})
+        row_b = yield rows.create('b', {'name': 'b'})
+
+        objs = yield rows.get_many(['b', 'missing', 'a'])
+        objs = yield gatherResults([maybeDeferred(lambda: o) for o in objs])
+        self.assertEqual(objs, [row_b, None, row_a])
+
     @inlineCallbacks
     def test_row_collection_create_and_get_null_data(self):
         """
@@ -443,6 +861,25 @@ class CommonStoreTests(object):
         got_data = yield rows.get('key')
         self.assertEqual(row_data, got_data)
 
+    @inlineCallbacks
+    def test_row_collection_create_many(self):
+        """
+        Creating many objects returns a result for each object and generates
+        ids where necessary.
+        """
+        rows = yield self.get_empty_row_collection()
+
+        results = yield rows.create_many([('a', {'foo': 1}), (None, 'bar')])
+        [(success_a, row_a), (success_b, row_b)] = results
+        self.assertEqual((success_a, success_b), (True, True))
+        self.assertEqual(row_a, {'id': 'a', 'data': {'foo': 1}})
+        self.assertEqual(row_b, {'id': row_b['id'], 'data': 'bar'})
+
+        got_data = yield rows.get('a')
+        self.assertEqual(got_data, row_a)
+        got_data = yield rows.get(row_b['id'])
+        self.assertEqual(got_data, row_b)
+
     @inlineCallbacks
     def test_row_collection_delete_missing_row(self):
         rows = yield self.get_empty_row_collection()
@@ -477,12 +914,128 @@ class CommonStoreTests(object):
         row_data = yield rows.get(row_key)
         self.assertEqual(row_data, {'id': row_key, 'data': {'foo': 'bar'}})
 
+    @inlineCallbacks
+    def test_row_collection_update_missing(self):
+        rows = yield self.get_empty_row_collection()
+        yield self.assertFailure(
+            maybeDeferred(rows.update, "missing", {}), ObjectNotFound)
+        yield self.assertFailure(
+            maybeDeferred(rows.update, "missing", {}, blind=False),
+            ObjectNotFound)
+        row_data = yield rows.get("missing")
+        self.assertEqual(row_data, None)
+
+    @inlineCallbacks
+    def test_row_collection_update_blind(self):
+        """
+        Blind updates never create objects.
+        """
+        rows = yield self.get_empty_row_collection()
+        yield rows.create("row", {"foo": "bar"})
+        row_data = yield rows.update("row", {"foo": "baz"}, blind=True)
+        self.assertEqual(row_data, {"id": "row", "data": {"foo": "baz"}})
+        row_data = yield rows.get("row")
+        self.assertEqual(row_data, {"id": "row", "data": {"foo": "baz"}})
+        yield self.assertFailure(
+            maybeDeferred(rows.update, "new", {"foo": "new"}, blind=True),
+            ObjectNotFound)
+        row_data = yield rows.get("new")
+        self.assertEqual(row_data, None)
+
+    @inlineCallbacks
+    def test_row_collection_update_blind_with_version(self):
+        """
+        Updates with a version check the version even if they're blind.
+        """
+        rows = yield self.get_empty_row_collection()
+        yield rows.create("row", {"foo": "bar"})
+        yield self.assertFailure(
+            maybeDeferred(
+                rows.update, "row", {}, data_version({"foo": "baz"}),
+                blind=True),
+            VersionConflict)
+        yield self.assertFailure(
+            maybeDeferred(
+                rows.update, "missing", {}, data_version({}), blind=True),
+            ObjectNotFound, VersionConflict)
+
+    @inlineCallbacks
+    def test_store_collection_update_missing(self):
+        stores = yield self.get_empty_store_collection()
+        yield self.assertFailure(
+            maybeDeferred(stores.update, "missing", {}), ObjectNotFound)
+        yield self.assertFailure(
+            maybeDeferred(stores.update, "missing", {}, blind=True),
+            ObjectNotFound)
+        store_data = yield stores.get("missing")
+        self.assertEqual(store_data, None)
+
+    @inlineCallbacks
+    def test_row_collection_get_version(self):
+        rows = yield self.get_empty_row_collection()
+        version = yield rows.get_version("missing")
+        self.assertEqual(version, None)
+
+        yield rows.create("row", {"foo": "bar"})
+        version = yield rows.get_version("row")
+        self.assertEqual(version, data_version({"foo": "bar"}))
+        yield rows.update("row", {"foo": "baz"})
+        new_version = yield rows.get_version("row")
+        self.assertEqual(new_version, data_version({"foo": "baz"}))
+
+    @inlineCallbacks
+    def test_row_collection_update_with_version(self):
+        rows = yield self.get_empty_row_collection()
+        yield rows.create("row", {"foo": "bar"})
+        version = yield rows.get_version("row")
+
+        yield self.assertFailure(
+            maybeDeferred(rows.update, "row", {"foo": "baz"}, "old-version"),
+            VersionConflict)
+        row_data = yield rows.get("row")
+        self.assertEqual(row_data, {'id': "row", 'data': {'foo': 'bar'}})
+
+        row_data = yield rows.update("row", {"foo": "baz"}, version)
+        self.assertEqual(row_data, {'id': "row", 'data': {'foo': 'baz'}})
+
+    @inlineCallbacks
+    def test_row_collection_delete_with_version(self):
+        rows = yield self.get_empty_row_collection()
+        yield rows.create("row", {"foo": "bar"})
+        version = yield rows.get_version("row")
+
+        yield self.assertFailure(
+            maybeDeferred(rows.delete, "row", "old-version"),
+            VersionConflict)
+        row_data = yield rows.get("row")
+        self.assertEqual(row_data, {'id': "row", 'data': {'foo': 'bar'}})
+
+        yield rows.delete("row", version)
+        row_data = yield rows.get("row")
+        self.assertEqual(row_data, None)
+
 
 class TestInMemoryStore(VumiTestCase, CommonStoreTests):
     def make_store_backend(self):
         return InMemoryCollectionBackend({})
 
 
+class TestInMemorySerializedStore(VumiTestCase, CommonStoreTests):
+    def make_store_backend(self):
+        return InMemoryCollectionBackend({}, serialized=True)
+
+
+class TestCachedInMemoryStore(VumiTestCase, CommonStoreTests):
+    def make_store_backend(self):
+        return CachedCollectionBackend(InMemoryCollectionBackend({}), 100)
+
+
+class TestInstrumentedInMemoryStore(VumiTestCase, CommonStoreTests):
+    def make_store_backend(self):
+        return InstrumentedCollectionBackend(
+            InMemoryCollectionBackend({}), MetricsRegistry())
+
+
 class TestRiakStore(VumiTestCase, CommonStoreTests):
     def setUp(self):
         self.persistence_helper = self.add_helper(
@@ -490,7 +1043,9 @@ class TestRiakStore(VumiTestCase, CommonStoreTests):
         self.manager = self.persistence_helper.get_riak_manager()
 
     def make_store_backend(self):
-        return RiakCollectionBackend(self.manager)
+        # Rows are loaded before they're created so that the store's stats
+        # stay exact, as the common tests expect.
+        return RiakCollectionBackend(self.manager, load_before_create=True)
 
     @inlineCallbacks
     def filtered_all_keys(self, collection):
@@ -513,3 +1068,42 @@ class TestRiakStore(VumiTestCase, CommonStoreTests):
 
         checked_keys = yield gatherResults([check_key(key) for key in keys])
         returnValue([key for key in checked_keys if key is not None])
+
+    def store_unindexed(self, modelcls, key, data):
+        """
+        Store an object the way it was stored before indexes were added.
+        """
+        riak_object = self.manager.riak_object(modelcls, key)
+        riak_object.set_data({'data': data})
+        return riak_object.store()
+
+    @inlineCallbacks
+    def test_store_collection_reindex(self):
+        backend = self.get_store_backend()
+        stores = yield backend.get_store_collection("me")
+        yield self.store_unindexed(StoreData, "store", {"foo": "bar"})
+        store_keys = yield self.filtered_all_keys(stores)
+        self.ensure_equal(store_keys, [])
+
+        reindexed = yield stores.reindex(["store", "missing"])
+        self.assertEqual(reindexed, 1)
+        store_keys = yield self.filtered_all_keys(stores)
+        self.assertEqual(store_keys, ["store"])
+        store_data = yield stores.get("store")
+        self.assertEqual(store_data, {"id": "store", "data": {"foo": "bar"}})
+
+    @inlineCallbacks
+    def test_row_collection_reindex(self):
+        backend = self.get_store_backend()
+        rows = yield backend.get_row_collection("me", "store")
+        yield self.store_unindexed(RowData, "store:row", {"foo": "bar"})
+        yield self.store_unindexed(RowData, "other_store:row", {})
+        row_keys = yield self.filtered_all_keys(rows)
+        self.ensure_equal(row_keys, [])
+
+        reindexed = yield rows.reindex()
+        self.assertEqual(reindexed, 1)
+        row_keys = yield self.filtered_all_keys(rows)
+        self.assertEqual(row_keys, ["row"])
+        row_data = yield rows.get("row")
+        self.assertEqual(row_data, {"id": "row", "data": {"foo": "bar"}})
@@ -0,0 +1,48 @@
+from twisted.trial.unittest import TestCase
+from zope.interface import implementer
+from zope.interface.verify import verifyObject
+
+from go_store_service.collections.forwarding import ForwardingCollection
+from go_store_service.collections.inmemory import InMemoryCollectionBackend
+from go_store_service.interfaces import ICollection
+
+
+@implementer(ICollection)
+class RecordingCollection(object):
+    """
+    Collection stub that returns the name and arguments of each call.
+    """
+
+    def __getattr__(self, name):
+        if name not in ICollection:
+            raise AttributeError(name)
+        return lambda *args, **kw: (name, args, kw)
+
+
+class TestForwardingCollection(TestCase):
+    def test_provides_ICollection(self):
+        backend = InMemoryCollectionBackend({})
+        verifyObject(
+            ICollection,
+            ForwardingCollection(backend.get_store_collection("me")))
+
+    def test_forwards_calls(self):
+        collection = ForwardingCollection(RecordingCollection())
+        self.assertEqual(collection.all_keys(), ("all_keys", (), {}))
+        self.assertEqual(
+            collection.page("c", 5, fields=["a"]),
+            ("page", ("c", 5), {"fields": ["a"]}))
+        self.assertEqual(
+            collection.count({"a": 1}), ("count", ({"a": 1},), {}))
+        self.assertEqual(
+            collection.update("a", {}, blind=True),
+            ("update", ("a", {}, None, True), {}))
+        self.assertEqual(
+            collection.delete("a", "v1"), ("delete", ("a", "v1"), {}))
+
+    def test_cheap_versions(self):
+        backend = InMemoryCollectionBackend({})
+        collection = ForwardingCollection(backend.get_store_collection("me"))
+        self.assertEqual(collection.cheap_versions, True)
+        self.patch(collection._collection, 'cheap_versions', False)
+        self.assertEqual(collection.cheap_versions, False)
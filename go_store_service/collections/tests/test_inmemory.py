@@ -1,7 +1,13 @@
+from twisted.internet.defer import inlineCallbacks
 from twisted.internet.task import Clock
 from twisted.trial.unittest import TestCase
 
-from go_store_service.collections.inmemory import defer_async
+from go_store_service.collections.inmemory import (
+    InMemoryCollection, InMemoryCollectionBackend, InMemoryIndex,
+    InMemoryRowCollection, InMemoryStats, defer_async)
+from go_store_service.encoding import RawJson, data_size, data_version
+from go_store_service.query import Query
+from go_store_service.schema import Schema
 
 
 class TestInMemoryCollectionMisc(TestCase):
@@ -12,3 +18,281 @@ class TestInMemoryCollectionMisc(TestCase):
         clock.advance(0)
         self.assertEqual(d.called, True)
         self.assertEqual(d.result, 'foo')
+
+
+class TestInMemoryCollection(TestCase):
+    @inlineCallbacks
+    def test_create_copies_data(self):
+        store = {}
+        collection = InMemoryCollection(store)
+        data = {"foo": ["bar"]}
+        yield collection.create("obj", data)
+        data["foo"].append("baz")
+        self.assertEqual(store, {"obj": {"foo": ["bar"]}})
+
+    @inlineCallbacks
+    def test_get_copies_data(self):
+        store = {"obj": {"foo": ["bar"]}}
+        collection = InMemoryCollection(store)
+        obj = yield collection.get("obj")
+        obj["data"]["foo"].append("baz")
+        self.assertEqual(store, {"obj": {"foo": ["bar"]}})
+
+    @inlineCallbacks
+    def test_get_fields_copies_data(self):
+        store = {"obj": {"foo": ["bar"], "baz": 1}}
+        collection = InMemoryCollection(store)
+        obj = yield collection.get("obj", fields=["foo"])
+        self.assertEqual(obj, {"id": "obj", "data": {"foo": ["bar"]}})
+        obj["data"]["foo"].append("baz")
+        self.assertEqual(store, {"obj": {"foo": ["bar"], "baz": 1}})
+
+    @inlineCallbacks
+    def test_get_fields_raw(self):
+        store = {"obj": '{"foo": ["bar"], "baz": 1}'}
+        collection = InMemoryCollection(store, serialized=True, raw=True)
+        obj = yield collection.get("obj", fields=["baz"])
+        self.assertEqual(obj, {"id": "obj", "data": {"baz": 1}})
+
+    def test_query_streamed(self):
+        store = {"a": {"n": 1}, "b": {"n": 2}}
+        collection = InMemoryCollection(store, reactor=Clock())
+        d = collection.query(Query.parse(["n == 2"]))
+        collection.reactor.advance(0)
+        objs = self.successResultOf(d)
+        # Objects are checked as results are consumed, so later changes are
+        # seen.
+        store["a"] = {"n": 2}
+        del store["b"]
+        self.assertEqual(list(objs), [{"id": "a", "data": {"n": 2}}])
+
+    @inlineCallbacks
+    def test_query_raw(self):
+        store = {"a": '{"n": 1}', "b": '{"n": 2}'}
+        collection = InMemoryCollection(store, serialized=True, raw=True)
+        [obj] = yield collection.query(Query.parse(["n == 1"]))
+        self.assertEqual(obj.decode(), {"id": "a", "data": {"n": 1}})
+
+    @inlineCallbacks
+    def test_create_serialized(self):
+        store = {}
+        collection = InMemoryCollection(store, serialized=True)
+        data = {"foo": ["bar"]}
+        obj = yield collection.create("obj", data)
+        self.assertEqual(obj, {"id": "obj", "data": {"foo": ["bar"]}})
+        self.assertEqual(store, {"obj": '{"foo": ["bar"]}'})
+
+    @inlineCallbacks
+    def test_get_serialized(self):
+        store = {"obj": '{"foo": ["bar"]}'}
+        collection = InMemoryCollection(store, serialized=True)
+        obj = yield collection.get("obj")
+        self.assertEqual(obj, {"id": "obj", "data": {"foo": ["bar"]}})
+
+    @inlineCallbacks
+    def test_get_raw(self):
+        store = {"obj": '{"foo": ["bar"]}'}
+        collection = InMemoryCollection(store, serialized=True, raw=True)
+        obj = yield collection.get("obj")
+        self.assertTrue(isinstance(obj, RawJson))
+        self.assertEqual(
+            obj.encoded, '{"id": "obj", "data": {"foo": ["bar"]}}')
+        missing = yield collection.get("missing")
+        self.assertEqual(missing, None)
+
+    @inlineCallbacks
+    def test_all_raw(self):
+        store = {"obj": '{"foo": ["bar"]}'}
+        collection = InMemoryCollection(store, serialized=True, raw=True)
+        [obj] = yield collection.all()
+        self.assertEqual(obj.decode(), {"id": "obj", "data": {"foo": ["bar"]}})
+
+    @inlineCallbacks
+    def test_raw_requires_serialized(self):
+        store = {"obj": {"foo": ["bar"]}}
+        collection = InMemoryCollection(store, raw=True)
+        obj = yield collection.get("obj")
+        self.assertEqual(obj, {"id": "obj", "data": {"foo": ["bar"]}})
+
+    @inlineCallbacks
+    def test_version_cached(self):
+        store = {"obj": {"foo": "bar"}}
+        versions = {}
+        collection = InMemoryCollection(store, versions=versions)
+        version = yield collection.get_version("obj")
+        self.assertEqual(version, data_version({"foo": "bar"}))
+        self.assertEqual(versions, {"obj": version})
+        yield collection.update("obj", {"foo": "baz"})
+        self.assertEqual(versions, {})
+        yield collection.get_version("obj")
+        yield collection.delete("obj")
+        self.assertEqual(versions, {})
+
+    @inlineCallbacks
+    def test_raw_version(self):
+        store = {"obj": '{"foo": ["bar"]}'}
+        versions = {}
+        collection = InMemoryCollection(
+            store, serialized=True, raw=True, versions=versions)
+        [obj] = yield collection.all()
+        self.assertEqual(obj.version, None)
+        obj = yield collection.get("obj")
+        self.assertEqual(obj.version, data_version({"foo": ["bar"]}))
+        self.assertEqual(versions, {"obj": obj.version})
+        [obj] = yield collection.all()
+        self.assertEqual(obj.version, versions["obj"])
+
+    @inlineCallbacks
+    def test_sorted_ids_maintained(self):
+        store = {"b": {}, "d": {}}
+        sorted_ids = ["b", "d"]
+        collection = InMemoryCollection(store, sorted_ids=sorted_ids)
+        yield collection.create("c", {})
+        yield collection.update("b", {"x": 1})
+        yield collection.create("a", {})
+        yield collection.delete("d")
+        yield collection.delete("missing")
+        self.assertEqual(sorted_ids, ["a", "b", "c"])
+        keys, cursor = yield collection.page_keys(2, None)
+        self.assertEqual(keys, ["a", "b"])
+        keys, cursor = yield collection.page_keys(2, cursor)
+        self.assertEqual((keys, cursor), (["c"], None))
+
+
+class TestInMemoryIndex(TestCase):
+    def test_lookup(self):
+        index = InMemoryIndex()
+        index.set("a", ["x/1", "y/2"])
+        index.set("b", ["x/2"])
+        index.set("c", ["x/3"])
+        self.assertEqual(index.lookup("x/1", "x/2"), ["a", "b"])
+        self.assertEqual(index.lookup("x/", "x/\xff"), ["a", "b", "c"])
+        self.assertEqual(index.lookup("y/3", "y/4"), [])
+
+    def test_set_replaces(self):
+        index = InMemoryIndex()
+        index.set("a", ["x/1"])
+        index.set("a", ["x/2"])
+        self.assertEqual(index.lookup("x/1", "x/1"), [])
+        self.assertEqual(index.lookup("x/2", "x/2"), ["a"])
+        self.assertEqual(len(index), 1)
+
+    def test_remove(self):
+        index = InMemoryIndex()
+        index.set("a", ["x/1"])
+        index.set("b", ["x/1"])
+        index.remove("a")
+        index.remove("missing")
+        self.assertEqual(index.lookup("x/1", "x/1"), ["b"])
+
+
+class TestInMemoryStats(TestCase):
+    def test_set_and_remove(self):
+        stats = InMemoryStats()
+        stats.set("a", 10, 1.0)
+        stats.set("b", 5, 2.0)
+        stats.set("a", 7, 3.0)
+        self.assertEqual(stats.as_dict(), {
+            "rows": 2, "bytes": 12, "last_modified": 3.0,
+            "approximate": False})
+        stats.remove("b", 4.0)
+        stats.remove("missing", 5.0)
+        self.assertEqual(stats.as_dict(), {
+            "rows": 1, "bytes": 7, "last_modified": 4.0,
+            "approximate": False})
+
+
+class TestInMemoryRowCollection(TestCase):
+    def mk_rows(self, data, schema):
+        schemas = [schema]
+        return InMemoryRowCollection(
+            data, "me", "store", get_schema=lambda: schemas[0]), schemas
+
+    @inlineCallbacks
+    def test_query_uses_index(self):
+        data = {}
+        rows, _ = self.mk_rows(data, Schema({"n": "integer"}))
+        yield rows.create("a", {"n": 1})
+        yield rows.create("b", {"n": 2})
+        # Rows outside the index range aren't checked, so this row isn't
+        # returned even though it matches.
+        data["c"] = {"n": 2}
+        objs = yield rows.query(Query.parse(["n == 2"]))
+        self.assertEqual(list(objs), [{"id": "b", "data": {"n": 2}}])
+
+    @inlineCallbacks
+    def test_schema_change_rebuilds_index(self):
+        data = {"a": {"n": 1, "s": "x"}, "b": {"n": "2", "s": "y"}}
+        rows, schemas = self.mk_rows(data, Schema())
+        schemas[0] = Schema({"n": "integer", "s": "string"})
+        objs = yield rows.query(Query.parse(["s == y"]))
+        self.assertEqual(list(objs), [{"id": "b", "data": data["b"]}])
+        objs = yield rows.query(Query.parse(["n >= 1"]))
+        self.assertEqual(list(objs), [{"id": "a", "data": data["a"]}])
+        # Row "b" doesn't match the schema, so only its "s" field is indexed.
+        self.assertEqual(len(rows._index), 3)
+
+
+class TestInMemoryCollectionBackend(TestCase):
+    @inlineCallbacks
+    def test_sorted_ids_shared(self):
+        backend = InMemoryCollectionBackend({"rows": {"me": {"store": {
+            "b": {}}}}})
+        rows = backend.get_row_collection("me", "store")
+        yield rows.create("a", {})
+        rows = backend.get_row_collection("me", "store")
+        keys, _ = yield rows.page_keys(10, None)
+        self.assertEqual(keys, ["a", "b"])
+        stores = backend.get_store_collection("me")
+        yield stores.create("s", {})
+        keys, _ = yield backend.get_store_collection("me").page_keys(10, None)
+        self.assertEqual(keys, ["s"])
+
+    @inlineCallbacks
+    def test_rows_stored_per_store(self):
+        stores = {}
+        backend = InMemoryCollectionBackend(stores)
+        rows = backend.get_row_collection("me", "store")
+        other_rows = backend.get_row_collection("me", "other_store")
+        yield rows.create("row", {"foo": "bar"})
+        yield other_rows.create("row", {"baz": "quux"})
+        self.assertEqual(stores["rows"], {
+            "me": {
+                "store": {"row": {"foo": "bar"}},
+                "other_store": {"row": {"baz": "quux"}},
+            },
+        })
+
+    @inlineCallbacks
+    def test_stats_count_existing_rows(self):
+        """
+        Rows that were already in the backend's dict are counted.
+        """
+        backend = InMemoryCollectionBackend({"rows": {"me": {"store": {
+            "a": {"n": 1}, "b": {"n": 2}}}}})
+        stats = yield backend.get_store_stats("me", "store")
+        self.assertEqual(stats["rows"], 2)
+        self.assertEqual(stats["bytes"], 2 * data_size({"n": 1}))
+        self.assertEqual(stats["last_modified"], None)
+
+    @inlineCallbacks
+    def test_stats_serialized(self):
+        backend = InMemoryCollectionBackend({}, serialized=True)
+        rows = backend.get_row_collection("me", "store")
+        yield rows.create("a", {"n": 1})
+        yield rows.create("b", {"n": 2})
+        stats = yield backend.get_store_stats("me", "store")
+        self.assertEqual(stats["rows"], 2)
+        self.assertEqual(stats["bytes"], 2 * data_size({"n": 1}))
+
+    def test_stats_last_modified(self):
+        clock = Clock()
+        clock.advance(100)
+        backend = InMemoryCollectionBackend({}, reactor=clock)
+        rows = backend.get_row_collection("me", "store")
+        rows.create("a", {})
+        clock.advance(5)
+        rows.delete("a")
+        d = backend.get_store_stats("me", "store")
+        clock.advance(0)
+        self.assertEqual(self.successResultOf(d)["last_modified"], 105)
@@ -0,0 +1,79 @@
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+from zope.interface import implementer
+
+from go_store_service.collections.inmemory import InMemoryCollectionBackend
+from go_store_service.collections.instrumented import (
+    InstrumentedCollectionBackend)
+from go_store_service.interfaces import ICollection, IStoreBackend
+from go_store_service.metrics import MetricsRegistry
+
+
+@implementer(ICollection)
+class SlowCollection(object):
+    """
+    Collection stub whose calls take one second of fake time.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def get(self, object_id, fields=None):
+        self.clock.advance(1)
+        return {"id": object_id, "data": {}}
+
+    def delete(self, object_id, version=None):
+        self.clock.advance(1)
+        raise KeyError(object_id)
+
+
+@implementer(IStoreBackend)
+class SlowBackend(object):
+    def __init__(self, clock):
+        self.clock = clock
+
+    def get_store_collection(self, owner_id):
+        return SlowCollection(self.clock)
+
+    def get_row_collection(self, owner_id, store_id):
+        return SlowCollection(self.clock)
+
+
+class TestInstrumentedCollectionBackend(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.metrics = MetricsRegistry()
+
+    def mk_backend(self, backend):
+        return InstrumentedCollectionBackend(
+            backend, self.metrics, reactor=self.clock)
+
+    def test_records_duration(self):
+        backend = self.mk_backend(SlowBackend(self.clock))
+        rows = backend.get_row_collection("me", "store")
+        d = rows.get("id-1")
+        self.assertEqual(
+            self.successResultOf(d), {"id": "id-1", "data": {}})
+        self.assertEqual(backend.histogram.count(("rows", "get")), 1)
+        self.assertTrue(
+            'store_backend_duration_seconds_sum'
+            '{collection="rows",method="get"} 1.0\n'
+            in self.metrics.render())
+
+    def test_records_failure_duration(self):
+        backend = self.mk_backend(SlowBackend(self.clock))
+        stores = backend.get_store_collection("me")
+        self.failureResultOf(stores.delete("id-1"), KeyError)
+        self.assertEqual(backend.histogram.count(("stores", "delete")), 1)
+
+    @inlineCallbacks
+    def test_passes_through(self):
+        backend = InstrumentedCollectionBackend(
+            InMemoryCollectionBackend({}), self.metrics)
+        stores = backend.get_store_collection("me")
+        yield stores.create("store-1", {"a": 1})
+        store = yield stores.get("store-1")
+        self.assertEqual(store, {"id": "store-1", "data": {"a": 1}})
+        self.assertEqual(backend.histogram.count(("stores", "create")), 1)
+        self.assertEqual(backend.histogram.count(("stores", "get")), 1)
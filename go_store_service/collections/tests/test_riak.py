@@ -0,0 +1,89 @@
+from riak.bucket import BucketType, RiakBucket
+from riak.riak_object import RiakObject
+from twisted.internet.defer import Deferred
+from twisted.trial.unittest import TestCase
+from vumi.persist.riak_base import VumiRiakObjectBase
+
+from go_store_service.collections.riak import (
+    bounded_calls, get_vclock, pipelined_fetch, riak_object, set_vclock)
+
+
+class FakeModel(object):
+    """
+    Stands in for a vumi model, which keeps its Riak object in
+    ``_riak_object``.
+    """
+
+    def __init__(self, riak_obj):
+        self._riak_object = riak_obj
+
+
+class TestRiakCollectionMisc(TestCase):
+    def mk_fetcher(self):
+        fetches = []
+
+        def fetch(key):
+            d = Deferred()
+            fetches.append((key, d))
+            return d
+
+        return fetches, fetch
+
+    def test_pipelined_fetch_fills_window(self):
+        fetches, fetch = self.mk_fetcher()
+        results = pipelined_fetch(fetch, ['a', 'b', 'c', 'd'], 2)
+        first = next(results)
+        self.assertEqual([key for key, _d in fetches], ['a', 'b'])
+        self.assertEqual(first, fetches[0][1])
+        second = next(results)
+        self.assertEqual([key for key, _d in fetches], ['a', 'b', 'c'])
+        self.assertEqual(second, fetches[1][1])
+
+    def test_pipelined_fetch_key_order(self):
+        fetches, fetch = self.mk_fetcher()
+        results = list(pipelined_fetch(fetch, ['a', 'b', 'c'], 2))
+        for key, d in reversed(fetches):
+            d.callback(key.upper())
+        self.assertEqual(
+            [self.successResultOf(d) for d in results], ['A', 'B', 'C'])
+
+    def test_pipelined_fetch_no_keys(self):
+        fetches, fetch = self.mk_fetcher()
+        self.assertEqual(list(pipelined_fetch(fetch, [], 2)), [])
+        self.assertEqual(fetches, [])
+
+    def test_bounded_calls(self):
+        fetches, fetch = self.mk_fetcher()
+        d = bounded_calls(fetch, [('a',), ('b',), ('c',)], 2)
+        self.assertEqual([key for key, _d in fetches], ['a', 'b'])
+        fetches[1][1].callback('B')
+        self.assertEqual([key for key, _d in fetches], ['a', 'b', 'c'])
+        fetches[0][1].errback(Exception('A'))
+        fetches[2][1].callback('C')
+        [(a_success, a_result), b, c] = self.successResultOf(d)
+        self.assertEqual(a_success, False)
+        self.assertEqual(a_result.getErrorMessage(), 'A')
+        self.assertEqual([b, c], [(True, 'B'), (True, 'C')])
+
+    def mk_model(self):
+        bucket = RiakBucket(None, 'bucket', BucketType(None, 'default'))
+        client_obj = RiakObject(None, bucket, 'key')
+        return FakeModel(VumiRiakObjectBase(client_obj)), client_obj
+
+    def test_riak_object(self):
+        model, client_obj = self.mk_model()
+        self.assertEqual(riak_object(model), model._riak_object)
+        self.assertEqual(riak_object(model, client=True), client_obj)
+
+    def test_vclock(self):
+        model, client_obj = self.mk_model()
+        self.assertEqual(get_vclock(model), None)
+        set_vclock(model, 'vclock-1')
+        self.assertEqual(client_obj.vclock, 'vclock-1')
+        self.assertEqual(get_vclock(model), 'vclock-1')
+
+    def test_riak_object_missing(self):
+        self.assertRaises(RuntimeError, riak_object, object())
+        err = self.assertRaises(
+            RuntimeError, get_vclock, FakeModel(object()))
+        self.assertIn('_riak_object._riak_obj', str(err))
@@ -0,0 +1,66 @@
+from twisted.internet.defer import inlineCallbacks
+from twisted.trial.unittest import TestCase
+from zope.interface.verify import verifyObject
+
+from go_store_service.collections.inmemory import InMemoryCollectionBackend
+from go_store_service.collections.stats import StatsCollectionBackend
+from go_store_service.encoding import data_size, data_version
+from go_store_service.interfaces import ICollection, IStoreBackend
+
+
+class TestStatsCollectionBackend(TestCase):
+    def mk_backend(self, **kw):
+        return StatsCollectionBackend(InMemoryCollectionBackend({}, **kw))
+
+    def test_provides_interfaces(self):
+        backend = self.mk_backend()
+        verifyObject(IStoreBackend, backend)
+        verifyObject(ICollection, backend.get_store_collection("me"))
+
+    @inlineCallbacks
+    def test_get_includes_stats(self):
+        backend = self.mk_backend()
+        stores = backend.get_store_collection("me")
+        yield stores.create("store", {"name": "s"})
+        rows = backend.get_row_collection("me", "store")
+        yield rows.create("a", {"n": 1})
+
+        store = yield stores.get("store")
+        self.assertEqual(store["data"], {"name": "s"})
+        self.assertEqual(store["stats"]["rows"], 1)
+        self.assertEqual(store["stats"]["bytes"], data_size({"n": 1}))
+        store = yield stores.get("store", fields=["missing"])
+        self.assertEqual(store["data"], {})
+        self.assertEqual(store["stats"]["rows"], 1)
+
+    @inlineCallbacks
+    def test_get_raw(self):
+        backend = self.mk_backend(serialized=True, raw=True)
+        stores = backend.get_store_collection("me")
+        yield stores.create("store", {"name": "s"})
+        store = yield stores.get("store")
+        self.assertEqual(store["data"], {"name": "s"})
+        self.assertEqual(store["stats"]["rows"], 0)
+
+    @inlineCallbacks
+    def test_get_missing(self):
+        stores = self.mk_backend().get_store_collection("me")
+        store = yield stores.get("missing")
+        self.assertEqual(store, None)
+
+    @inlineCallbacks
+    def test_stats_not_versioned(self):
+        backend = self.mk_backend()
+        stores = backend.get_store_collection("me")
+        yield stores.create("store", {})
+        rows = backend.get_row_collection("me", "store")
+        yield rows.create("a", {})
+        version = yield stores.get_version("store")
+        self.assertEqual(version, data_version({}))
+
+    @inlineCallbacks
+    def test_listings_exclude_stats(self):
+        stores = self.mk_backend().get_store_collection("me")
+        yield stores.create("store", {})
+        objs = yield stores.all()
+        self.assertEqual(list(objs), [{"id": "store", "data": {}}])
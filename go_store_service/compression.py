@@ -0,0 +1,105 @@
+""" Streaming response compression.
+"""
+
+import zlib
+
+from cyclone.web import OutputTransform
+
+
+# Window bits for the gzip and zlib ("deflate") container formats.
+ENCODING_WBITS = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS,
+}
+
+
+def parse_accept(header):
+    """
+    Return the values accepted by an ``Accept`` or ``Accept-Encoding``
+    header, most preferred first. Values with a quality value of zero are
+    left out.
+    """
+    codings = []
+    for i, item in enumerate(header.split(",")):
+        parts = [part.strip() for part in item.split(";")]
+        coding = parts[0].lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            name, _sep, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            # Ties are broken by the order the client listed codings in.
+            codings.append((-quality, i, coding))
+    return [entry[2] for entry in sorted(codings)]
+
+
+class CompressedContentEncoding(OutputTransform):
+    """
+    Applies the gzip or deflate content encoding to a response, depending on
+    what the client accepts.
+
+    Each chunk that is flushed is compressed and sync-flushed on its own, so
+    streamed responses can be decompressed incrementally by the client.
+
+    :param request:
+        The request being responded to.
+    :param int level:
+        The zlib compression level to use, from 1 (fastest) to 9 (smallest).
+    :param int min_size:
+        Responses that are written in one piece and are smaller than this
+        many bytes aren't compressed. Streamed responses are always
+        compressed.
+    """
+
+    CONTENT_TYPES = set([
+        "application/json", "application/x-msgpack", "text/plain"])
+
+    def __init__(self, request, level=6, min_size=1024):
+        self.level = level
+        self.min_size = min_size
+        self._compressor = None
+        self._encoding = None
+        if request.supports_http_1_1() and request.method != "HEAD":
+            header = request.headers.get("Accept-Encoding", "")
+            for coding in parse_accept(header):
+                if coding in ENCODING_WBITS:
+                    self._encoding = coding
+                    break
+
+    def _should_compress(self, status_code, headers, chunk, finishing):
+        if self._encoding is None or status_code == 304:
+            return False
+        if "Content-Encoding" in headers:
+            return False
+        ctype = headers.get("Content-Type", "").split(";")[0].strip()
+        if ctype not in self.CONTENT_TYPES:
+            return False
+        return not finishing or len(chunk) >= self.min_size
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        if 'Vary' in headers:
+            headers['Vary'] += ', Accept-Encoding'
+        else:
+            headers['Vary'] = 'Accept-Encoding'
+        if self._should_compress(status_code, headers, chunk, finishing):
+            headers["Content-Encoding"] = self._encoding
+            self._compressor = zlib.compressobj(
+                self.level, zlib.DEFLATED, ENCODING_WBITS[self._encoding])
+            chunk = self.transform_chunk(chunk, finishing)
+            if "Content-Length" in headers:
+                headers["Content-Length"] = str(len(chunk))
+        return status_code, headers, chunk
+
+    def transform_chunk(self, chunk, finishing):
+        if self._compressor is None:
+            return chunk
+        compressed = self._compressor.compress(chunk)
+        if finishing:
+            return compressed + self._compressor.flush()
+        return compressed + self._compressor.flush(zlib.Z_SYNC_FLUSH)
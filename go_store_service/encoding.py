@@ -0,0 +1,199 @@
+""" JSON and MessagePack encoding helpers.
+
+If `ujson`_ is installed and encodes floats losslessly it is used to encode
+objects, otherwise the standard library's :mod:`json` module is used. The
+MessagePack helpers require `msgpack`_ to be installed.
+
+.. _ujson: https://pypi.python.org/pypi/ujson
+.. _msgpack: https://pypi.python.org/pypi/msgpack
+"""
+
+import json
+import struct
+from hashlib import sha1
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/x-msgpack"
+
+# Each frame of a multi-object MessagePack response starts with the length
+# of the encoded object as a big-endian unsigned 32-bit integer.
+FRAME_HEADER = struct.Struct(">I")
+
+
+# Forward slashes are left alone so that only ``</`` is escaped, as the json
+# module's output is.
+UJSON_OPTIONS = {"escape_forward_slashes": False}
+
+# Floats that are rounded by encoders that don't write enough digits.
+_FLOAT_PROBES = [0.1, 1 / 3.0, 1e-20, 2 ** 0.5 * 1e300, 5e-324]
+
+
+def ujson_is_lossless(module):
+    """
+    Return ``True`` if a ujson module encodes floats without losing
+    precision. ujson 1.x, the last release for Python 2, writes at most 15
+    decimal places whatever ``double_precision`` is, so it isn't used.
+    Encoded data is stored and hashed, so it must decode to what was
+    encoded.
+    """
+    try:
+        encoded = module.dumps(_FLOAT_PROBES, **UJSON_OPTIONS)
+    except (TypeError, ValueError, OverflowError):
+        return False
+    return json.loads(encoded) == _FLOAT_PROBES
+
+
+if ujson is not None and not ujson_is_lossless(ujson):
+    ujson = None
+
+
+def json_dumps(obj):
+    """
+    Encode an object as JSON, using the fastest available encoder.
+
+    Forward slashes in ``</`` are escaped so that the output is safe to embed
+    in HTML, as :func:`cyclone.escape.json_encode` does.
+
+    :param obj:
+        JSON serializable object to encode.
+    :returns:
+        The encoded JSON as a byte string.
+    """
+    if ujson is not None:
+        encoded = ujson.dumps(obj, **UJSON_OPTIONS)
+    else:
+        encoded = json.dumps(obj)
+    return encoded.replace("</", "<\\/")
+
+
+def msgpack_available():
+    """
+    Return ``True`` if MessagePack encoding is available.
+    """
+    return msgpack is not None
+
+
+def msgpack_dumps(obj):
+    """
+    Encode an object as MessagePack. Byte strings are encoded as raw
+    binary and unicode strings as MessagePack strings.
+    """
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def msgpack_loads(data):
+    """
+    Decode a MessagePack encoded object. Strings are decoded to unicode.
+
+    :raises ValueError:
+        If the data isn't a single valid MessagePack object.
+    """
+    return msgpack.unpackb(data, raw=False)
+
+
+def frame(encoded):
+    """
+    Prefix an encoded object with its length. See :func:`iter_frames`.
+    """
+    return FRAME_HEADER.pack(len(encoded)) + encoded
+
+
+def iter_frames(data):
+    """
+    Iterate over the encoded objects in a string of length-prefixed frames.
+
+    :raises ValueError:
+        If the data ends part way through a frame.
+    """
+    offset = 0
+    while offset < len(data):
+        start = offset + FRAME_HEADER.size
+        if start > len(data):
+            raise ValueError("Truncated frame header at offset %d." % (
+                offset,))
+        [length] = FRAME_HEADER.unpack_from(data, offset)
+        offset = start + length
+        if offset > len(data):
+            raise ValueError("Truncated frame at offset %d." % (start,))
+        yield data[start:offset]
+
+
+def data_version(data):
+    """
+    Return a version string for an object's data.
+
+    The version is a hash of the data's canonical JSON encoding, so it only
+    changes when the data does.
+    """
+    return sha1(json.dumps(
+        data, sort_keys=True, separators=(',', ':'))).hexdigest()
+
+
+def data_size(data):
+    """
+    Return the number of bytes in the JSON encoding of an object's data, as
+    encoded by :func:`json_dumps`. This is what store stats count.
+    """
+    return len(json_dumps(data))
+
+
+def object_version(obj):
+    """
+    Return the version of an object returned by a collection. See
+    :func:`data_version`.
+
+    :param obj:
+        A ``{"id": ..., "data": ...}`` dict or a :class:`RawJson` object.
+    """
+    if isinstance(obj, RawJson):
+        if obj.version is not None:
+            return obj.version
+        obj = obj.decode()
+    return data_version(obj['data'])
+
+
+class RawJson(object):
+    """
+    An object that has already been encoded as JSON.
+
+    Collections may return these instead of dicts so that stored JSON can be
+    written out without being decoded and re-encoded.
+
+    :param str encoded:
+        The encoded JSON.
+    :param str version:
+        The object's version, if it is known. See :func:`data_version`.
+    """
+
+    def __init__(self, encoded, version=None):
+        self.encoded = encoded
+        self.version = version
+
+    def __repr__(self):
+        return "<RawJson %r>" % (self.encoded,)
+
+    @classmethod
+    def for_object(cls, object_id, encoded_data, version=None):
+        """
+        Build the encoded form of ``{"id": object_id, "data": data}`` from
+        already-encoded data.
+        """
+        return cls('{"id": %s, "data": %s}' % (
+            json_dumps(object_id), encoded_data), version=version)
+
+    def decode(self):
+        """
+        Return the decoded object.
+        """
+        return json.loads(self.encoded)
@@ -1,4 +1,42 @@
-from zope.interface import Interface
+from zope.interface import Attribute, Interface
+
+
+class VersionConflict(Exception):
+    """
+    Raised when an object is written with an expected version that doesn't
+    match its current version.
+    """
+
+
+class ObjectNotFound(Exception):
+    """
+    Raised when an object that is being updated doesn't exist.
+    """
+
+
+class SchemaViolation(Exception):
+    """
+    Raised when a store's schema is invalid, or when a row doesn't match the
+    schema of the store it's written to.
+    """
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when admission control rejects a request.
+
+    :param str message:
+        Description of why the request was rejected.
+    :param str reason:
+        Short label for the kind of limit that was hit, for metrics.
+    :param float retry_after:
+        Number of seconds the client should wait before trying again.
+    """
+
+    def __init__(self, message, reason, retry_after):
+        super(AdmissionRejected, self).__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
 
 
 class ICollection(Interface):
@@ -6,23 +44,110 @@ class ICollection(Interface):
     An interface to a collection of objects.
     """
 
+    cheap_versions = Attribute(
+        """
+        ``True`` if :meth:`get_version` is cheaper than :meth:`get`, so that
+        callers that may not need the object should check its version
+        first. ``False`` if finding the version means loading the object,
+        so callers should load it and find its version themselves.
+        """)
+
     def all_keys():
         """
         Return an iterable over all keys in the collection. May return a
         deferred instead of the iterable.
         """
 
-    def all():
+    def all(fields=None):
         """
         Return an iterable over all objects in the collection. The iterable may
         contain deferreds instead of objects. May return a deferred instead of
         the iterable.
+
+        If ``fields`` is given, only those fields of each object's data are
+        returned. See :func:`go_store_service.projection.project`.
+        """
+
+    def page_keys(limit, cursor):
+        """
+        Return a page of at most ``limit`` keys from the collection as a
+        ``(keys, next_cursor)`` tuple. May return a deferred instead of the
+        tuple.
+
+        If ``cursor`` is ``None``, the first page is returned. Otherwise
+        ``cursor`` must be a ``next_cursor`` value returned from an earlier
+        call. ``next_cursor`` is an opaque string, or ``None`` if there are
+        no more pages.
+        """
+
+    def page(limit, cursor, fields=None):
+        """
+        Return a page of at most ``limit`` objects from the collection as an
+        ``(objects, next_cursor)`` tuple. ``objects`` is an iterable that may
+        contain deferreds instead of objects. May return a deferred instead
+        of the tuple.
+
+        ``cursor`` and ``next_cursor`` are the same as for :meth:`page_keys`
+        and ``fields`` is the same as for :meth:`all`.
+        """
+
+    def query(query, fields=None):
+        """
+        Return an iterable over the objects in the collection whose data
+        matches ``query``, a :class:`go_store_service.query.Query`. The
+        iterable may contain deferreds instead of objects and may contain
+        ``None`` in place of objects that turn out not to match. May return
+        a deferred instead of the iterable.
+
+        ``fields`` is the same as for :meth:`all`.
+        """
+
+    def count(query=None):
+        """
+        Return the number of objects in the collection, or the number whose
+        data matches ``query`` if it's given. May return a deferred instead
+        of the number.
+
+        Implementations should avoid loading objects if they can.
+        """
+
+    def aggregate(aggregation, query=None):
+        """
+        Count and sum the data of the objects in the collection, as described
+        by ``aggregation``, a
+        :class:`go_store_service.aggregation.Aggregation`. If ``query`` is
+        given, only objects whose data matches it are aggregated. May return
+        a deferred instead of the results.
+
+        Returns a list of results, see
+        :meth:`go_store_service.aggregation.Aggregator.results`.
         """
 
-    def get(object_id):
+    def get(object_id, fields=None):
         """
         Return a single object from the collection. May return a deferred
         instead of the object.
+
+        ``fields`` is the same as for :meth:`all`.
+        """
+
+    def get_version(object_id):
+        """
+        Return the current version of an object as an opaque string, or
+        ``None`` if the object doesn't exist. May return a deferred instead
+        of the version.
+
+        The version is the :func:`go_store_service.encoding.data_version` of
+        the object's data. Implementations should avoid loading the object
+        if they can.
+        """
+
+    def get_many(object_ids):
+        """
+        Return an iterable over the objects with the given ids, in the same
+        order as the ids. The iterable may contain deferreds instead of
+        objects and contains ``None`` for objects that don't exist. May return
+        a deferred instead of the iterable.
         """
 
     def create(object_id, data):
@@ -32,16 +157,44 @@ class ICollection(Interface):
         If ``object_id`` is ``None``, an identifier will be generated.
         """
 
-    def update(object_id, data):
+    def create_many(objects):
+        """
+        Create many objects within the collection. May return a deferred.
+
+        ``objects`` is an iterable of ``(object_id, data)`` tuples, which are
+        treated the same way as the parameters to :meth:`create`.
+
+        Returns a list of ``(success, result)`` tuples in the same order as
+        ``objects``. If ``success`` is ``True``, ``result`` is the created
+        object, otherwise it's a :class:`twisted.python.failure.Failure`.
+        """
+
+    def update(object_id, data, version=None, blind=None):
         """
         Update an object. May return a deferred.
 
-        ``object_id`` may not be ``None``.
+        ``object_id`` may not be ``None``. If the object doesn't exist,
+        :class:`ObjectNotFound` is raised.
+
+        If ``version`` is given and doesn't match the object's current
+        version (see :meth:`get_version`), :class:`VersionConflict` is raised
+        and the object isn't changed.
+
+        If ``blind`` is ``True`` and no ``version`` is given, backends where
+        reads are round trips may skip reading the object, but only if they
+        have a hint of its current version from recently reading or writing
+        it, such as a Riak vclock. Without a hint the object is read as
+        usual. Blind updates never create objects: an object that doesn't
+        exist still raises :class:`ObjectNotFound`, unless the backend's hint
+        is out of date because another process deleted the object. If
+        ``blind`` is ``None``, the collection's default is used.
         """
 
-    def delete(object_id):
+    def delete(object_id, version=None):
         """
         Delete an object. May return a deferred.
+
+        ``version`` is the same as for :meth:`update`.
         """
 
 
@@ -59,3 +212,43 @@ class IStoreBackend(Interface):
         """
         Returns an ICollection provider containing a collection of rows.
         """
+
+    def get_store_stats(owner_id, store_id):
+        """
+        Return the stats of a store's rows, kept up to date as rows are
+        written, so that they can be read without listing the rows. May
+        return a deferred instead of the stats.
+
+        The stats are a dict with these keys:
+
+        * ``rows`` - the number of rows.
+        * ``bytes`` - the total size of the rows' data, see
+          :func:`go_store_service.encoding.data_size`.
+        * ``last_modified`` - when a row was last written or deleted, in
+          seconds since the epoch, or ``None`` if none have been.
+        * ``approximate`` - ``True`` if the counts might be wrong because
+          the backend couldn't tell how a write changed them.
+
+        Stores without rows have zero counts, whether they exist or not.
+        """
+
+
+class IAdmissionControl(Interface):
+    """
+    An interface for deciding which requests to handle, so that one owner
+    can't use up the service for everyone else.
+    """
+
+    def admit(owner_id, listing=False):
+        """
+        Decide whether to handle a request for ``owner_id``. This is called
+        before any backend work is done for the request, so it must not
+        block.
+
+        ``listing`` is ``True`` for requests that read a whole collection,
+        such as listings, queries and aggregations.
+
+        Returns a callable that must be called once, with no arguments, when
+        the request has finished. Raises :class:`AdmissionRejected` if the
+        request shouldn't be handled.
+        """
@@ -0,0 +1,479 @@
+"""
+Multi-process launcher for the store service.
+
+The launcher opens a listening socket and starts a number of worker
+processes that all accept connections from it, so one machine can serve the
+API on all of its cores from a single port::
+
+    $ python -m go_store_service.launcher --port=8080 --workers=4 \\
+        --health-port=8081
+
+Workers are restarted if they exit, don't become ready in time or stop
+sending heartbeats. Sending the launcher ``SIGHUP`` replaces the workers one
+at a time, without closing the listening socket. Workers that are shut
+down stop accepting connections and are given ``--grace-period`` seconds to
+finish their in-flight requests.
+
+Each worker builds its own application, so the in-memory backend isn't
+shared between workers.
+"""
+
+import errno
+import fcntl
+import os
+import signal
+import socket
+import sys
+
+from twisted.internet.abstract import isIPv6Address
+from twisted.internet.defer import Deferred, gatherResults, inlineCallbacks
+from twisted.internet.protocol import ProcessProtocol
+from twisted.internet.task import LoopingCall, deferLater, react
+from twisted.python import log, usage
+from twisted.python.reflect import namedAny
+
+from cyclone.web import Application, RequestHandler, URLSpec
+
+
+WORKER_LISTEN_FD = 3
+WORKER_STATUS_FD = 4
+
+
+class WorkerStartupFailed(Exception):
+    """
+    Raised when a worker exits before it's ready.
+    """
+
+
+def make_listening_socket(interface, port, backlog=128):
+    """
+    Create a non-blocking listening TCP socket.
+
+    :param str interface:
+        Address to listen on.
+    :param int port:
+        Port to listen on. If ``0``, a free port is chosen.
+    :param int backlog:
+        Maximum number of pending connections.
+    """
+    family = socket.AF_INET6 if isIPv6Address(interface) else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((interface, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+class WorkerProtocol(ProcessProtocol):
+    """
+    Process protocol for tracking a single worker process.
+
+    :param Supervisor supervisor:
+        The supervisor to report to.
+    """
+
+    def __init__(self, supervisor):
+        self.supervisor = supervisor
+        self.pid = None
+        self.ready = False
+        self.stopping = False
+        self.started = supervisor.reactor.seconds()
+        self.last_heartbeat = None
+        self.started_serving = Deferred()
+        self.ended = Deferred()
+
+    def connectionMade(self):
+        # The transport forgets the pid once the process has exited, so we
+        # keep our own copy for logging.
+        self.pid = self.transport.pid
+
+    def childDataReceived(self, childFD, data):
+        if childFD != WORKER_STATUS_FD:
+            return
+        self.last_heartbeat = self.supervisor.reactor.seconds()
+        if not self.ready:
+            log.msg("Worker %s is ready." % (self.pid,))
+            self.ready = True
+            self.started_serving.callback(self)
+
+    def processEnded(self, reason):
+        self.ready = False
+        self.supervisor.worker_ended(self, reason)
+        if not self.started_serving.called:
+            self.started_serving.callback(self)
+        self.ended.callback(None)
+
+    def signal(self, name):
+        try:
+            self.transport.signalProcess(name)
+        except Exception:
+            # The process has already exited.
+            pass
+
+    def status(self):
+        """
+        Return a dict describing this worker.
+        """
+        return {
+            "pid": self.pid,
+            "ready": self.ready,
+            "started": self.started,
+            "last_heartbeat": self.last_heartbeat,
+        }
+
+
+class Supervisor(object):
+    """
+    Starts and monitors worker processes that share a listening socket.
+
+    :param reactor:
+        The reactor to spawn processes with.
+    :param listen_socket:
+        The listening socket to pass to workers.
+    :param int worker_count:
+        Number of workers to run.
+    :param list worker_args:
+        Command line for worker processes. The listening socket is passed
+        to them as file descriptor 3 and they're expected to write a line to
+        file descriptor 4 when they're ready and then periodically as a
+        heartbeat.
+    :param float restart_delay:
+        Number of seconds to wait before replacing a worker that exited.
+    :param float heartbeat_timeout:
+        Number of seconds without a heartbeat after which a worker is
+        killed.
+    :param float startup_timeout:
+        Number of seconds a worker has to become ready before it's killed.
+    :param float stop_timeout:
+        Number of seconds to wait for a worker to exit after asking it to
+        stop before killing it.
+    """
+
+    def __init__(self, reactor, listen_socket, worker_count, worker_args,
+                 restart_delay=1.0, heartbeat_timeout=10.0,
+                 startup_timeout=30.0, stop_timeout=30.0):
+        self.reactor = reactor
+        # We hold a reference to the socket so that it isn't closed while
+        # we still need to hand it to new workers.
+        self.listen_socket = listen_socket
+        self.worker_count = worker_count
+        self.worker_args = worker_args
+        self.restart_delay = restart_delay
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.stop_timeout = stop_timeout
+        self.workers = []
+        self.restarts = 0
+        self.running = False
+        self._health_check = LoopingCall(self.check_heartbeats)
+        self._health_check.clock = reactor
+
+    def spawn_worker(self):
+        """
+        Start a new worker process.
+        """
+        worker = WorkerProtocol(self)
+        self.reactor.spawnProcess(
+            worker, self.worker_args[0], self.worker_args, env=os.environ,
+            childFDs={
+                0: 0, 1: 1, 2: 2,
+                WORKER_LISTEN_FD: self.listen_socket.fileno(),
+                WORKER_STATUS_FD: "r",
+            })
+        self.workers.append(worker)
+        log.msg("Started worker %s." % (worker.pid,))
+        return worker
+
+    def start(self):
+        self.running = True
+        for _ in range(self.worker_count):
+            self.spawn_worker()
+        self._health_check.start(self.heartbeat_timeout / 2, now=False)
+
+    def worker_ended(self, worker, reason):
+        if worker in self.workers:
+            self.workers.remove(worker)
+        log.msg("Worker %s exited: %s" % (
+            worker.pid, reason.getErrorMessage()))
+        if self.running and not worker.stopping:
+            self.restarts += 1
+            self.reactor.callLater(self.restart_delay, self._replace_worker)
+
+    def _replace_worker(self):
+        if self.running and len(self.workers) < self.worker_count:
+            self.spawn_worker()
+
+    def check_heartbeats(self):
+        """
+        Kill any ready workers that have stopped sending heartbeats, and
+        any workers that haven't become ready within
+        :attr:`startup_timeout` seconds.
+        """
+        now = self.reactor.seconds()
+        for worker in list(self.workers):
+            if worker.ready:
+                if now - worker.last_heartbeat > self.heartbeat_timeout:
+                    log.msg("Worker %s missed its heartbeat, killing it." % (
+                        worker.pid,))
+                    worker.signal("KILL")
+            elif (not worker.stopping and
+                    now - worker.started > self.startup_timeout):
+                log.msg("Worker %s didn't become ready, killing it." % (
+                    worker.pid,))
+                worker.signal("KILL")
+
+    def stop_worker(self, worker):
+        """
+        Ask a worker to shut down, killing it if it doesn't exit within
+        :attr:`stop_timeout` seconds.
+        """
+        worker.stopping = True
+        worker.signal("TERM")
+        kill = self.reactor.callLater(
+            self.stop_timeout, worker.signal, "KILL")
+        worker.ended.addCallback(
+            lambda _: kill.active() and kill.cancel())
+        return worker.ended
+
+    @inlineCallbacks
+    def restart(self):
+        """
+        Replace the workers one at a time. Each replacement is started
+        before the worker it replaces is stopped, so there is always a full
+        set of workers accepting connections.
+
+        If a replacement exits before it's ready, the restart is abandoned
+        and the remaining workers are left running, so that a broken deploy
+        doesn't replace every working worker with one that can't start.
+        """
+        log.msg("Restarting workers.")
+        for worker in list(self.workers):
+            new_worker = yield self.spawn_worker().started_serving
+            if not new_worker.ready:
+                log.err(WorkerStartupFailed(
+                    "Worker %s exited before it was ready, abandoning"
+                    " restart." % (new_worker.pid,)))
+                return
+            yield self.stop_worker(worker)
+
+    def stop(self):
+        """
+        Stop all workers.
+        """
+        self.running = False
+        if self._health_check.running:
+            self._health_check.stop()
+        return gatherResults(
+            [self.stop_worker(worker) for worker in list(self.workers)])
+
+    def status(self):
+        """
+        Return a dict describing the state of the workers.
+        """
+        workers = [worker.status() for worker in self.workers]
+        ready = len([w for w in workers if w["ready"]])
+        return {
+            "healthy": ready >= self.worker_count,
+            "worker_count": self.worker_count,
+            "ready": ready,
+            "restarts": self.restarts,
+            "workers": workers,
+        }
+
+
+class HealthHandler(RequestHandler):
+    """
+    Handler for reporting the state of a supervisor's workers.
+
+    Methods supported:
+
+    * ``GET /health`` - return the state of the workers. The response
+      status is ``503`` if fewer than the configured number of workers are
+      ready.
+    """
+
+    @classmethod
+    def mk_urlspec(cls, supervisor):
+        return URLSpec('/health', cls, kwargs={"supervisor": supervisor})
+
+    def initialize(self, supervisor):
+        self.supervisor = supervisor
+
+    def get(self):
+        status = self.supervisor.status()
+        if not status["healthy"]:
+            self.set_status(503)
+        self.write(status)
+
+
+class Worker(object):
+    """
+    Serves an application from an inherited listening socket.
+
+    :param reactor:
+        The reactor to serve the application with.
+    :param app:
+        The application factory to serve. If it has a ``stop()`` method,
+        that's called once in-flight requests have had their grace period,
+        and may return a deferred.
+    :param int listen_fd:
+        File descriptor of the listening socket.
+    :param int status_fd:
+        File descriptor to write heartbeats to, or ``None``.
+    :param int family:
+        Address family of the listening socket.
+    :param float heartbeat_interval:
+        Number of seconds between heartbeats.
+    :param float grace_period:
+        Number of seconds to keep serving in-flight requests after being
+        asked to shut down.
+    """
+
+    def __init__(self, reactor, app, listen_fd, status_fd=None,
+                 family=socket.AF_INET, heartbeat_interval=1.0,
+                 grace_period=5.0):
+        self.reactor = reactor
+        self.app = app
+        self.listen_fd = listen_fd
+        self.status_fd = status_fd
+        self.family = family
+        self.grace_period = grace_period
+        self.port = None
+        self._heartbeat = LoopingCall(self.heartbeat)
+        self._heartbeat.clock = reactor
+        self.heartbeat_interval = heartbeat_interval
+
+    def start(self):
+        self.port = self.reactor.adoptStreamPort(
+            self.listen_fd, self.family, self.app)
+        os.close(self.listen_fd)
+        if self.status_fd is not None:
+            flags = fcntl.fcntl(self.status_fd, fcntl.F_GETFL)
+            fcntl.fcntl(self.status_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            self._heartbeat.start(self.heartbeat_interval)
+
+    def heartbeat(self):
+        try:
+            os.write(self.status_fd, "ok\n")
+        except OSError, err:
+            if err.errno == errno.EAGAIN:
+                # If the supervisor isn't reading heartbeats, it will notice
+                # soon enough without us blocking.
+                return
+            if err.errno != errno.EPIPE:
+                raise
+            log.msg("Supervisor has gone away, shutting down.")
+            self._heartbeat.stop()
+            if self.reactor.running:
+                self.reactor.stop()
+
+    def _stop_app(self, _):
+        stop = getattr(self.app, "stop", None)
+        if stop is not None:
+            return stop()
+
+    def stop(self):
+        """
+        Stop accepting connections, wait for in-flight requests and then
+        stop the application.
+        """
+        if self._heartbeat.running:
+            self._heartbeat.stop()
+        d = self.port.stopListening()
+        d.addCallback(lambda _: deferLater(
+            self.reactor, self.grace_period, lambda: None))
+        d.addCallback(self._stop_app)
+        return d
+
+
+class Options(usage.Options):
+    optParameters = [
+        ["app", "a", "go_store_service.server.StoreServer",
+         "Application class to serve."],
+        ["interface", "i", "127.0.0.1", "Address to listen on."],
+        ["port", "p", 8888, "Port to listen on.", int],
+        ["workers", "w", None,
+         "Number of worker processes. Defaults to the number of CPUs.", int],
+        ["health-port", None, None,
+         "Port to serve worker health on, if any.", int],
+        ["grace-period", None, 5.0,
+         "Seconds workers are given to finish in-flight requests when they"
+         " are shut down.", float],
+        ["heartbeat-timeout", None, 10.0,
+         "Seconds without a heartbeat after which a worker is killed.",
+         float],
+        ["startup-timeout", None, 30.0,
+         "Seconds a worker has to become ready before it is killed.",
+         float],
+        # Used internally to start workers.
+        ["worker-family", None, None, None, int],
+    ]
+
+    def postOptions(self):
+        if self["workers"] is None:
+            from multiprocessing import cpu_count
+            self["workers"] = cpu_count()
+        if self["workers"] < 1:
+            raise usage.UsageError("At least one worker is required.")
+
+    def worker_args(self, family):
+        return [
+            sys.executable, "-m", "go_store_service.launcher",
+            "--app", self["app"],
+            "--grace-period", str(self["grace-period"]),
+            "--heartbeat-timeout", str(self["heartbeat-timeout"]),
+            "--worker-family", str(family),
+        ]
+
+
+def run_worker(reactor, options):
+    app = namedAny(options["app"])()
+    worker = Worker(
+        reactor, app, WORKER_LISTEN_FD, WORKER_STATUS_FD,
+        family=options["worker-family"],
+        heartbeat_interval=options["heartbeat-timeout"] / 10,
+        grace_period=options["grace-period"])
+    worker.start()
+    reactor.addSystemEventTrigger("before", "shutdown", worker.stop)
+    return Deferred()
+
+
+def run_supervisor(reactor, options):
+    sock = make_listening_socket(options["interface"], options["port"])
+    supervisor = Supervisor(
+        reactor, sock, options["workers"],
+        options.worker_args(sock.family),
+        heartbeat_timeout=options["heartbeat-timeout"],
+        startup_timeout=options["startup-timeout"],
+        stop_timeout=options["grace-period"] * 2)
+    supervisor.start()
+    if options["health-port"] is not None:
+        reactor.listenTCP(
+            options["health-port"],
+            Application([HealthHandler.mk_urlspec(supervisor)]),
+            interface=options["interface"])
+    signal.signal(
+        signal.SIGHUP,
+        lambda *a: reactor.callFromThread(supervisor.restart))
+    reactor.addSystemEventTrigger("before", "shutdown", supervisor.stop)
+    log.msg("Serving on %s:%s with %s workers." % (
+        sock.getsockname()[0], sock.getsockname()[1], options["workers"]))
+    return Deferred()
+
+
+def main(reactor, *argv):
+    options = Options()
+    try:
+        options.parseOptions(argv)
+    except usage.UsageError, err:
+        print >> sys.stderr, "%s\n%s" % (options, err)
+        raise SystemExit(1)
+    log.startLogging(sys.stdout)
+    if options["worker-family"] is not None:
+        return run_worker(reactor, options)
+    return run_supervisor(reactor, options)
+
+
+if __name__ == "__main__":
+    react(main, sys.argv[1:])
@@ -0,0 +1,171 @@
+""" Lightweight metrics that can be exported in the Prometheus text format.
+"""
+
+from bisect import bisect_left
+
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0)
+
+
+def _escape_label_value(value):
+    return unicode(value).replace(
+        u'\\', u'\\\\').replace(u'"', u'\\"').replace(u'\n', u'\\n')
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = zip(label_names, label_values) + list(extra)
+    if not pairs:
+        return u''
+    return u'{%s}' % u','.join(
+        u'%s="%s"' % (name, _escape_label_value(value))
+        for name, value in pairs)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return u'+Inf'
+    return repr(float(value))
+
+
+class Counter(object):
+    """
+    A value that only goes up, optionally split by a set of labels.
+
+    :param str name:
+        Name of the metric.
+    :param str help:
+        Description of the metric.
+    :param tuple label_names:
+        Names of the labels values are split by.
+    """
+
+    metric_type = 'counter'
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values = {}
+
+    def inc(self, amount=1, labels=()):
+        """
+        Increment the counter for the given label values.
+        """
+        labels = tuple(labels)
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(tuple(labels), 0)
+
+    def render_samples(self):
+        for labels, value in sorted(self._values.items()):
+            yield u'%s%s %s' % (
+                self.name, _format_labels(self.label_names, labels),
+                _format_value(value))
+
+
+class Histogram(object):
+    """
+    A distribution of observed values, optionally split by a set of labels.
+
+    :param str name:
+        Name of the metric.
+    :param str help:
+        Description of the metric.
+    :param tuple label_names:
+        Names of the labels values are split by.
+    :param tuple buckets:
+        Sorted upper bounds of the histogram buckets.
+    """
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value, labels=()):
+        """
+        Record an observed value for the given label values.
+        """
+        labels = tuple(labels)
+        entry = self._values.get(labels)
+        if entry is None:
+            # The last bucket count is for values above the largest bound.
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def count(self, labels=()):
+        entry = self._values.get(tuple(labels))
+        if entry is None:
+            return 0
+        return sum(entry[0])
+
+    def render_samples(self):
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            bounds = self.buckets + (float('inf'),)
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield u'%s_bucket%s %s' % (
+                    self.name,
+                    _format_labels(
+                        self.label_names, labels,
+                        [('le', _format_value(bound))]),
+                    _format_value(cumulative))
+            formatted_labels = _format_labels(self.label_names, labels)
+            yield u'%s_sum%s %s' % (
+                self.name, formatted_labels, _format_value(total))
+            yield u'%s_count%s %s' % (
+                self.name, formatted_labels, _format_value(cumulative))
+
+
+class MetricsRegistry(object):
+    """
+    A collection of metrics.
+
+    Metrics are created the first time they're asked for and shared after
+    that, so components can look up the metrics they need by name.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _get_or_create(self, metric_class, name, *args, **kw):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = metric_class(name, *args, **kw)
+        if not isinstance(metric, metric_class):
+            raise ValueError("Metric %r is not a %s." % (
+                name, metric_class.__name__))
+        return metric
+
+    def counter(self, name, help, label_names=()):
+        """
+        Return the :class:`Counter` with the given name.
+        """
+        return self._get_or_create(Counter, name, help, label_names)
+
+    def histogram(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        """
+        Return the :class:`Histogram` with the given name.
+        """
+        return self._get_or_create(
+            Histogram, name, help, label_names, buckets=buckets)
+
+    def render(self):
+        """
+        Return all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(u'# HELP %s %s' % (name, metric.help))
+            lines.append(u'# TYPE %s %s' % (name, metric.metric_type))
+            lines.extend(metric.render_samples())
+        return u''.join(line + u'\n' for line in lines).encode('utf-8')
@@ -0,0 +1,97 @@
+""" Helpers for projecting objects down to a subset of their fields.
+
+Fields are given as dotted paths into an object's data, e.g. ``name`` or
+``address.city``.
+"""
+
+from go_store_service.encoding import RawJson
+
+
+def parse_fields(value):
+    """
+    Parse a comma separated list of field paths, e.g.
+    ``"name,address.city"``.
+
+    :returns:
+        A list of field paths.
+    :raises ValueError:
+        If no fields are given or a field path is invalid.
+    """
+    fields = [field.strip() for field in value.split(",")]
+    if not fields or not all(fields):
+        raise ValueError("Invalid fields: %r" % (value,))
+    for field in fields:
+        if not all(field.split(".")):
+            raise ValueError("Invalid field path: %r" % (field,))
+    return fields
+
+
+def _field_tree(fields):
+    """
+    Build a nested dict of field names from a list of field paths. Fields
+    that are selected in full have ``None`` as their value.
+    """
+    tree = {}
+    for field in fields:
+        node = tree
+        names = field.split(".")
+        for name in names[:-1]:
+            child = node.get(name, {})
+            if child is None:
+                # The parent field has been selected in full.
+                break
+            node = node.setdefault(name, child)
+        else:
+            node[names[-1]] = None
+    return tree
+
+
+def _project(data, tree):
+    if not isinstance(data, dict):
+        return {}
+    result = {}
+    for name, subtree in tree.iteritems():
+        if name not in data:
+            continue
+        value = data[name]
+        if subtree is None:
+            result[name] = value
+        elif isinstance(value, dict):
+            result[name] = _project(value, subtree)
+    return result
+
+
+def project(data, fields):
+    """
+    Return a dict containing only the given fields from an object's data.
+
+    Fields that don't exist are left out, as are paths that pass through
+    values that aren't dicts. Selected values are shared with ``data``
+    rather than copied.
+
+    :param data:
+        The object's data.
+    :param list fields:
+        Field paths to select, or ``None`` to select the whole object.
+    """
+    if fields is None:
+        return data
+    return _project(data, _field_tree(fields))
+
+
+def project_object(obj, fields):
+    """
+    Project a ``{"id": ..., "data": ...}`` object returned by a collection.
+    See :func:`project`.
+
+    :param obj:
+        A dict, :class:`go_store_service.encoding.RawJson` object or
+        ``None``.
+    :param list fields:
+        Field paths to select, or ``None`` to return the object unchanged.
+    """
+    if fields is None or obj is None:
+        return obj
+    if isinstance(obj, RawJson):
+        obj = obj.decode()
+    return {'id': obj['id'], 'data': project(obj['data'], fields)}
@@ -0,0 +1,189 @@
+""" A simple query language for filtering objects by their data.
+
+A query is a list of conditions, all of which must match. Each condition
+compares the value at a dotted path into an object's data with a value::
+
+    status == "active"
+    age >= 18
+    address.city ^= "Cape"
+
+Supported operators are ``==`` (equality), ``<``, ``<=``, ``>`` and ``>=``
+(ranges) and ``^=`` (string prefix). Values are JSON literals. Values that
+aren't valid JSON are treated as strings, so ``status == active`` works too.
+
+Conditions only match values of the same kind, so ``1`` doesn't equal
+``true`` and numbers and strings can't be compared with each other.
+"""
+
+import json
+import operator
+import re
+
+
+# Returned by :func:`lookup` for paths that don't exist.
+MISSING = object()
+
+_CONDITION_RE = re.compile(
+    r'^\s*(?P<path>[^\s=<>^]+)\s*(?P<op>==|<=|>=|<|>|\^=)'
+    r'\s*(?P<value>.*?)\s*$', re.DOTALL)
+
+
+def _kind(value):
+    """
+    Return the kind of a value, for deciding which values can be compared.
+    """
+    if isinstance(value, bool):
+        return bool
+    if isinstance(value, (int, long, float)):
+        return float
+    if isinstance(value, basestring):
+        return basestring
+    return type(value)
+
+
+def _equal(a, b):
+    return _kind(a) is _kind(b) and a == b
+
+
+def _ordered(compare):
+    def check(a, b):
+        kind = _kind(a)
+        return (kind in (float, basestring) and kind is _kind(b) and
+                compare(a, b))
+    return check
+
+
+def _prefix(a, b):
+    return (isinstance(a, basestring) and isinstance(b, basestring) and
+            a.startswith(b))
+
+
+OPERATORS = {
+    "==": _equal,
+    "<": _ordered(operator.lt),
+    "<=": _ordered(operator.le),
+    ">": _ordered(operator.gt),
+    ">=": _ordered(operator.ge),
+    "^=": _prefix,
+}
+
+
+def lookup(data, names):
+    """
+    Return the value at a path in ``data``, or :data:`MISSING` if there
+    isn't one.
+
+    :param list names:
+        The path to look up, split into field names.
+    """
+    for name in names:
+        if not isinstance(data, dict) or name not in data:
+            return MISSING
+        data = data[name]
+    return data
+
+
+def _parse_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class Condition(object):
+    """
+    A comparison between the value at a path in an object's data and a
+    given value.
+
+    :param str path:
+        Dotted path to the value to compare, e.g. ``address.city``.
+    :param str op:
+        The comparison operator. One of the keys of :data:`OPERATORS`.
+    :param value:
+        The value to compare with.
+    """
+
+    def __init__(self, path, op, value):
+        if op not in OPERATORS:
+            raise ValueError("Invalid operator: %r" % (op,))
+        names = path.split(".")
+        if not all(names):
+            raise ValueError("Invalid path: %r" % (path,))
+        self.path = path
+        self.op = op
+        self.value = value
+        self._names = names
+        self._compare = OPERATORS[op]
+
+    def __repr__(self):
+        return "<Condition %s %s %r>" % (self.path, self.op, self.value)
+
+    def __eq__(self, other):
+        if not isinstance(other, Condition):
+            return NotImplemented
+        return (self.path, self.op, self.value) == (
+            other.path, other.op, other.value)
+
+    def __ne__(self, other):
+        return not self == other
+
+    @classmethod
+    def parse(cls, condition):
+        """
+        Parse a condition such as ``age >= 18``.
+
+        :raises ValueError:
+            If the condition is invalid.
+        """
+        match = _CONDITION_RE.match(condition)
+        if match is None:
+            raise ValueError("Invalid condition: %r" % (condition,))
+        return cls(
+            match.group("path"), match.group("op"),
+            _parse_value(match.group("value")))
+
+    def lookup(self, data):
+        """
+        Return the value at this condition's path in ``data``, or
+        :data:`MISSING` if there isn't one.
+        """
+        return lookup(data, self._names)
+
+    def matches(self, data):
+        value = self.lookup(data)
+        if value is MISSING:
+            return False
+        return self._compare(value, self.value)
+
+
+class Query(object):
+    """
+    A set of conditions that an object's data must all match.
+
+    :param list conditions:
+        The :class:`Condition` objects to match.
+    """
+
+    def __init__(self, conditions):
+        self.conditions = list(conditions)
+
+    def __repr__(self):
+        return "<Query %r>" % (self.conditions,)
+
+    @classmethod
+    def parse(cls, conditions):
+        """
+        Parse a list of conditions. See :meth:`Condition.parse`.
+
+        :raises ValueError:
+            If there are no conditions or a condition is invalid.
+        """
+        if not conditions:
+            raise ValueError("A query needs at least one condition.")
+        return cls([Condition.parse(condition) for condition in conditions])
+
+    def matches(self, data):
+        """
+        Return ``True`` if ``data`` matches all the conditions.
+        """
+        return all(condition.matches(data) for condition in self.conditions)
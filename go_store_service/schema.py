@@ -0,0 +1,187 @@
+""" Store schemas and the secondary indexes they declare.
+
+A store may declare a schema in its data::
+
+    {
+        "schema": {
+            "status": {"type": "string", "index": true},
+            "address.city": {"type": "string", "index": true},
+            "age": {"type": "integer", "index": true},
+            "notes": {"type": "text"}
+        }
+    }
+
+Fields are dotted paths into the data of the store's rows. Fields with
+``"index": true`` are indexed, and must have a type of ``string`` or
+``integer``. Rows whose indexed fields have the wrong type are rejected
+with :class:`go_store_service.interfaces.SchemaViolation`. Other field
+definitions are descriptive only.
+
+Each indexed value is turned into an index entry, a string that sorts the
+same way as the values do, so that equality, range and prefix conditions on
+indexed fields can be answered with a range of index entries. See
+:meth:`Schema.index_range`.
+"""
+
+from go_store_service.interfaces import SchemaViolation
+from go_store_service.query import MISSING, lookup
+
+# Integers are offset so that they're non-negative and zero-padded, so that
+# they sort correctly as strings.
+_INTEGER_OFFSET = 2 ** 63
+_INTEGER_WIDTH = 20
+
+# Sorts after any byte in a UTF-8 encoded string or an encoded integer.
+_MAX_SUFFIX = "\xff"
+
+
+def _encode_string(value):
+    if not isinstance(value, basestring):
+        return None
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return value
+
+
+def _encode_integer(value):
+    if isinstance(value, bool) or not isinstance(value, (int, long)):
+        return None
+    value += _INTEGER_OFFSET
+    if not 0 <= value < 2 * _INTEGER_OFFSET:
+        return None
+    return "%0*d" % (_INTEGER_WIDTH, value)
+
+
+INDEX_TYPES = {
+    "string": _encode_string,
+    "integer": _encode_integer,
+}
+
+
+class Schema(object):
+    """
+    The indexed fields of a store.
+
+    :param dict indexes:
+        Mapping of field paths to index types (``"string"`` or
+        ``"integer"``).
+    """
+
+    def __init__(self, indexes=None):
+        self.indexes = dict(indexes or {})
+        for path, index_type in self.indexes.iteritems():
+            names = path.split(".")
+            if not all(names) or "/" in path:
+                raise SchemaViolation("Invalid field path: %r" % (path,))
+            if index_type not in INDEX_TYPES:
+                raise SchemaViolation(
+                    "Invalid index type for %r: %r" % (path, index_type))
+        self._fields = sorted(
+            (path, path.encode('utf-8'), path.split("."),
+             INDEX_TYPES[index_type])
+            for path, index_type in self.indexes.iteritems())
+
+    def __repr__(self):
+        return "<Schema %r>" % (self.indexes,)
+
+    def __eq__(self, other):
+        if not isinstance(other, Schema):
+            return NotImplemented
+        return self.indexes == other.indexes
+
+    def __ne__(self, other):
+        return not self == other
+
+    def without(self, paths):
+        """
+        Return a copy of this schema that doesn't index the given fields.
+        """
+        return Schema(dict(
+            (path, index_type) for path, index_type in self.indexes.iteritems()
+            if path not in paths))
+
+    @classmethod
+    def from_store_data(cls, data):
+        """
+        Return the schema declared in a store's data. Stores that don't
+        declare a schema have an empty one.
+
+        :raises SchemaViolation:
+            If the declared schema is invalid.
+        """
+        if not isinstance(data, dict) or data.get("schema") is None:
+            return cls()
+        fields = data["schema"]
+        if not isinstance(fields, dict):
+            raise SchemaViolation("A schema must be an object.")
+        indexes = {}
+        for path, definition in fields.iteritems():
+            if not isinstance(definition, dict):
+                raise SchemaViolation(
+                    "Invalid field definition for %r." % (path,))
+            if definition.get("index"):
+                indexes[path] = definition.get("type")
+        return cls(indexes)
+
+    def index_entries(self, data, strict=True):
+        """
+        Return the index entries for a row's data.
+
+        Indexed fields that are missing or ``null`` aren't indexed.
+
+        :param bool strict:
+            If ``True``, :class:`SchemaViolation` is raised if an indexed
+            field has the wrong type. Otherwise the field isn't indexed.
+        """
+        entries = []
+        for path, encoded_path, names, encode in self._fields:
+            value = lookup(data, names)
+            if value is MISSING or value is None:
+                continue
+            encoded = encode(value)
+            if encoded is None:
+                if strict:
+                    raise SchemaViolation(
+                        "Field %r can't be indexed: %r" % (path, value))
+                continue
+            entries.append("%s/%s" % (encoded_path, encoded))
+        return entries
+
+    def _condition_range(self, condition):
+        if condition.path not in self.indexes:
+            return None
+        encoded = INDEX_TYPES[self.indexes[condition.path]](condition.value)
+        if encoded is None:
+            # Values of other types can't match indexed values.
+            return None
+        prefix = "%s/" % (condition.path.encode('utf-8'),)
+        if condition.op == "==":
+            return (prefix + encoded, prefix + encoded)
+        if condition.op in (">", ">="):
+            return (prefix + encoded, prefix + _MAX_SUFFIX)
+        if condition.op in ("<", "<="):
+            return (prefix, prefix + encoded)
+        if condition.op == "^=" and self.indexes[condition.path] == "string":
+            return (prefix + encoded, prefix + encoded + _MAX_SUFFIX)
+        return None
+
+    def index_range(self, query):
+        """
+        Return an inclusive ``(start, end)`` range of index entries that
+        contains the entries of all rows that match a query, or ``None`` if
+        the query can't be answered with an index.
+
+        Rows in the range may still not match the query, so they must be
+        checked after they're loaded. Equality conditions are preferred
+        because they usually select the fewest rows.
+
+        :type query: go_store_service.query.Query
+        """
+        ranges = []
+        for condition in query.conditions:
+            entry_range = self._condition_range(condition)
+            if entry_range is not None:
+                ranges.append((condition.op != "==", entry_range))
+        if not ranges:
+            return None
+        return min(ranges)[1]
@@ -1,8 +1,15 @@
 """ Go Store Service HTTP server.
 """
 
-from go_store_service.api_handler import ApiApplication
-from go_store_service.collections import InMemoryCollectionBackend
+from twisted.internet.defer import succeed
+
+from go_store_service.api_handler import (
+    ApiApplication, DeletionStatusHandler)
+from go_store_service.collections import (
+    InMemoryCollectionBackend, CachedCollectionBackend,
+    CascadingCollectionBackend, CoalescingCollectionBackend,
+    InstrumentedCollectionBackend, StatsCollectionBackend)
+from go_store_service.collections.coalescing import DURABILITY_WRITTEN
 from go_store_service.interfaces import IStoreBackend
 
 
@@ -11,14 +18,82 @@ class StoreServer(ApiApplication):
     :param IBackend backend:
         A backend that provides a store collection factory and a row
         collection factory.
+    :param int cache_size:
+        If given, objects read from the backend are cached in an LRU cache
+        holding up to this many objects.
+    :param float cache_ttl:
+        Number of seconds to cache objects for. Only used if ``cache_size``
+        is given. If ``None``, objects are cached until they're evicted or
+        invalidated.
+    :param metrics:
+        If given, a :class:`go_store_service.metrics.MetricsRegistry` to
+        record request, backend and cache metrics in. The metrics are served
+        from ``/metrics``.
+    :param float write_delay:
+        If given, writes are queued for this many seconds and repeated
+        writes to the same object are merged before they're written to the
+        backend. See
+        :class:`go_store_service.collections.CoalescingCollectionBackend`.
+    :param str write_durability:
+        When queued writes are acknowledged. Only used if ``write_delay`` is
+        given.
+
+        Whoever runs the server should call :meth:`stop` when it shuts
+        down, so that queued writes aren't lost.
+    :param deletion_jobs:
+        The :class:`go_store_service.collections.cascading.DeletionJobs` to
+        delete the rows of deleted stores with. Their progress is served
+        from ``/:owner_id/stores/:store_id/_deletion``. If ``None``, jobs
+        with the default settings are used.
+    :param reactor:
+        Used to schedule queued writes. Defaults to the global reactor.
     """
 
-    def __init__(self, backend=None, **settings):
+    def __init__(self, backend=None, cache_size=None, cache_ttl=None,
+                 metrics=None, write_delay=None,
+                 write_durability=DURABILITY_WRITTEN, deletion_jobs=None,
+                 reactor=None, **settings):
         # TODO: better backend construction
         if backend is None:
             backend = InMemoryCollectionBackend({})
+        if metrics is not None:
+            # This wraps the backend before the cache so that cache hits
+            # aren't recorded as backend calls.
+            backend = InstrumentedCollectionBackend(backend, metrics)
+        self._write_queue = None
+        if write_delay is not None:
+            # This wraps the backend before the cache so that the cache is
+            # invalidated when writes are acknowledged.
+            backend = self._write_queue = CoalescingCollectionBackend(
+                backend, delay=write_delay, durability=write_durability,
+                reactor=reactor)
+        if cache_size is not None:
+            backend = CachedCollectionBackend(
+                backend, cache_size, ttl=cache_ttl, metrics=metrics)
+        # This wraps the cache so that cached stores don't have stale stats.
+        backend = StatsCollectionBackend(backend)
+        # This wraps everything else so that rows are deleted through the
+        # cache.
+        backend = CascadingCollectionBackend(backend, deletion_jobs)
         self.backend = IStoreBackend(backend)
-        ApiApplication.__init__(self, **settings)
+        ApiApplication.__init__(self, metrics=metrics, **settings)
+
+    def stop(self):
+        """
+        Write any queued writes to the backend.
+
+        :returns:
+            A deferred that fires once they've been written.
+        """
+        if self._write_queue is None:
+            return succeed(None)
+        return self._write_queue.flush()
+
+    def _build_routes(self):
+        routes = ApiApplication._build_routes(self)
+        routes.append(DeletionStatusHandler.mk_urlspec(
+            '/:owner_id/stores/:store_id/_deletion', self.backend.jobs))
+        return routes
 
     @property
     def collections(self):
@@ -11,11 +11,29 @@ import treq
 
 from cyclone.web import Application
 
+from go_store_service.encoding import iter_frames, msgpack_loads
+
+
+class _DummyTransport(object):
+    """
+    Extremely dummy transport for use with :class:`_DummyConnection`.
+    """
+    def __init__(self):
+        self.producer = None
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
 
 class _DummyConnection(object):
     """
     Extremely dummy connection for use with :class:`_DummyRequest`.
     """
+    def __init__(self):
+        self.transport = _DummyTransport()
 
 
 class _DummyRequest(object):
@@ -24,6 +42,7 @@ class _DummyRequest(object):
     """
     def __init__(self):
         self.supports_http_1_1 = lambda: True
+        self.headers = {}
         self.connection = _DummyConnection()
 
 
@@ -87,6 +106,16 @@ class AppHelper(object):
         d.addCallback(lambda s: [json.loads(l) for l in s.splitlines()])
         return d
 
+    def _parse_msgpack(self, response):
+        d = treq.content(response)
+        d.addCallback(msgpack_loads)
+        return d
+
+    def _parse_msgpack_frames(self, response):
+        d = treq.content(response)
+        d.addCallback(lambda s: [msgpack_loads(f) for f in iter_frames(s)])
+        return d
+
     @inlineCallbacks
     def request(self, method, url_suffix, parser=None, **kw):
         """
@@ -97,7 +126,8 @@ class AppHelper(object):
             A path to make the request to.
         :param str parser:
             Response parser to use. Valid values are ``'bytes'``, ``'json'``,
-            ``'json_lines'`` or ``None``. ``None`` indicates that the raw
+            ``'json_lines'``, ``'msgpack'``, ``'msgpack_frames'`` or
+            ``None``. ``None`` indicates that the raw
             response object should be returned. Otherwise the parsed data is
             returned.
 
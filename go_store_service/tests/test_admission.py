@@ -0,0 +1,83 @@
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+from zope.interface.verify import verifyObject
+
+from go_store_service.admission import OwnerAdmissionControl, TokenBucket
+from go_store_service.interfaces import AdmissionRejected, IAdmissionControl
+
+
+class TestTokenBucket(TestCase):
+    def test_take(self):
+        bucket = TokenBucket(2, 2, 0)
+        self.assertEqual(bucket.take(0), 0)
+        self.assertEqual(bucket.take(0), 0)
+        self.assertEqual(bucket.take(0), 0.5)
+        self.assertEqual(bucket.take(0.25), 0.25)
+        self.assertEqual(bucket.take(0.5), 0)
+
+    def test_refill_up_to_burst(self):
+        bucket = TokenBucket(1, 2, 0)
+        bucket.take(0)
+        self.assertEqual(bucket.is_full(0), False)
+        self.assertEqual(bucket.is_full(10), True)
+        self.assertEqual(bucket.tokens, 2)
+
+
+class TestOwnerAdmissionControl(TestCase):
+    def test_provides_IAdmissionControl(self):
+        verifyObject(IAdmissionControl, OwnerAdmissionControl())
+
+    def test_no_limits(self):
+        admission = OwnerAdmissionControl()
+        for _ in range(10):
+            admission.admit("me", listing=True)
+        self.assertEqual(admission.listings("me"), 0)
+
+    def test_rate(self):
+        clock = Clock()
+        admission = OwnerAdmissionControl(rate=1, burst=2, reactor=clock)
+        admission.admit("me")
+        admission.admit("me")
+        err = self.assertRaises(AdmissionRejected, admission.admit, "me")
+        self.assertEqual((err.reason, err.retry_after), ("rate", 1))
+        # Other owners have their own buckets.
+        admission.admit("you")
+        clock.advance(1)
+        admission.admit("me")
+
+    def test_burst_defaults_to_rate(self):
+        self.assertEqual(OwnerAdmissionControl(rate=5).burst, 5)
+        self.assertEqual(OwnerAdmissionControl(rate=0.1).burst, 1)
+
+    def test_full_buckets_forgotten(self):
+        clock = Clock()
+        admission = OwnerAdmissionControl(rate=1, burst=2, reactor=clock)
+        admission.admit("me")
+        admission.admit("you")
+        clock.advance(2)
+        admission.admit("me")
+        self.assertEqual(sorted(admission._buckets), ["me"])
+
+    def test_max_listings(self):
+        admission = OwnerAdmissionControl(
+            max_listings=2, listing_retry_after=3)
+        release = admission.admit("me", listing=True)
+        admission.admit("me", listing=True)
+        err = self.assertRaises(
+            AdmissionRejected, admission.admit, "me", listing=True)
+        self.assertEqual((err.reason, err.retry_after), ("listings", 3))
+        # Requests that aren't listings aren't limited.
+        admission.admit("me")
+        admission.admit("you", listing=True)
+        release()
+        self.assertEqual(admission.listings("me"), 1)
+        admission.admit("me", listing=True)
+
+    def test_rejected_listings_dont_use_tokens(self):
+        clock = Clock()
+        admission = OwnerAdmissionControl(
+            rate=1, burst=2, max_listings=1, reactor=clock)
+        admission.admit("me", listing=True)
+        self.assertRaises(
+            AdmissionRejected, admission.admit, "me", listing=True)
+        admission.admit("me")
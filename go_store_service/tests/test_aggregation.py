@@ -0,0 +1,64 @@
+from twisted.trial.unittest import TestCase
+
+from go_store_service.aggregation import Aggregation
+
+
+class TestAggregation(TestCase):
+    def test_invalid_paths(self):
+        self.assertRaises(ValueError, Aggregation, group_by="")
+        self.assertRaises(ValueError, Aggregation, group_by="a..b")
+        self.assertRaises(ValueError, Aggregation, sums=["a", "b."])
+
+    def test_count(self):
+        self.assertEqual(Aggregation().aggregate([]), [
+            {"group": None, "count": 0, "sum": {}}])
+        self.assertEqual(Aggregation().aggregate([{}, "foo", None]), [
+            {"group": None, "count": 3, "sum": {}}])
+
+    def test_sum(self):
+        aggregation = Aggregation(sums=["a", "b.c"])
+        self.assertEqual(aggregation.aggregate([
+            {"a": 1, "b": {"c": 0.5}},
+            {"a": True, "b": {"c": 2}},
+            {"a": "1", "b": 3},
+        ]), [{"group": None, "count": 3, "sum": {"a": 1, "b.c": 2.5}}])
+
+    def test_group_by(self):
+        aggregation = Aggregation(group_by="g", sums=["n"])
+        self.assertEqual(aggregation.aggregate([
+            {"g": "x", "n": 1},
+            {"g": "y", "n": 2},
+            {"g": "x", "n": 3},
+            {"g": None, "n": 4},
+            {"n": 5},
+        ]), [
+            {"group": None, "count": 2, "sum": {"n": 9}},
+            {"group": "x", "count": 2, "sum": {"n": 4}},
+            {"group": "y", "count": 1, "sum": {"n": 2}},
+        ])
+
+    def test_group_by_empty(self):
+        self.assertEqual(Aggregation(group_by="g").aggregate([]), [])
+
+    def test_group_by_unhashable(self):
+        aggregation = Aggregation(group_by="g")
+        self.assertEqual(aggregation.aggregate([
+            {"g": {"a": 1, "b": 2}},
+            {"g": {"b": 2, "a": 1}},
+            {"g": [1]},
+        ]), [
+            {"group": [1], "count": 1, "sum": {}},
+            {"group": {"a": 1, "b": 2}, "count": 2, "sum": {}},
+        ])
+
+    def test_group_by_kinds(self):
+        aggregation = Aggregation(group_by="g")
+        results = aggregation.aggregate([{"g": 1}, {"g": True}, {"g": "1"}])
+        self.assertEqual(
+            [result["count"] for result in results], [1, 1, 1])
+
+    def test_data_not_copied(self):
+        aggregation = Aggregation(group_by="g")
+        group = {"a": 1}
+        [result] = aggregation.aggregate([{"g": group}])
+        self.assertTrue(result["group"] is group)
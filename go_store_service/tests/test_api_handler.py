@@ -2,14 +2,27 @@ import json
 
 from twisted.trial.unittest import TestCase
 from twisted.python.failure import Failure
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, Deferred
+from twisted.internet.task import Clock
+from twisted.web.iweb import UNKNOWN_LENGTH
 
 from cyclone.web import HTTPError
 
 from go_store_service.collections import InMemoryCollection
+from go_store_service.collections.cascading import DeletionJobs
+from go_store_service.collections.inmemory import InMemoryRowCollection
 from go_store_service.api_handler import (
-    BaseHandler, CollectionHandler, ElementHandler,
-    create_urlspec_regex, ApiApplication)
+    AggregateHandler, BaseHandler, CollectionHandler, CountHandler,
+    DeletionStatusHandler, ElementHandler, BatchGetHandler, BulkHandler,
+    MetricsHandler, StreamProducer, create_urlspec_regex,
+    negotiate_content_type, parse_etags, ApiApplication)
+from go_store_service import encoding
+from go_store_service.admission import OwnerAdmissionControl
+from go_store_service.encoding import (
+    RawJson, data_version, frame, msgpack_available, msgpack_dumps,
+    msgpack_loads)
+from go_store_service.metrics import MetricsRegistry
+from go_store_service.schema import Schema
 from go_store_service.tests.helpers import HandlerHelper, AppHelper
 
 
@@ -19,6 +32,15 @@ class DummyError(Exception):
     """
 
 
+def mk_schema_collection(data):
+    """
+    Return a row collection whose rows must have an integer ``n`` field.
+    """
+    schema = Schema({"n": "integer"})
+    return InMemoryRowCollection(
+        data, "owner", "store", get_schema=lambda: schema)
+
+
 class TestCreateUrlspecRegex(TestCase):
     def test_no_variables(self):
         self.assertEqual(create_urlspec_regex("/foo/bar"), "/foo/bar")
@@ -43,6 +65,68 @@ class TestCreateUrlspecRegex(TestCase):
         self.assertEqual(create_urlspec_regex("/"), "/")
 
 
+class TestParseEtags(TestCase):
+    def test_single(self):
+        self.assertEqual(parse_etags('"abc"'), ["abc"])
+
+    def test_many(self):
+        self.assertEqual(
+            parse_etags('"abc", W/"def",ghi'), ["abc", "def", "ghi"])
+
+    def test_any(self):
+        self.assertEqual(parse_etags(' * '), None)
+
+
+class TestNegotiateContentType(TestCase):
+    if not msgpack_available():
+        skip = "msgpack is not installed."
+
+    def test_default(self):
+        self.assertEqual(negotiate_content_type(""), "application/json")
+
+    def test_msgpack(self):
+        self.assertEqual(
+            negotiate_content_type("application/x-msgpack"),
+            "application/x-msgpack")
+
+    def test_preference(self):
+        self.assertEqual(
+            negotiate_content_type(
+                "application/x-msgpack;q=0.5, application/json"),
+            "application/json")
+        self.assertEqual(
+            negotiate_content_type("application/x-msgpack, */*;q=0.1"),
+            "application/x-msgpack")
+
+    def test_msgpack_unavailable(self):
+        self.patch(encoding, "msgpack", None)
+        self.assertEqual(
+            negotiate_content_type("application/x-msgpack"),
+            "application/json")
+
+
+class TestStreamProducer(TestCase):
+    def test_wait_not_paused(self):
+        producer = StreamProducer()
+        self.assertEqual(self.successResultOf(producer.wait()), None)
+
+    def test_wait_paused(self):
+        producer = StreamProducer()
+        producer.pauseProducing()
+        d = producer.wait()
+        self.assertNoResult(d)
+        producer.resumeProducing()
+        self.assertEqual(self.successResultOf(d), None)
+
+    def test_stop_producing(self):
+        producer = StreamProducer()
+        producer.pauseProducing()
+        d = producer.wait()
+        producer.stopProducing()
+        self.assertEqual(self.successResultOf(d), None)
+        self.assertEqual(producer.stopped, True)
+
+
 class TestBaseHandler(TestCase):
     def setUp(self):
         self.handler_helper = HandlerHelper(BaseHandler)
@@ -59,6 +143,93 @@ class TestBaseHandler(TestCase):
         [err] = self.flushLoggedErrors(DummyError)
         self.assertEqual(err, f)
 
+    def test_raise_err_http_error(self):
+        handler = self.handler_helper.mk_handler()
+        f = Failure(HTTPError(400, reason="Bad"))
+        try:
+            handler.raise_err(f, 500, "Eep")
+        except HTTPError, err:
+            pass
+        self.assertEqual(err.status_code, 400)
+        self.assertEqual(err.reason, "Bad")
+        self.assertEqual(self.flushLoggedErrors(HTTPError), [])
+
+    def test_catch_err(self):
+        handler = self.handler_helper.mk_handler()
+        f = Failure(DummyError("Moop"))
+        try:
+            handler.catch_err(f, DummyError, 400, "Eep")
+        except HTTPError, err:
+            pass
+        self.assertEqual(err.status_code, 400)
+        self.assertEqual(err.reason, "Eep")
+
+    def test_catch_err_other_error(self):
+        handler = self.handler_helper.mk_handler()
+        f = Failure(DummyError("Moop"))
+        err = self.assertRaises(
+            Failure, handler.catch_err, f, ValueError, 400, "Eep")
+        self.assertEqual(err, f)
+
+    def test_write_dict(self):
+        handler = self.handler_helper.mk_handler()
+        handler.write({"id": "foo"})
+        self.assertEqual(handler._write_buffer, ['{"id": "foo"}'])
+        self.assertEqual(
+            handler._headers["Content-Type"], "application/json")
+
+    def test_write_raw_json(self):
+        handler = self.handler_helper.mk_handler()
+        handler.write(RawJson('{"id": "foo"}'))
+        self.assertEqual(handler._write_buffer, ['{"id": "foo"}'])
+        self.assertEqual(
+            handler._headers["Content-Type"], "application/json")
+
+    def test_write_dict_msgpack(self):
+        handler = self.handler_helper.mk_handler()
+        handler.request.headers["Accept"] = "application/x-msgpack"
+        handler.write({"id": "foo"})
+        self.assertEqual(handler._write_buffer, [msgpack_dumps({"id": "foo"})])
+        self.assertEqual(
+            handler._headers["Content-Type"], "application/x-msgpack")
+        self.assertEqual(handler._headers["Vary"], "Accept")
+
+    def test_write_raw_json_msgpack(self):
+        handler = self.handler_helper.mk_handler()
+        handler.request.headers["Accept"] = "application/x-msgpack"
+        handler.write(RawJson('{"id": "foo"}'))
+        self.assertEqual(
+            handler._write_buffer, [msgpack_dumps({u"id": u"foo"})])
+
+    def test_write_framed(self):
+        handler = self.handler_helper.mk_handler()
+        handler.write_framed({"id": "foo"})
+        self.assertEqual(handler._write_buffer, ['{"id": "foo"}', "\n"])
+
+    def test_write_framed_msgpack(self):
+        handler = self.handler_helper.mk_handler()
+        handler.request.headers["Accept"] = "application/x-msgpack"
+        handler.write_framed({"id": "foo"})
+        self.assertEqual(
+            handler._write_buffer, [frame(msgpack_dumps({"id": "foo"}))])
+
+    def test_decode(self):
+        handler = self.handler_helper.mk_handler()
+        self.assertEqual(handler.decode('{"a": 1}'), {"a": 1})
+        self.assertRaises(ValueError, handler.decode, "not json")
+
+    def test_decode_msgpack(self):
+        handler = self.handler_helper.mk_handler()
+        handler.request.headers["Content-Type"] = "application/x-msgpack"
+        self.assertEqual(handler.decode(msgpack_dumps({"a": 1})), {"a": 1})
+
+    def test_decode_msgpack_unavailable(self):
+        self.patch(encoding, "msgpack", None)
+        handler = self.handler_helper.mk_handler()
+        handler.request.headers["Content-Type"] = "application/x-msgpack"
+        err = self.assertRaises(HTTPError, handler.decode, "\x80")
+        self.assertEqual(err.status_code, 415)
+
     @inlineCallbacks
     def test_write_object(self):
         writes = []
@@ -82,6 +253,59 @@ class TestBaseHandler(TestCase):
             {"id": "obj2"}, "\n",
         ])
 
+    def mk_streaming_handler(self, writes, flushes):
+        handler = self.handler_helper.mk_handler()
+        handler.write = lambda d: writes.append(d)
+        handler.flush = lambda: flushes.append(len(writes))
+        return handler
+
+    @inlineCallbacks
+    def test_stream_objects(self):
+        writes, flushes = [], []
+        handler = self.mk_streaming_handler(writes, flushes)
+        handler.stream_flush_count = 2
+        yield handler.stream_objects([
+            {"id": "obj1"}, None, {"id": "obj2"}, {"id": "obj3"},
+        ])
+        self.assertEqual(writes, [
+            {"id": "obj1"}, "\n",
+            {"id": "obj2"}, "\n",
+            {"id": "obj3"}, "\n",
+        ])
+        self.assertEqual(flushes, [4])
+        self.assertEqual(handler.objects_written, 3)
+        self.assertEqual(handler.request.connection.transport.producer, None)
+
+    def test_stream_objects_paused(self):
+        writes, flushes = [], []
+        handler = self.mk_streaming_handler(writes, flushes)
+        transport = handler.request.connection.transport
+        obj1 = Deferred()
+        d = handler.stream_objects([obj1, {"id": "obj2"}])
+        transport.producer.pauseProducing()
+        obj1.callback({"id": "obj1"})
+        self.assertEqual(writes, [{"id": "obj1"}, "\n"])
+
+        transport.producer.resumeProducing()
+        self.assertEqual(writes, [
+            {"id": "obj1"}, "\n",
+            {"id": "obj2"}, "\n",
+        ])
+        self.successResultOf(d)
+
+    def test_stream_objects_stopped(self):
+        writes, flushes = [], []
+        handler = self.mk_streaming_handler(writes, flushes)
+        transport = handler.request.connection.transport
+        obj1 = Deferred()
+        d = handler.stream_objects([obj1, {"id": "obj2"}])
+        producer = transport.producer
+        producer.stopProducing()
+        obj1.callback({"id": "obj1"})
+        self.assertEqual(writes, [{"id": "obj1"}, "\n"])
+        self.successResultOf(d)
+        self.assertEqual(transport.producer, None)
+
 
 # TODO: Test error handling
 
@@ -116,6 +340,111 @@ class TestCollectionHandler(TestCase):
             {"id": "obj1", "data": {"foo": "bar"}},
             {"id": "obj2", "data": "baz"}])
 
+    @inlineCallbacks
+    def test_get_raw(self):
+        collection = InMemoryCollection(
+            {"obj1": '{"foo": "bar"}'}, serialized=True, raw=True)
+        app_helper = AppHelper(urlspec=CollectionHandler.mk_urlspec(
+            '/root', lambda: collection))
+        data = yield app_helper.get('/root', parser='json_lines')
+        self.assertEqual(data, [{"id": "obj1", "data": {"foo": "bar"}}])
+
+    @inlineCallbacks
+    def test_get_streamed(self):
+        self.patch(CollectionHandler, 'stream_flush_count', 1)
+        response = yield self.app_helper.get('/root')
+        # The client strips the Transfer-Encoding header, but a chunked
+        # response has no Content-Length.
+        self.assertEqual(response.length, UNKNOWN_LENGTH)
+        data = yield self.app_helper._parse_json_lines(response)
+        self.assertEqual(data, [
+            {"id": "obj1", "data": {"foo": "bar"}},
+            {"id": "obj2", "data": "baz"}])
+
+    @inlineCallbacks
+    def test_get_fields(self):
+        self.collection_data["obj3"] = {"foo": "baz", "big": [0] * 100}
+        data = yield self.app_helper.get(
+            '/root?fields=foo', parser='json_lines')
+        self.assertEqual(sorted(data, key=lambda obj: obj["id"]), [
+            {"id": "obj1", "data": {"foo": "bar"}},
+            {"id": "obj2", "data": {}},
+            {"id": "obj3", "data": {"foo": "baz"}}])
+
+    @inlineCallbacks
+    def test_get_page_fields(self):
+        self.collection_data["obj1"]["big"] = [0] * 100
+        data = yield self.app_helper.get(
+            '/root?limit=1&fields=foo', parser='json_lines')
+        self.assertEqual(data, [{"id": "obj1", "data": {"foo": "bar"}}])
+
+    @inlineCallbacks
+    def test_get_invalid_fields(self):
+        response = yield self.app_helper.get('/root?fields=foo..bar')
+        self.assertEqual(response.code, 400)
+
+    @inlineCallbacks
+    def test_get_query(self):
+        self.collection_data["obj3"] = {"foo": "baz", "n": 1}
+        data = yield self.app_helper.get(
+            '/root?query=foo+%5E%3D+ba&query=n+%3E+0', parser='json_lines')
+        self.assertEqual(data, [
+            {"id": "obj3", "data": {"foo": "baz", "n": 1}}])
+
+    @inlineCallbacks
+    def test_get_query_fields(self):
+        data = yield self.app_helper.get(
+            '/root?query=foo+%3D%3D+bar&fields=missing', parser='json_lines')
+        self.assertEqual(data, [{"id": "obj1", "data": {}}])
+
+    @inlineCallbacks
+    def test_get_invalid_query(self):
+        response = yield self.app_helper.get('/root?query=foo')
+        self.assertEqual(response.code, 400)
+
+    @inlineCallbacks
+    def test_get_query_paged(self):
+        response = yield self.app_helper.get(
+            '/root?query=foo+%3D%3D+bar&limit=1')
+        self.assertEqual(response.code, 400)
+
+    @inlineCallbacks
+    def test_get_msgpack(self):
+        collection = InMemoryCollection(
+            {"obj1": '{"values": [1, 2, 3]}'}, serialized=True, raw=True)
+        app_helper = AppHelper(urlspec=CollectionHandler.mk_urlspec(
+            '/root', lambda: collection))
+        response = yield app_helper.get(
+            '/root', headers={"Accept": "application/x-msgpack"})
+        self.assertEqual(
+            response.headers.getRawHeaders("Content-Type"),
+            ["application/x-msgpack"])
+        data = yield app_helper._parse_msgpack_frames(response)
+        self.assertEqual(data, [{"id": "obj1", "data": {"values": [1, 2, 3]}}])
+
+    @inlineCallbacks
+    def test_get_page(self):
+        response = yield self.app_helper.get('/root?limit=1')
+        [cursor] = response.headers.getRawHeaders('X-Next-Cursor')
+        data = yield self.app_helper._parse_json_lines(response)
+        self.assertEqual(data, [{"id": "obj1", "data": {"foo": "bar"}}])
+
+        response = yield self.app_helper.get(
+            '/root?limit=1&cursor=%s' % (cursor,))
+        self.assertEqual(response.headers.getRawHeaders('X-Next-Cursor'), None)
+        data = yield self.app_helper._parse_json_lines(response)
+        self.assertEqual(data, [{"id": "obj2", "data": "baz"}])
+
+    @inlineCallbacks
+    def test_get_page_invalid_limit(self):
+        response = yield self.app_helper.get('/root?limit=foo')
+        self.assertEqual(response.code, 400)
+
+    @inlineCallbacks
+    def test_get_page_invalid_cursor(self):
+        response = yield self.app_helper.get('/root?limit=1&cursor=foo')
+        self.assertEqual(response.code, 400)
+
     @inlineCallbacks
     def test_post(self):
         data = yield self.app_helper.post(
@@ -123,6 +452,216 @@ class TestCollectionHandler(TestCase):
         self.assertEqual(data, {"id": data["id"], "data": {"hello": "world"}})
         self.assertEqual(self.collection_data[data["id"]], {"hello": "world"})
 
+    @inlineCallbacks
+    def test_post_msgpack(self):
+        data = yield self.app_helper.post(
+            '/root', data=msgpack_dumps({"values": [1.5, 2]}),
+            headers={
+                "Content-Type": "application/x-msgpack",
+                "Accept": "application/x-msgpack",
+            }, parser='msgpack')
+        self.assertEqual(data["data"], {"values": [1.5, 2]})
+        self.assertEqual(
+            self.collection_data[data["id"]], {"values": [1.5, 2]})
+
+    @inlineCallbacks
+    def test_post_schema_violation(self):
+        collection = mk_schema_collection({})
+        app_helper = AppHelper(urlspec=CollectionHandler.mk_urlspec(
+            '/root', lambda: collection))
+        response = yield app_helper.post(
+            '/root', data=json.dumps({"n": "1"}))
+        self.assertEqual(response.code, 400)
+        self.assertEqual(collection._data, {})
+
+
+class TestBatchGetHandler(TestCase):
+    def setUp(self):
+        self.collection_data = {
+            "obj1": {"foo": "bar"},
+            "obj2": "baz",
+        }
+        self.collection = InMemoryCollection(self.collection_data)
+        self.collection_factory = lambda: self.collection
+        self.app_helper = AppHelper(
+            urlspec=BatchGetHandler.mk_urlspec(
+                '/root', self.collection_factory))
+
+    @inlineCallbacks
+    def test_post(self):
+        data = yield self.app_helper.post(
+            '/root/_batch_get', data=json.dumps(["obj2", "missing", "obj1"]),
+            parser='json_lines')
+        self.assertEqual(data, [
+            {"id": "obj2", "data": "baz"},
+            {"id": "obj1", "data": {"foo": "bar"}}])
+
+    @inlineCallbacks
+    def test_post_invalid_ids(self):
+        response = yield self.app_helper.post(
+            '/root/_batch_get', data=json.dumps({"id": "obj1"}))
+        self.assertEqual(response.code, 400)
+
+    @inlineCallbacks
+    def test_post_invalid_json(self):
+        response = yield self.app_helper.post(
+            '/root/_batch_get', data="not json")
+        self.assertEqual(response.code, 400)
+
+
+class TestBulkHandler(TestCase):
+    def setUp(self):
+        self.collection_data = {
+            "obj1": {"foo": "bar"},
+        }
+        self.collection = InMemoryCollection(self.collection_data)
+        self.collection_factory = lambda: self.collection
+        self.app_helper = AppHelper(
+            urlspec=BulkHandler.mk_urlspec(
+                '/root', self.collection_factory))
+
+    @inlineCallbacks
+    def test_post(self):
+        body = "\n".join([
+            json.dumps({"id": "obj1", "data": "baz"}),
+            json.dumps({"data": {"hello": "world"}}),
+            "",
+            "not json",
+            json.dumps({"id": 5, "data": None}),
+        ])
+        data = yield self.app_helper.post(
+            '/root/_bulk', data=body, parser='json_lines')
+        new_id = data[1].get("id")
+        self.assertEqual(data, [
+            {"success": True, "id": "obj1"},
+            {"success": True, "id": new_id},
+            {"success": False, "reason": "Invalid line."},
+            {"success": False, "reason": "Invalid line."},
+        ])
+        self.assertEqual(self.collection_data, {
+            "obj1": "baz",
+            new_id: {"hello": "world"},
+        })
+
+    @inlineCallbacks
+    def test_post_batches(self):
+        self.patch(BulkHandler, 'bulk_batch_size', 2)
+        body = "\n".join(
+            json.dumps({"id": "obj%d" % i, "data": i}) for i in range(5))
+        data = yield self.app_helper.post(
+            '/root/_bulk', data=body, parser='json_lines')
+        self.assertEqual(data, [
+            {"success": True, "id": "obj%d" % i} for i in range(5)])
+        self.assertEqual(self.collection_data, dict(
+            ("obj%d" % i, i) for i in range(5)))
+
+    @inlineCallbacks
+    def test_post_msgpack(self):
+        body = "".join([
+            frame(msgpack_dumps({"id": "obj1", "data": [1, 2]})),
+            frame("\xc1"),
+            frame(msgpack_dumps({"id": "obj2", "data": None})),
+        ])
+        data = yield self.app_helper.post(
+            '/root/_bulk', data=body, headers={
+                "Content-Type": "application/x-msgpack",
+                "Accept": "application/x-msgpack",
+            }, parser='msgpack_frames')
+        self.assertEqual(data, [
+            {"success": True, "id": "obj1"},
+            {"success": False, "reason": "Invalid line."},
+            {"success": True, "id": "obj2"},
+        ])
+        self.assertEqual(self.collection_data, {"obj1": [1, 2], "obj2": None})
+
+    @inlineCallbacks
+    def test_post_schema_violation(self):
+        collection = mk_schema_collection({})
+        app_helper = AppHelper(urlspec=BulkHandler.mk_urlspec(
+            '/root', lambda: collection))
+        body = "\n".join([
+            json.dumps({"id": "obj1", "data": {"n": "1"}}),
+            json.dumps({"id": "obj2", "data": {"n": 2}}),
+        ])
+        data = yield app_helper.post(
+            '/root/_bulk', data=body, parser='json_lines')
+        self.assertEqual(data, [
+            {"success": False, "reason": "Schema violation."},
+            {"success": True, "id": "obj2"},
+        ])
+        self.assertEqual(collection._data, {"obj2": {"n": 2}})
+
+
+class TestCountHandler(TestCase):
+    def setUp(self):
+        self.collection = InMemoryCollection({
+            "obj1": {"n": 1},
+            "obj2": {"n": 2},
+            "obj3": "foo",
+        })
+        self.app_helper = AppHelper(urlspec=CountHandler.mk_urlspec(
+            '/root', lambda: self.collection))
+
+    @inlineCallbacks
+    def test_get(self):
+        data = yield self.app_helper.get('/root/_count', parser='json')
+        self.assertEqual(data, {"count": 3})
+
+    @inlineCallbacks
+    def test_get_query(self):
+        data = yield self.app_helper.get(
+            '/root/_count?query=n+%3E%3D+2', parser='json')
+        self.assertEqual(data, {"count": 1})
+
+    @inlineCallbacks
+    def test_get_invalid_query(self):
+        response = yield self.app_helper.get('/root/_count?query=n')
+        self.assertEqual(response.code, 400)
+
+
+class TestAggregateHandler(TestCase):
+    def setUp(self):
+        self.collection = InMemoryCollection({
+            "obj1": {"status": "paid", "amount": 5},
+            "obj2": {"status": "paid", "amount": 2},
+            "obj3": {"status": "new", "amount": 1},
+        })
+        self.app_helper = AppHelper(urlspec=AggregateHandler.mk_urlspec(
+            '/root', lambda: self.collection))
+
+    @inlineCallbacks
+    def test_get(self):
+        data = yield self.app_helper.get(
+            '/root/_aggregate?sum=amount', parser='json')
+        self.assertEqual(data, {"groups": [
+            {"group": None, "count": 3, "sum": {"amount": 8}},
+        ]})
+
+    @inlineCallbacks
+    def test_get_group_by(self):
+        data = yield self.app_helper.get(
+            '/root/_aggregate?group_by=status&sum=amount', parser='json')
+        self.assertEqual(data, {"groups": [
+            {"group": "new", "count": 1, "sum": {"amount": 1}},
+            {"group": "paid", "count": 2, "sum": {"amount": 7}},
+        ]})
+
+    @inlineCallbacks
+    def test_get_query(self):
+        data = yield self.app_helper.get(
+            '/root/_aggregate?group_by=status&query=amount+%3E+1',
+            parser='json')
+        self.assertEqual(data, {"groups": [
+            {"group": "paid", "count": 2, "sum": {}},
+        ]})
+
+    @inlineCallbacks
+    def test_get_invalid(self):
+        response = yield self.app_helper.get('/root/_aggregate?sum=a..b')
+        self.assertEqual(response.code, 400)
+        response = yield self.app_helper.get('/root/_aggregate?query=a')
+        self.assertEqual(response.code, 400)
+
 
 class TestElementHandler(TestCase):
     def setUp(self):
@@ -168,6 +707,79 @@ class TestElementHandler(TestCase):
             self.collection_data["obj2"],
             {"hello": "world"})
 
+    @inlineCallbacks
+    def test_put_missing(self):
+        response = yield self.app_helper.put(
+            '/root/missing', data=json.dumps({"hello": "world"}))
+        self.assertEqual(response.code, 404)
+        self.assertTrue("missing" not in self.collection_data)
+
+    @inlineCallbacks
+    def test_put_blind(self):
+        data = yield self.app_helper.put(
+            '/root/obj2?blind=true', data=json.dumps({"hello": "world"}),
+            parser='json')
+        self.assertEqual(data, {"success": True})
+        self.assertEqual(self.collection_data["obj2"], {"hello": "world"})
+
+    @inlineCallbacks
+    def test_put_blind_missing(self):
+        response = yield self.app_helper.put(
+            '/root/missing?blind=true', data=json.dumps({"hello": "world"}))
+        self.assertEqual(response.code, 404)
+        self.assertTrue("missing" not in self.collection_data)
+
+    @inlineCallbacks
+    def test_put_invalid_blind(self):
+        response = yield self.app_helper.put(
+            '/root/obj1?blind=maybe', data=json.dumps({"hello": "world"}))
+        self.assertEqual(response.code, 400)
+
+    @inlineCallbacks
+    def test_put_schema_violation(self):
+        collection = mk_schema_collection({"obj1": {"n": 1}})
+        app_helper = AppHelper(urlspec=ElementHandler.mk_urlspec(
+            '/root', lambda: collection))
+        response = yield app_helper.put(
+            '/root/obj1', data=json.dumps({"n": 1.5}))
+        self.assertEqual(response.code, 400)
+        self.assertEqual(collection._data, {"obj1": {"n": 1}})
+
+    @inlineCallbacks
+    def test_get_fields(self):
+        self.collection_data["obj1"]["big"] = [0] * 100
+        response = yield self.app_helper.get('/root/obj1?fields=foo')
+        data = yield response.json()
+        self.assertEqual(data, {"id": "obj1", "data": {"foo": "bar"}})
+        self.assertNotEqual(
+            response.headers.getRawHeaders("Etag"),
+            [self.etag(self.collection_data["obj1"])])
+
+    @inlineCallbacks
+    def test_get_invalid_fields(self):
+        response = yield self.app_helper.get('/root/obj1?fields=,')
+        self.assertEqual(response.code, 400)
+
+    @inlineCallbacks
+    def test_get_msgpack(self):
+        response = yield self.app_helper.get(
+            '/root/obj1', headers={"Accept": "application/x-msgpack"})
+        body = yield response.content()
+        self.assertEqual(
+            msgpack_loads(body), {"id": "obj1", "data": {"foo": "bar"}})
+        self.assertEqual(
+            response.headers.getRawHeaders("Etag"),
+            [self.etag({"foo": "bar"})])
+
+    @inlineCallbacks
+    def test_put_msgpack(self):
+        data = yield self.app_helper.put(
+            '/root/obj2', data=msgpack_dumps({"values": range(3)}),
+            headers={"Content-Type": "application/x-msgpack"},
+            parser='json')
+        self.assertEqual(data, {"success": True})
+        self.assertEqual(self.collection_data["obj2"], {"values": [0, 1, 2]})
+
     @inlineCallbacks
     def test_delete(self):
         self.assertTrue("obj1" in self.collection_data)
@@ -176,6 +788,142 @@ class TestElementHandler(TestCase):
         self.assertEqual(data, {"success": True})
         self.assertTrue("obj1" not in self.collection_data)
 
+    def etag(self, data):
+        return '"%s"' % (data_version(data),)
+
+    @inlineCallbacks
+    def test_get_etag(self):
+        response = yield self.app_helper.get('/root/obj1')
+        self.assertEqual(
+            response.headers.getRawHeaders('ETag'),
+            [self.etag({"foo": "bar"})])
+
+    def record_gets(self):
+        calls = []
+        get = self.collection.get
+        get_version = self.collection.get_version
+
+        def record_get(object_id, fields=None):
+            calls.append(("get", object_id))
+            return get(object_id, fields=fields)
+
+        def record_get_version(object_id):
+            calls.append(("get_version", object_id))
+            return get_version(object_id)
+
+        self.patch(self.collection, 'get', record_get)
+        self.patch(self.collection, 'get_version', record_get_version)
+        return calls
+
+    @inlineCallbacks
+    def test_get_if_none_match(self):
+        calls = self.record_gets()
+        response = yield self.app_helper.get(
+            '/root/obj1', headers={'If-None-Match': self.etag({"foo": "bar"})})
+        self.assertEqual(response.code, 304)
+        self.assertEqual(
+            response.headers.getRawHeaders('ETag'),
+            [self.etag({"foo": "bar"})])
+        body = yield self.app_helper._parse_bytes(response)
+        self.assertEqual(body, "")
+        # The in-memory collection finds versions cheaply, so the element
+        # isn't loaded.
+        self.assertEqual(calls, [("get_version", "obj1")])
+
+    @inlineCallbacks
+    def test_get_if_none_match_changed(self):
+        calls = self.record_gets()
+        response = yield self.app_helper.get(
+            '/root/obj1', headers={'If-None-Match': '"old", "older"'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(
+            response.headers.getRawHeaders('ETag'),
+            [self.etag({"foo": "bar"})])
+        data = yield self.app_helper._parse_json(response)
+        self.assertEqual(data, {"id": "obj1", "data": {"foo": "bar"}})
+        self.assertEqual(calls, [("get_version", "obj1"), ("get", "obj1")])
+
+    @inlineCallbacks
+    def test_get_if_none_match_without_cheap_versions(self):
+        """
+        Collections that have to load an element to find its version are
+        only asked for the element, whether or not the version matches.
+        """
+        self.patch(self.collection, 'cheap_versions', False)
+        calls = self.record_gets()
+        response = yield self.app_helper.get(
+            '/root/obj1', headers={'If-None-Match': self.etag({"foo": "bar"})})
+        self.assertEqual(response.code, 304)
+        response = yield self.app_helper.get(
+            '/root/obj1', headers={'If-None-Match': '"old"'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(calls, [("get", "obj1"), ("get", "obj1")])
+
+    @inlineCallbacks
+    def test_put_if_match(self):
+        response = yield self.app_helper.put(
+            '/root/obj2', data=json.dumps({"hello": "world"}),
+            headers={'If-Match': self.etag("baz")})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(
+            response.headers.getRawHeaders('ETag'),
+            [self.etag({"hello": "world"})])
+        self.assertEqual(self.collection_data["obj2"], {"hello": "world"})
+
+    @inlineCallbacks
+    def test_put_if_match_many(self):
+        response = yield self.app_helper.put(
+            '/root/obj2', data=json.dumps({"hello": "world"}),
+            headers={'If-Match': '"old", %s' % (self.etag("baz"),)})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.collection_data["obj2"], {"hello": "world"})
+
+    @inlineCallbacks
+    def test_put_if_match_conflict(self):
+        response = yield self.app_helper.put(
+            '/root/obj2', data=json.dumps({"hello": "world"}),
+            headers={'If-Match': '"old"'})
+        self.assertEqual(response.code, 412)
+        self.assertEqual(self.collection_data["obj2"], "baz")
+
+    @inlineCallbacks
+    def test_put_if_match_many_conflict(self):
+        response = yield self.app_helper.put(
+            '/root/obj2', data=json.dumps({"hello": "world"}),
+            headers={'If-Match': '"old", "older"'})
+        self.assertEqual(response.code, 412)
+        self.assertEqual(self.collection_data["obj2"], "baz")
+
+    @inlineCallbacks
+    def test_delete_if_match_conflict(self):
+        response = yield self.app_helper.delete(
+            '/root/obj1', headers={'If-Match': '"old"'})
+        self.assertEqual(response.code, 412)
+        self.assertTrue("obj1" in self.collection_data)
+
+
+class TestDeletionStatusHandler(TestCase):
+    def setUp(self):
+        self.jobs = DeletionJobs()
+        self.app_helper = AppHelper(urlspec=DeletionStatusHandler.mk_urlspec(
+            '/:owner_id/stores/:store_id/_deletion', self.jobs))
+
+    @inlineCallbacks
+    def test_get(self):
+        rows = InMemoryCollection({"a": {}, "b": {}})
+        job = self.jobs.start("me", "store", rows)
+        yield job.wait()
+        data = yield self.app_helper.get(
+            '/me/stores/store/_deletion', parser='json')
+        self.assertEqual(data, job.status())
+        self.assertEqual(
+            (data["status"], data["total"], data["deleted"]), ("done", 2, 2))
+
+    @inlineCallbacks
+    def test_get_missing(self):
+        response = yield self.app_helper.get('/me/stores/store/_deletion')
+        self.assertEqual(response.code, 404)
+
 
 class TestApiApplication(TestCase):
     def test_build_routes(self):
@@ -184,16 +932,120 @@ class TestApiApplication(TestCase):
         app.collections = (
             ('/:owner_id/store', collection_factory),
         )
-        [collection_route, elem_route] = app._build_routes()
+        [collection_route, batch_get_route, bulk_route, count_route,
+         aggregate_route, elem_route] = app._build_routes()
         self.assertEqual(collection_route.handler_class, CollectionHandler)
         self.assertEqual(collection_route.regex.pattern,
                          "/(?P<owner_id>[^/]*)/store$")
         self.assertEqual(collection_route.kwargs, {
             "collection_factory": collection_factory,
+            "route": "/:owner_id/store",
+        })
+        self.assertEqual(batch_get_route.handler_class, BatchGetHandler)
+        self.assertEqual(batch_get_route.regex.pattern,
+                         "/(?P<owner_id>[^/]*)/store/_batch_get$")
+        self.assertEqual(batch_get_route.kwargs, {
+            "collection_factory": collection_factory,
+            "route": "/:owner_id/store/_batch_get",
+        })
+        self.assertEqual(bulk_route.handler_class, BulkHandler)
+        self.assertEqual(bulk_route.regex.pattern,
+                         "/(?P<owner_id>[^/]*)/store/_bulk$")
+        self.assertEqual(bulk_route.kwargs, {
+            "collection_factory": collection_factory,
+            "route": "/:owner_id/store/_bulk",
         })
+        self.assertEqual(count_route.handler_class, CountHandler)
+        self.assertEqual(count_route.regex.pattern,
+                         "/(?P<owner_id>[^/]*)/store/_count$")
+        self.assertEqual(aggregate_route.handler_class, AggregateHandler)
+        self.assertEqual(aggregate_route.regex.pattern,
+                         "/(?P<owner_id>[^/]*)/store/_aggregate$")
         self.assertEqual(elem_route.handler_class, ElementHandler)
         self.assertEqual(elem_route.regex.pattern,
                          "/(?P<owner_id>[^/]*)/store/(?P<elem_id>[^/]*)$")
         self.assertEqual(elem_route.kwargs, {
             "collection_factory": collection_factory,
+            "route": "/:owner_id/store/:elem_id",
         })
+
+    def test_build_routes_with_metrics(self):
+        metrics = MetricsRegistry()
+        app = ApiApplication(metrics=metrics)
+        [metrics_route] = app._build_routes()
+        self.assertEqual(metrics_route.handler_class, MetricsHandler)
+        self.assertEqual(metrics_route.regex.pattern, "/metrics$")
+        self.assertEqual(metrics_route.kwargs, {"metrics": metrics})
+
+    @inlineCallbacks
+    def test_metrics(self):
+        collection = InMemoryCollection({"obj1": {"foo": "bar"}})
+
+        class App(ApiApplication):
+            collections = (('/root', lambda: collection),)
+
+        metrics = MetricsRegistry()
+        app_helper = AppHelper(app=App(metrics=metrics))
+        yield app_helper.get('/root', parser='json_lines')
+        response = yield app_helper.get('/metrics')
+        self.assertEqual(
+            response.headers.getRawHeaders('Content-Type'),
+            ['text/plain; version=0.0.4'])
+        body = yield app_helper._parse_bytes(response)
+        lines = body.splitlines()
+        self.assertTrue(
+            'store_request_duration_seconds_count'
+            '{route="/root",method="GET",code="200"} 1.0' in lines)
+        self.assertTrue(
+            'store_response_bytes_total{route="/root",method="GET"} 39.0'
+            in lines)
+        self.assertTrue(
+            'store_streamed_objects_total{route="/root",method="GET"} 1.0'
+            in lines)
+
+
+class TestAdmissionControl(TestCase):
+    def mk_app_helper(self, admission, metrics=None):
+        collection = InMemoryCollection({"obj1": {"foo": "bar"}})
+
+        class App(ApiApplication):
+            collections = (('/:owner_id/root', lambda owner_id: collection),)
+
+        return AppHelper(app=App(metrics=metrics, admission=admission))
+
+    @inlineCallbacks
+    def test_rate_limited(self):
+        metrics = MetricsRegistry()
+        admission = OwnerAdmissionControl(rate=1, reactor=Clock())
+        app_helper = self.mk_app_helper(admission, metrics)
+        response = yield app_helper.get('/me/root/obj1')
+        self.assertEqual(response.code, 200)
+        response = yield app_helper.get('/me/root/obj1')
+        self.assertEqual(response.code, 429)
+        self.assertEqual(response.headers.getRawHeaders('Retry-After'), ['1'])
+        data = yield app_helper._parse_json(response)
+        self.assertEqual(data["success"], False)
+        response = yield app_helper.get('/you/root/obj1')
+        self.assertEqual(response.code, 200)
+        counter = metrics.counter(
+            'store_admission_rejections_total', '', ('route', 'reason'))
+        self.assertEqual(
+            counter.value(('/:owner_id/root/:elem_id', 'rate')), 1)
+
+    @inlineCallbacks
+    def test_max_listings(self):
+        admission = OwnerAdmissionControl(max_listings=1)
+        app_helper = self.mk_app_helper(admission)
+        release = admission.admit("me", listing=True)
+        response = yield app_helper.get('/me/root')
+        self.assertEqual(response.code, 429)
+        response = yield app_helper.get('/me/root/_count')
+        self.assertEqual(response.code, 429)
+        # Requests that don't list the collection aren't limited.
+        response = yield app_helper.get('/me/root/obj1')
+        self.assertEqual(response.code, 200)
+        release()
+        objs = yield app_helper.get('/me/root', parser='json_lines')
+        self.assertEqual(objs, [{"id": "obj1", "data": {"foo": "bar"}}])
+        # The listing was released once it finished.
+        self.assertEqual(admission.listings("me"), 0)
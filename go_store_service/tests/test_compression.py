@@ -0,0 +1,163 @@
+import zlib
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.trial.unittest import TestCase
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+
+from go_store_service.api_handler import ApiApplication
+from go_store_service.collections import InMemoryCollection
+from go_store_service.compression import (
+    CompressedContentEncoding, parse_accept)
+
+
+class DummyHeaders(dict):
+    pass
+
+
+class DummyRequest(object):
+    def __init__(self, accept_encoding=None, method="GET", http_1_1=True):
+        self.method = method
+        self.headers = DummyHeaders()
+        if accept_encoding is not None:
+            self.headers["Accept-Encoding"] = accept_encoding
+        self.supports_http_1_1 = lambda: http_1_1
+
+
+def json_headers():
+    return {"Content-Type": "application/json"}
+
+
+class TestParseAccept(TestCase):
+    def test_empty(self):
+        self.assertEqual(parse_accept(""), [])
+
+    def test_order(self):
+        self.assertEqual(
+            parse_accept("deflate, gzip"), ["deflate", "gzip"])
+
+    def test_quality(self):
+        self.assertEqual(
+            parse_accept("deflate;q=0.5, gzip, br;q=0"),
+            ["gzip", "deflate"])
+
+    def test_invalid_quality(self):
+        self.assertEqual(parse_accept("gzip;q=foo"), [])
+
+
+class TestCompressedContentEncoding(TestCase):
+    def test_gzip(self):
+        transform = CompressedContentEncoding(
+            DummyRequest("gzip"), min_size=0)
+        status, headers, chunk = transform.transform_first_chunk(
+            200, json_headers(), "a" * 100, True)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertEqual(
+            zlib.decompress(chunk, 16 + zlib.MAX_WBITS), "a" * 100)
+
+    def test_deflate(self):
+        transform = CompressedContentEncoding(
+            DummyRequest("deflate"), min_size=0)
+        status, headers, chunk = transform.transform_first_chunk(
+            200, json_headers(), "a" * 100, True)
+        self.assertEqual(headers["Content-Encoding"], "deflate")
+        self.assertEqual(zlib.decompress(chunk), "a" * 100)
+
+    def test_streamed(self):
+        transform = CompressedContentEncoding(
+            DummyRequest("gzip"), min_size=1000)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        status, headers, chunk = transform.transform_first_chunk(
+            200, json_headers(), "first\n", False)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        # Each chunk can be decompressed as soon as it arrives.
+        self.assertEqual(decompressor.decompress(chunk), "first\n")
+        chunk = transform.transform_chunk("second\n", False)
+        self.assertEqual(decompressor.decompress(chunk), "second\n")
+        chunk = transform.transform_chunk("", True)
+        self.assertEqual(decompressor.decompress(chunk), "")
+        self.assertEqual(decompressor.unused_data, "")
+
+    def test_content_length(self):
+        transform = CompressedContentEncoding(
+            DummyRequest("gzip"), min_size=0)
+        headers = json_headers()
+        headers["Content-Length"] = "100"
+        status, headers, chunk = transform.transform_first_chunk(
+            200, headers, "a" * 100, True)
+        self.assertEqual(headers["Content-Length"], str(len(chunk)))
+
+    def test_below_min_size(self):
+        transform = CompressedContentEncoding(
+            DummyRequest("gzip"), min_size=100)
+        status, headers, chunk = transform.transform_first_chunk(
+            200, json_headers(), "a" * 99, True)
+        self.assertTrue("Content-Encoding" not in headers)
+        self.assertEqual(chunk, "a" * 99)
+
+    def test_not_accepted(self):
+        transform = CompressedContentEncoding(DummyRequest(), min_size=0)
+        status, headers, chunk = transform.transform_first_chunk(
+            200, json_headers(), "a" * 100, True)
+        self.assertTrue("Content-Encoding" not in headers)
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+
+    def test_other_content_type(self):
+        transform = CompressedContentEncoding(
+            DummyRequest("gzip"), min_size=0)
+        status, headers, chunk = transform.transform_first_chunk(
+            200, {"Content-Type": "image/png"}, "a" * 100, True)
+        self.assertTrue("Content-Encoding" not in headers)
+
+    def test_head(self):
+        transform = CompressedContentEncoding(
+            DummyRequest("gzip", method="HEAD"), min_size=0)
+        status, headers, chunk = transform.transform_first_chunk(
+            200, json_headers(), "a" * 100, True)
+        self.assertTrue("Content-Encoding" not in headers)
+
+
+class TestCompressedResponses(TestCase):
+    def mk_app(self, **settings):
+        collection = InMemoryCollection(
+            dict(("obj%d" % i, {"n": i}) for i in range(200)))
+
+        class App(ApiApplication):
+            collections = (('/root', lambda: collection),)
+
+        return App(**settings)
+
+    @inlineCallbacks
+    def get(self, app, path, headers):
+        """
+        Make a request without the response decoding treq does.
+        """
+        server = reactor.listenTCP(0, app, interface="127.0.0.1")
+        self.addCleanup(server.stopListening)
+        pool = HTTPConnectionPool(reactor, persistent=False)
+        url = "http://127.0.0.1:%d%s" % (server.getHost().port, path)
+        response = yield Agent(reactor, pool=pool).request(
+            "GET", url, Headers(headers))
+        body = yield readBody(response)
+        returnValue((response, body))
+
+    @inlineCallbacks
+    def test_listing_compressed(self):
+        app = self.mk_app(compression_min_size=0)
+        response, body = yield self.get(
+            app, '/root', {'Accept-Encoding': ['gzip']})
+        self.assertEqual(
+            response.headers.getRawHeaders('Content-Encoding'), ['gzip'])
+        lines = zlib.decompress(body, 16 + zlib.MAX_WBITS).splitlines()
+        self.assertEqual(len(lines), 200)
+
+    @inlineCallbacks
+    def test_compression_disabled(self):
+        app = self.mk_app(compression_level=None)
+        response, body = yield self.get(
+            app, '/root', {'Accept-Encoding': ['gzip']})
+        self.assertEqual(
+            response.headers.getRawHeaders('Content-Encoding'), None)
+        self.assertEqual(len(body.splitlines()), 200)
@@ -0,0 +1,137 @@
+import json
+
+from twisted.trial.unittest import SkipTest, TestCase
+
+from go_store_service import encoding
+from go_store_service.encoding import (
+    RawJson, data_size, data_version, frame, iter_frames, json_dumps,
+    msgpack_available, msgpack_dumps, msgpack_loads, object_version,
+    ujson_is_lossless)
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class TestJsonDumps(TestCase):
+    def test_dumps(self):
+        self.patch(encoding, "ujson", None)
+        self.assertEqual(json_dumps({"a": [1, "b"]}), '{"a": [1, "b"]}')
+
+    def test_dumps_escapes_close_tags(self):
+        self.patch(encoding, "ujson", None)
+        self.assertEqual(json_dumps("</script>"), '"<\\/script>"')
+
+    def test_dumps_floats(self):
+        # Whichever encoder was chosen on import must not round floats.
+        floats = [0.1, 1 / 3.0, 1e-20, 1e300, -2.5]
+        self.assertEqual(json.loads(json_dumps(floats)), floats)
+
+    def test_lossless_ujson_check(self):
+        class LosslessUJson(object):
+            def dumps(self, obj, escape_forward_slashes=True):
+                return json.dumps(obj)
+
+        class RoundingUJson(object):
+            def dumps(self, obj, **kw):
+                return json.dumps([round(f, 9) for f in obj])
+
+        class OldUJson(object):
+            def dumps(self, obj, escape_forward_slashes=True):
+                raise TypeError("Unknown option.")
+
+        self.assertEqual(ujson_is_lossless(LosslessUJson()), True)
+        self.assertEqual(ujson_is_lossless(RoundingUJson()), False)
+        self.assertEqual(ujson_is_lossless(OldUJson()), False)
+
+
+class TestJsonDumpsUJson(TestCase):
+    if ujson is None:
+        skip = "ujson is not installed."
+
+    def setUp(self):
+        # The real module is used even if it isn't lossless, so that these
+        # tests show whether the installed version would be safe to use.
+        self.patch(encoding, "ujson", ujson)
+
+    def assert_round_trip(self, obj):
+        self.assertEqual(json.loads(json_dumps(obj)), obj)
+
+    def test_floats(self):
+        if not ujson_is_lossless(ujson):
+            raise SkipTest("The installed ujson rounds floats.")
+        self.assert_round_trip([0.1, 1 / 3.0, 1e-20, 1e300, -2.5])
+
+    def test_close_tags(self):
+        self.assertEqual(json_dumps(u"</script> a/b"), '"<\\/script> a/b"')
+
+    def test_non_ascii(self):
+        self.assert_round_trip({u"name": u"caf\xe9 \u2603"})
+
+
+class TestMsgpack(TestCase):
+    if not msgpack_available():
+        skip = "msgpack is not installed."
+
+    def test_round_trip(self):
+        obj = {u"id": u"obj1", u"data": {u"values": [1, 2.5, None, True]}}
+        self.assertEqual(msgpack_loads(msgpack_dumps(obj)), obj)
+
+    def test_loads_unicode(self):
+        self.assertEqual(msgpack_loads(msgpack_dumps(u"caf\xe9")), u"caf\xe9")
+
+    def test_loads_invalid(self):
+        self.assertRaises(ValueError, msgpack_loads, "\xc1")
+        self.assertRaises(ValueError, msgpack_loads, "\x01\x02")
+
+
+class TestFrames(TestCase):
+    def test_frame(self):
+        self.assertEqual(frame("abc"), "\x00\x00\x00\x03abc")
+
+    def test_iter_frames(self):
+        data = frame("abc") + frame("") + frame("de")
+        self.assertEqual(list(iter_frames(data)), ["abc", "", "de"])
+
+    def test_iter_frames_empty(self):
+        self.assertEqual(list(iter_frames("")), [])
+
+    def test_iter_frames_truncated(self):
+        self.assertRaises(ValueError, list, iter_frames(frame("abc")[:-1]))
+        self.assertRaises(ValueError, list, iter_frames("\x00\x00"))
+
+
+class TestRawJson(TestCase):
+    def test_for_object(self):
+        raw = RawJson.for_object("obj1", '{"foo": "bar"}')
+        self.assertEqual(raw.encoded, '{"id": "obj1", "data": {"foo": "bar"}}')
+
+    def test_decode(self):
+        raw = RawJson('{"id": "obj1", "data": null}')
+        self.assertEqual(raw.decode(), {"id": "obj1", "data": None})
+
+
+class TestVersions(TestCase):
+    def test_data_version(self):
+        self.assertEqual(
+            data_version({"a": 1, "b": [2]}),
+            data_version({"b": [2], "a": 1}))
+        self.assertNotEqual(data_version({"a": 1}), data_version({"a": 2}))
+
+    def test_object_version(self):
+        self.assertEqual(
+            object_version({"id": "obj1", "data": {"a": 1}}),
+            data_version({"a": 1}))
+
+    def test_object_version_raw(self):
+        raw = RawJson('{"id": "obj1", "data": {"a": 1}}')
+        self.assertEqual(object_version(raw), data_version({"a": 1}))
+        raw.version = "v1"
+        self.assertEqual(object_version(raw), "v1")
+
+
+class TestDataSize(TestCase):
+    def test_data_size(self):
+        self.assertEqual(data_size({"a": 1}), len(json_dumps({"a": 1})))
+        self.assertEqual(data_size(None), 4)
@@ -0,0 +1,297 @@
+import os
+import socket
+
+from twisted.internet import reactor
+from twisted.internet.error import ProcessTerminated
+from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.task import Clock
+from twisted.python import usage
+from twisted.python.failure import Failure
+from twisted.trial.unittest import TestCase
+
+import treq
+
+from go_store_service.launcher import (
+    HealthHandler, Options, Supervisor, Worker, WorkerStartupFailed,
+    make_listening_socket)
+from go_store_service.server import StoreServer
+from go_store_service.tests.helpers import AppHelper
+
+
+class FakeProcessTransport(object):
+    def __init__(self, pid):
+        self.pid = pid
+        self.signals = []
+
+    def signalProcess(self, name):
+        self.signals.append(name)
+
+
+class FakeReactor(Clock):
+    """
+    Clock that records spawned processes instead of starting them.
+    """
+
+    def __init__(self):
+        Clock.__init__(self)
+        self.spawned = []
+
+    def spawnProcess(self, protocol, executable, args, env, childFDs):
+        transport = FakeProcessTransport(1000 + len(self.spawned))
+        self.spawned.append((protocol, args, childFDs))
+        protocol.makeConnection(transport)
+        return transport
+
+
+class FakeSocket(object):
+    def fileno(self):
+        return 7
+
+
+class FakePort(object):
+    stopped = False
+
+    def stopListening(self):
+        self.stopped = True
+        return succeed(None)
+
+
+class TestMakeListeningSocket(TestCase):
+    def test_listening(self):
+        sock = make_listening_socket("127.0.0.1", 0)
+        self.addCleanup(sock.close)
+        host, port = sock.getsockname()
+        self.assertEqual(host, "127.0.0.1")
+        self.assertNotEqual(port, 0)
+        self.assertEqual(sock.gettimeout(), 0.0)
+
+
+class TestSupervisor(TestCase):
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.supervisor = Supervisor(
+            self.reactor, FakeSocket(), 2, ["python", "worker"],
+            restart_delay=1, heartbeat_timeout=10, startup_timeout=20,
+            stop_timeout=5)
+
+    def heartbeat(self, worker):
+        worker.childDataReceived(4, "ok\n")
+
+    def end(self, worker):
+        worker.processEnded(Failure(ProcessTerminated(signal=15)))
+
+    def test_start(self):
+        self.supervisor.start()
+        self.assertEqual(len(self.supervisor.workers), 2)
+        [(_, args, child_fds), _] = self.reactor.spawned
+        self.assertEqual(args, ["python", "worker"])
+        self.assertEqual(child_fds, {0: 0, 1: 1, 2: 2, 3: 7, 4: "r"})
+
+    def test_status(self):
+        self.supervisor.start()
+        [worker1, worker2] = self.supervisor.workers
+        self.heartbeat(worker1)
+        status = self.supervisor.status()
+        self.assertEqual(status["healthy"], False)
+        self.assertEqual(status["ready"], 1)
+        self.heartbeat(worker2)
+        self.assertEqual(self.supervisor.status()["healthy"], True)
+        self.assertEqual(self.supervisor.status()["workers"][0], {
+            "pid": 1000, "ready": True, "started": 0, "last_heartbeat": 0,
+        })
+
+    def test_worker_exit_restarts(self):
+        self.supervisor.start()
+        [worker1, worker2] = self.supervisor.workers
+        self.end(worker1)
+        self.assertEqual(self.supervisor.workers, [worker2])
+        self.reactor.advance(1)
+        self.assertEqual(len(self.supervisor.workers), 2)
+        self.assertEqual(self.supervisor.restarts, 1)
+
+    def test_missed_heartbeat(self):
+        self.supervisor.start()
+        [worker1, worker2] = self.supervisor.workers
+        self.heartbeat(worker1)
+        self.heartbeat(worker2)
+        self.reactor.advance(5)
+        self.heartbeat(worker2)
+        self.reactor.advance(10)
+        self.assertEqual(worker1.transport.signals, ["KILL"])
+        self.assertEqual(worker2.transport.signals, [])
+
+    def test_startup_timeout(self):
+        self.supervisor.start()
+        [worker1, worker2] = self.supervisor.workers
+        for _ in range(4):
+            self.heartbeat(worker1)
+            self.reactor.advance(5)
+        self.assertEqual(worker2.transport.signals, [])
+        self.heartbeat(worker1)
+        self.reactor.advance(5)
+        self.assertEqual(worker1.transport.signals, [])
+        self.assertEqual(worker2.transport.signals, ["KILL"])
+        self.end(worker2)
+        self.reactor.advance(1)
+        self.assertEqual(len(self.supervisor.workers), 2)
+        self.assertEqual(self.supervisor.restarts, 1)
+
+    def test_restart_with_hung_worker(self):
+        """
+        A replacement that never becomes ready is killed, and the restart
+        is abandoned.
+        """
+        self.supervisor.start()
+        [worker1, worker2] = self.supervisor.workers
+        self.heartbeat(worker1)
+        self.heartbeat(worker2)
+        d = self.supervisor.restart()
+        [worker3] = self.supervisor.workers[2:]
+        for _ in range(5):
+            self.reactor.advance(5)
+            self.heartbeat(worker1)
+            self.heartbeat(worker2)
+        self.assertEqual(worker3.transport.signals, ["KILL"])
+        self.end(worker3)
+        self.successResultOf(d)
+        self.assertEqual(len(self.flushLoggedErrors(WorkerStartupFailed)), 1)
+        self.assertEqual(worker1.transport.signals, [])
+        self.assertEqual(self.supervisor.workers, [worker1, worker2])
+
+    def test_restart_abandoned(self):
+        """
+        If a replacement exits before it's ready, the worker it was to
+        replace is left running and no other workers are replaced.
+        """
+        self.supervisor.start()
+        [worker1, worker2] = self.supervisor.workers
+        d = self.supervisor.restart()
+        [worker3] = self.supervisor.workers[2:]
+        self.end(worker3)
+        self.successResultOf(d)
+        self.assertEqual(len(self.flushLoggedErrors(WorkerStartupFailed)), 1)
+        self.assertEqual(worker1.transport.signals, [])
+        self.assertEqual(worker2.transport.signals, [])
+        self.reactor.advance(10)
+        self.assertEqual(self.supervisor.workers, [worker1, worker2])
+        self.assertEqual(len(self.reactor.spawned), 3)
+
+    def test_restart(self):
+        self.supervisor.start()
+        [worker1, worker2] = self.supervisor.workers
+        d = self.supervisor.restart()
+        [worker3] = self.supervisor.workers[2:]
+        self.assertEqual(worker1.transport.signals, [])
+        self.heartbeat(worker3)
+        self.assertEqual(worker1.transport.signals, ["TERM"])
+        self.end(worker1)
+        [worker4] = self.supervisor.workers[2:]
+        self.heartbeat(worker4)
+        self.assertEqual(worker2.transport.signals, ["TERM"])
+        self.end(worker2)
+        self.successResultOf(d)
+        self.assertEqual(self.supervisor.workers, [worker3, worker4])
+        self.reactor.advance(10)
+        self.assertEqual(len(self.reactor.spawned), 4)
+
+    def test_stop(self):
+        self.supervisor.start()
+        [worker1, worker2] = self.supervisor.workers
+        d = self.supervisor.stop()
+        self.assertEqual(worker1.transport.signals, ["TERM"])
+        self.assertEqual(worker2.transport.signals, ["TERM"])
+        self.end(worker1)
+        self.reactor.advance(5)
+        self.assertEqual(worker1.transport.signals, ["TERM"])
+        self.assertEqual(worker2.transport.signals, ["TERM", "KILL"])
+        self.end(worker2)
+        self.successResultOf(d)
+        self.reactor.advance(10)
+        self.assertEqual(self.supervisor.workers, [])
+
+
+class TestHealthHandler(TestCase):
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.supervisor = Supervisor(
+            self.reactor, FakeSocket(), 1, ["python", "worker"])
+        self.app_helper = AppHelper(
+            urlspec=HealthHandler.mk_urlspec(self.supervisor))
+
+    @inlineCallbacks
+    def test_healthy(self):
+        self.supervisor.start()
+        self.supervisor.workers[0].childDataReceived(4, "ok\n")
+        response = yield self.app_helper.get('/health')
+        self.assertEqual(response.code, 200)
+        data = yield self.app_helper._parse_json(response)
+        self.assertEqual(data["healthy"], True)
+
+    @inlineCallbacks
+    def test_unhealthy(self):
+        self.supervisor.start()
+        response = yield self.app_helper.get('/health')
+        self.assertEqual(response.code, 503)
+
+
+class TestWorker(TestCase):
+    @inlineCallbacks
+    def test_serve(self):
+        sock = make_listening_socket("127.0.0.1", 0)
+        self.addCleanup(sock.close)
+        port = sock.getsockname()[1]
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+
+        worker = Worker(
+            reactor, StoreServer(), os.dup(sock.fileno()), write_fd,
+            family=socket.AF_INET, grace_period=0)
+        worker.start()
+        self.assertEqual(os.read(read_fd, 3), "ok\n")
+
+        response = yield treq.get(
+            "http://127.0.0.1:%d/me/stores" % (port,), persistent=False)
+        self.assertEqual(response.code, 200)
+        yield treq.content(response)
+        yield worker.stop()
+        self.assertEqual(worker._heartbeat.running, False)
+
+    def test_stop_stops_app(self):
+        clock = Clock()
+        app = StoreServer()
+        stopped = []
+        self.patch(app, 'stop', lambda: stopped.append(clock.seconds()))
+        worker = Worker(clock, app, None, grace_period=5)
+        worker.port = FakePort()
+        d = worker.stop()
+        self.assertEqual(worker.port.stopped, True)
+        self.assertEqual(stopped, [])
+        clock.advance(5)
+        self.successResultOf(d)
+        self.assertEqual(stopped, [5])
+
+
+class TestOptions(TestCase):
+    def test_defaults(self):
+        options = Options()
+        options.parseOptions([])
+        self.assertTrue(options["workers"] >= 1)
+        self.assertEqual(options["worker-family"], None)
+
+    def test_no_workers(self):
+        options = Options()
+        self.assertRaises(
+            usage.UsageError, options.parseOptions, ["--workers", "0"])
+
+    def test_worker_args(self):
+        options = Options()
+        options.parseOptions(["--grace-period", "2"])
+        args = options.worker_args(socket.AF_INET)
+        self.assertEqual(args[1:], [
+            "-m", "go_store_service.launcher",
+            "--app", "go_store_service.server.StoreServer",
+            "--grace-period", "2.0",
+            "--heartbeat-timeout", "10.0",
+            "--worker-family", str(socket.AF_INET),
+        ])
@@ -0,0 +1,79 @@
+from twisted.trial.unittest import TestCase
+
+from go_store_service.metrics import Counter, Histogram, MetricsRegistry
+
+
+class TestCounter(TestCase):
+    def test_inc(self):
+        counter = Counter("requests", "Requests.", ("method",))
+        counter.inc(labels=("GET",))
+        counter.inc(2, labels=("GET",))
+        self.assertEqual(counter.value(("GET",)), 3)
+        self.assertEqual(counter.value(("PUT",)), 0)
+
+    def test_render_samples(self):
+        counter = Counter("requests", "Requests.", ("method",))
+        counter.inc(labels=("GET",))
+        counter.inc(labels=('"x"\n',))
+        self.assertEqual(list(counter.render_samples()), [
+            u'requests{method="\\"x\\"\\n"} 1.0',
+            u'requests{method="GET"} 1.0',
+        ])
+
+    def test_render_samples_no_labels(self):
+        counter = Counter("requests", "Requests.")
+        counter.inc()
+        self.assertEqual(list(counter.render_samples()), [u'requests 1.0'])
+
+
+class TestHistogram(TestCase):
+    def test_observe(self):
+        histogram = Histogram("latency", "Latency.", buckets=(1, 2))
+        histogram.observe(0.5)
+        histogram.observe(2)
+        histogram.observe(3)
+        self.assertEqual(histogram.count(), 3)
+        self.assertEqual(histogram.count(("other",)), 0)
+
+    def test_render_samples(self):
+        histogram = Histogram(
+            "latency", "Latency.", ("route",), buckets=(1, 2))
+        histogram.observe(0.5, ("/a",))
+        histogram.observe(2, ("/a",))
+        histogram.observe(3, ("/a",))
+        self.assertEqual(list(histogram.render_samples()), [
+            u'latency_bucket{route="/a",le="1.0"} 1.0',
+            u'latency_bucket{route="/a",le="2.0"} 2.0',
+            u'latency_bucket{route="/a",le="+Inf"} 3.0',
+            u'latency_sum{route="/a"} 5.5',
+            u'latency_count{route="/a"} 3.0',
+        ])
+
+
+class TestMetricsRegistry(TestCase):
+    def test_metrics_are_shared(self):
+        metrics = MetricsRegistry()
+        counter = metrics.counter("requests", "Requests.")
+        self.assertTrue(metrics.counter("requests", "Requests.") is counter)
+
+    def test_metric_type_mismatch(self):
+        metrics = MetricsRegistry()
+        metrics.counter("requests", "Requests.")
+        self.assertRaises(
+            ValueError, metrics.histogram, "requests", "Requests.")
+
+    def test_render(self):
+        metrics = MetricsRegistry()
+        metrics.counter("b_total", "B.").inc()
+        metrics.histogram("a_seconds", "A.", buckets=(1,)).observe(0.5)
+        self.assertEqual(metrics.render(), "\n".join([
+            "# HELP a_seconds A.",
+            "# TYPE a_seconds histogram",
+            'a_seconds_bucket{le="1.0"} 1.0',
+            'a_seconds_bucket{le="+Inf"} 1.0',
+            "a_seconds_sum 0.5",
+            "a_seconds_count 1.0",
+            "# HELP b_total B.",
+            "# TYPE b_total counter",
+            "b_total 1.0",
+        ]) + "\n")
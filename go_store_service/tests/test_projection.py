@@ -0,0 +1,75 @@
+from twisted.trial.unittest import TestCase
+
+from go_store_service.encoding import RawJson
+from go_store_service.projection import parse_fields, project, project_object
+
+
+class TestParseFields(TestCase):
+    def test_fields(self):
+        self.assertEqual(
+            parse_fields("name, address.city"), ["name", "address.city"])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse_fields, "")
+        self.assertRaises(ValueError, parse_fields, "name,")
+        self.assertRaises(ValueError, parse_fields, "address..city")
+        self.assertRaises(ValueError, parse_fields, ".name")
+
+
+class TestProject(TestCase):
+    def setUp(self):
+        self.data = {
+            "name": "foo",
+            "address": {"city": "bar", "street": "baz"},
+            "tags": ["a", "b"],
+        }
+
+    def test_no_fields(self):
+        self.assertTrue(project(self.data, None) is self.data)
+
+    def test_top_level(self):
+        self.assertEqual(
+            project(self.data, ["name", "tags"]),
+            {"name": "foo", "tags": ["a", "b"]})
+
+    def test_nested(self):
+        self.assertEqual(
+            project(self.data, ["address.city"]),
+            {"address": {"city": "bar"}})
+
+    def test_overlapping(self):
+        address = {"city": "bar", "street": "baz"}
+        self.assertEqual(
+            project(self.data, ["address.city", "address"]),
+            {"address": address})
+        self.assertEqual(
+            project(self.data, ["address", "address.city"]),
+            {"address": address})
+
+    def test_missing(self):
+        self.assertEqual(
+            project(self.data, ["missing", "name.first", "address.zip"]),
+            {"address": {}})
+
+    def test_not_a_dict(self):
+        self.assertEqual(project("foo", ["name"]), {})
+
+    def test_values_not_copied(self):
+        self.assertTrue(
+            project(self.data, ["tags"])["tags"] is self.data["tags"])
+
+
+class TestProjectObject(TestCase):
+    def test_dict(self):
+        obj = {"id": "obj1", "data": {"a": 1, "b": 2}}
+        self.assertEqual(
+            project_object(obj, ["a"]), {"id": "obj1", "data": {"a": 1}})
+        self.assertTrue(project_object(obj, None) is obj)
+
+    def test_raw_json(self):
+        obj = RawJson('{"id": "obj1", "data": {"a": 1, "b": 2}}')
+        self.assertEqual(
+            project_object(obj, ["b"]), {"id": "obj1", "data": {"b": 2}})
+
+    def test_none(self):
+        self.assertEqual(project_object(None, ["a"]), None)
@@ -0,0 +1,78 @@
+from twisted.trial.unittest import TestCase
+
+from go_store_service.query import Condition, Query
+
+
+class TestCondition(TestCase):
+    def test_parse(self):
+        self.assertEqual(
+            Condition.parse('status == "active"'),
+            Condition("status", "==", "active"))
+        self.assertEqual(
+            Condition.parse("age>=18"), Condition("age", ">=", 18))
+        self.assertEqual(
+            Condition.parse("address.city ^= Cape"),
+            Condition("address.city", "^=", "Cape"))
+        self.assertEqual(
+            Condition.parse("flag == true"), Condition("flag", "==", True))
+        self.assertEqual(
+            Condition.parse("name == "), Condition("name", "==", ""))
+
+    def test_parse_invalid(self):
+        self.assertRaises(ValueError, Condition.parse, "status")
+        self.assertRaises(ValueError, Condition.parse, "== 1")
+        self.assertRaises(ValueError, Condition.parse, "a..b == 1")
+        self.assertRaises(ValueError, Condition.parse, "a != 1")
+
+    def test_equal(self):
+        condition = Condition("status", "==", "active")
+        self.assertTrue(condition.matches({"status": "active"}))
+        self.assertFalse(condition.matches({"status": "inactive"}))
+        self.assertFalse(condition.matches({}))
+        self.assertFalse(condition.matches("active"))
+
+    def test_equal_kinds(self):
+        self.assertTrue(Condition("n", "==", 1).matches({"n": 1.0}))
+        self.assertFalse(Condition("n", "==", 1).matches({"n": True}))
+        self.assertFalse(Condition("n", "==", True).matches({"n": 1}))
+        self.assertTrue(Condition("n", "==", None).matches({"n": None}))
+        self.assertTrue(Condition("n", "==", [1]).matches({"n": [1]}))
+
+    def test_range(self):
+        self.assertTrue(Condition("n", "<", 2).matches({"n": 1}))
+        self.assertFalse(Condition("n", "<", 2).matches({"n": 2}))
+        self.assertTrue(Condition("n", "<=", 2).matches({"n": 2}))
+        self.assertTrue(Condition("n", ">", 2).matches({"n": 2.5}))
+        self.assertFalse(Condition("n", ">=", 2).matches({"n": 1}))
+        self.assertTrue(Condition("s", ">=", "b").matches({"s": "c"}))
+
+    def test_range_kinds(self):
+        self.assertFalse(Condition("n", "<", 2).matches({"n": "1"}))
+        self.assertFalse(Condition("n", ">", 0).matches({"n": True}))
+        self.assertFalse(Condition("n", ">", 0).matches({"n": None}))
+        self.assertFalse(Condition("n", "<", "b").matches({"n": 1}))
+
+    def test_prefix(self):
+        condition = Condition("address.city", "^=", "Cape")
+        self.assertTrue(condition.matches(
+            {"address": {"city": "Cape Town"}}))
+        self.assertFalse(condition.matches(
+            {"address": {"city": "Durban"}}))
+        self.assertFalse(condition.matches({"address": "Cape Town"}))
+        self.assertFalse(Condition("n", "^=", "1").matches({"n": 12}))
+
+
+class TestQuery(TestCase):
+    def test_parse(self):
+        query = Query.parse(["a == 1", "b < 2"])
+        self.assertEqual(query.conditions, [
+            Condition("a", "==", 1), Condition("b", "<", 2)])
+
+    def test_parse_empty(self):
+        self.assertRaises(ValueError, Query.parse, [])
+
+    def test_matches_all(self):
+        query = Query.parse(["a == 1", "b < 2"])
+        self.assertTrue(query.matches({"a": 1, "b": 1}))
+        self.assertFalse(query.matches({"a": 1, "b": 2}))
+        self.assertFalse(query.matches({"a": 2, "b": 1}))
@@ -0,0 +1,86 @@
+from twisted.trial.unittest import TestCase
+
+from go_store_service.interfaces import SchemaViolation
+from go_store_service.query import Query
+from go_store_service.schema import Schema
+
+
+class TestSchema(TestCase):
+    def test_from_store_data(self):
+        schema = Schema.from_store_data({"schema": {
+            "status": {"type": "string", "index": True},
+            "age": {"type": "integer", "index": True},
+            "notes": {"type": "text"},
+        }})
+        self.assertEqual(
+            schema.indexes, {"status": "string", "age": "integer"})
+
+    def test_from_store_data_no_schema(self):
+        self.assertEqual(Schema.from_store_data({}), Schema())
+        self.assertEqual(Schema.from_store_data("foo"), Schema())
+        self.assertEqual(Schema.from_store_data({"schema": None}), Schema())
+
+    def test_without(self):
+        schema = Schema({"s": "string", "n": "integer"})
+        self.assertEqual(schema.without({"n": "integer"}), Schema({
+            "s": "string"}))
+        self.assertEqual(schema.without([]), schema)
+
+    def test_from_store_data_invalid(self):
+        for schema in [
+                [], {"a": "string"}, {"a": {"type": "float", "index": True}},
+                {"a..b": {"type": "string", "index": True}},
+                {"a/b": {"type": "string", "index": True}}]:
+            self.assertRaises(
+                SchemaViolation, Schema.from_store_data, {"schema": schema})
+
+    def test_index_entries(self):
+        schema = Schema({"a.b": "string", "n": "integer", "m": "integer"})
+        self.assertEqual(
+            schema.index_entries({"a": {"b": u"caf\xe9"}, "n": 1, "m": None}),
+            ["a.b/caf\xc3\xa9", "n/%020d" % (2 ** 63 + 1,)])
+        self.assertEqual(schema.index_entries({"a": "b"}), [])
+        self.assertEqual(schema.index_entries("foo"), [])
+
+    def test_index_entries_wrong_type(self):
+        schema = Schema({"n": "integer"})
+        for value in ["1", 1.5, True, 2 ** 63, [1]]:
+            self.assertRaises(
+                SchemaViolation, schema.index_entries, {"n": value})
+            self.assertEqual(
+                schema.index_entries({"n": value}, strict=False), [])
+
+    def test_integer_entries_sorted(self):
+        schema = Schema({"n": "integer"})
+        values = [-2 ** 63, -10, -1, 0, 1, 9, 10, 2 ** 63 - 1]
+        entries = [schema.index_entries({"n": n}) for n in values]
+        self.assertEqual(sorted(entries), entries)
+
+    def test_index_range(self):
+        schema = Schema({"s": "string", "n": "integer"})
+
+        def n(value):
+            return "n/%020d" % (2 ** 63 + value,)
+
+        self.assertEqual(
+            schema.index_range(Query.parse(["s == foo"])),
+            ("s/foo", "s/foo"))
+        self.assertEqual(
+            schema.index_range(Query.parse(["n > 5"])), (n(5), "n/\xff"))
+        self.assertEqual(
+            schema.index_range(Query.parse(["n <= 5"])), ("n/", n(5)))
+        self.assertEqual(
+            schema.index_range(Query.parse(["s ^= foo"])),
+            ("s/foo", "s/foo\xff"))
+
+    def test_index_range_prefers_equality(self):
+        schema = Schema({"s": "string", "n": "integer"})
+        self.assertEqual(
+            schema.index_range(Query.parse(["n > 5", "s == foo"])),
+            ("s/foo", "s/foo"))
+
+    def test_index_range_not_indexed(self):
+        schema = Schema({"s": "string", "n": "integer"})
+        for condition in ["x == 1", "s == 1", "n == 1.5", "n ^= 1"]:
+            self.assertEqual(
+                schema.index_range(Query.parse([condition])), None)
@@ -1,7 +1,16 @@
-from unittest import TestCase
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
 
-from go_store_service.collections import InMemoryCollectionBackend
+from go_store_service.api_handler import DeletionStatusHandler
+from go_store_service.collections import (
+    InMemoryCollectionBackend, CachedCollectionBackend,
+    CascadingCollectionBackend, CoalescingCollectionBackend,
+    InstrumentedCollectionBackend, StatsCollectionBackend)
+from go_store_service.collections.cascading import DeletionJobs
+from go_store_service.metrics import MetricsRegistry
 from go_store_service.server import StoreServer
+from go_store_service.tests.helpers import AppHelper
 
 
 class TestStoreServer(TestCase):
@@ -9,6 +18,93 @@ class TestStoreServer(TestCase):
         backend = InMemoryCollectionBackend({})
         api = StoreServer(backend=backend)
         self.assertEqual(api.collections, (
-            ("/:owner_id/stores", backend.get_store_collection),
-            ("/:owner_id/stores/:store_id/keys", backend.get_row_collection),
+            ("/:owner_id/stores", api.backend.get_store_collection),
+            ("/:owner_id/stores/:store_id/keys",
+             api.backend.get_row_collection),
         ))
+
+    def test_cascading_deletes(self):
+        backend = InMemoryCollectionBackend({})
+        jobs = DeletionJobs()
+        api = StoreServer(backend=backend, deletion_jobs=jobs)
+        self.assertTrue(isinstance(api.backend, CascadingCollectionBackend))
+        self.assertEqual(api.backend.backend.backend, backend)
+        self.assertEqual(api.backend.jobs, jobs)
+        [deletion_route] = [
+            route for route in api._build_routes()
+            if route.handler_class is DeletionStatusHandler]
+        self.assertEqual(deletion_route.kwargs["jobs"], jobs)
+
+    def test_store_stats(self):
+        backend = InMemoryCollectionBackend({})
+        api = StoreServer(backend=backend, cache_size=10)
+        stats = api.backend.backend
+        self.assertTrue(isinstance(stats, StatsCollectionBackend))
+        self.assertTrue(isinstance(stats.backend, CachedCollectionBackend))
+
+    def test_cache(self):
+        backend = InMemoryCollectionBackend({})
+        api = StoreServer(backend=backend, cache_size=10, cache_ttl=5)
+        cached = api.backend.backend.backend
+        self.assertTrue(isinstance(cached, CachedCollectionBackend))
+        self.assertEqual(cached.backend, backend)
+        self.assertEqual(cached.cache.max_size, 10)
+        self.assertEqual(cached.cache.ttl, 5)
+
+    def test_metrics(self):
+        backend = InMemoryCollectionBackend({})
+        metrics = MetricsRegistry()
+        api = StoreServer(backend=backend, metrics=metrics)
+        self.assertEqual(api.metrics, metrics)
+        self.assertTrue(isinstance(
+            api.backend.backend.backend, InstrumentedCollectionBackend))
+        self.assertEqual(api.backend.backend.backend.backend, backend)
+
+    @inlineCallbacks
+    def test_cache_metrics(self):
+        metrics = MetricsRegistry()
+        api = StoreServer(cache_size=1, metrics=metrics)
+        stores = api.backend.get_store_collection("me")
+        yield stores.create("a", {})
+        yield stores.create("b", {})
+        app_helper = AppHelper(app=api)
+        yield app_helper.get('/me/stores/a')
+        yield app_helper.get('/me/stores/a')
+        yield app_helper.get('/me/stores/b')
+        response = yield app_helper.get('/metrics')
+        body = yield app_helper._parse_bytes(response)
+        lines = body.splitlines()
+        self.assertTrue('store_cache_hits_total 1.0' in lines)
+        self.assertTrue('store_cache_misses_total 2.0' in lines)
+        self.assertTrue('store_cache_evictions_total 1.0' in lines)
+
+    def test_write_delay(self):
+        backend = InMemoryCollectionBackend({})
+        api = StoreServer(
+            backend=backend, write_delay=0.1, write_durability="queued")
+        coalescing = api.backend.backend.backend
+        self.assertTrue(isinstance(coalescing, CoalescingCollectionBackend))
+        self.assertEqual(coalescing.backend, backend)
+        self.assertEqual(coalescing.queue.delay, 0.1)
+        self.assertEqual(coalescing.durability, "queued")
+
+    def test_stop_flushes_queued_writes(self):
+        # The clock has no addSystemEventTrigger, so this also checks that
+        # the server doesn't register for shutdown itself.
+        clock = Clock()
+        data = {}
+        api = StoreServer(
+            backend=InMemoryCollectionBackend(data, reactor=clock),
+            write_delay=10, write_durability="queued", reactor=clock)
+        rows = api.backend.get_row_collection("me", "store")
+        rows.create("row", {"foo": "bar"})
+        clock.advance(0)
+        self.assertEqual(data["rows"]["me"].get("store", {}), {})
+
+        d = api.stop()
+        clock.advance(0)
+        self.assertEqual(data["rows"]["me"]["store"], {"row": {"foo": "bar"}})
+        self.successResultOf(d)
+
+    def test_stop_without_write_delay(self):
+        self.successResultOf(StoreServer().stop())
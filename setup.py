@@ -17,6 +17,12 @@ setup(
         'vumi>0.4',
         'cyclone',
     ],
+    extras_require={
+        # ujson releases before 2.0, the last of which support Python 2,
+        # round floats, so they aren't used.
+        'fast-json': ['ujson>=2.0; python_version >= "3"'],
+        'msgpack': ['msgpack'],
+    },
     classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',